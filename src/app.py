@@ -1,118 +1,590 @@
 import os
-import sqlite3
 import asyncio
 import logging
-import aiohttp
-import json
+import math
+import signal
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Any, AsyncIterator, List, Optional, Tuple
 from aiohttp import web
-from claim.claim import DonationTokenClaim
-from claim.claim_storage import ClaimStorage, SqlLiteClaimStorage
+from claim.async_claim_storage import AsyncClaimStorage, AsyncSqlLiteClaimStorage, SqlLitePragmas
+from claim.claim import CLAIM_MAX_LENGTH, DonationTokenClaim
+from claim.claim_events import ClaimEvents
+from claim.claim_filter import ClaimFilter
+from claim.claim_status_cache import ClaimStatusCache
+from claim.claim_storage import RecoveredCallbacks
+from claim.postgres_claim_storage import AsyncPostgresClaimStorage
+from claim.sql_database import AsyncpgDatabase
+from create_claim.admission import AdmissionController, TokenBucketLimiter
 from create_claim.create_claim_handler import CreateClaimApi, CreateClaimHandler
+from create_claim.create_pay_link import create_pay_link
+from create_claim.pay_link_pool import PayLinkPool
 
-from lnbits import LnBitsApi, LnBitsCallbackData
+from body_log import BodyLog
+from http_metrics import metrics_middleware
+from json_codec import dumps, parse_body
+from lnbits import CoalescingLnBitsApi, LnBitsApi, LnBitsCallbackData, create_ln_bits_session
+from loop_lag import LoopLagMonitor
+from metrics import CONTENT_TYPE, REGISTRY
+from profiler import SamplingProfiler
+from readiness import ReadinessProbe
 from settings import (
+    CALLBACK_MAX_ATTEMPTS,
+    CALLBACK_RETENTION,
+    CALLBACK_WORKERS,
+    CLAIM_FILTER_CAPACITY,
+    CLAIM_FILTER_ERROR_RATE,
+    CLAIM_MAX_CONCURRENCY,
+    CLAIM_MAX_QUEUE,
+    CLIENT_IP_HEADER,
+    DB_CACHE_SIZE,
+    DB_GROUP_COMMIT,
+    DB_MMAP_SIZE,
+    DB_PATH,
+    DB_POOL_SIZE,
+    DB_READERS,
+    DB_SYNCHRONOUS,
+    DB_URL,
+    DOMAIN,
     LN_BITS_API_KEY,
+    LN_BITS_BATCH_LIMIT,
+    LN_BITS_BATCH_WINDOW,
+    LN_BITS_CACHE_TTL,
+    LN_BITS_DNS_CACHE_TTL,
+    LN_BITS_KEEPALIVE_TIMEOUT,
+    LN_BITS_LNURL_URL,
+    LN_BITS_POOL_SIZE,
+    LN_BITS_POOL_SIZE_PER_HOST,
+    LN_BITS_RETRIES,
+    LN_BITS_TIMEOUT,
     LN_BITS_URL,
+    LOG_BODY_LIMIT,
+    LOG_BODY_SAMPLE_RATE,
+    LOG_LEVEL,
+    LONG_POLL_RECHECK,
+    LONG_POLL_TIMEOUT,
+    MAX_BODY_SIZE,
+    PAY_LINK_POOL_HIGH_WATERMARK,
+    PAY_LINK_POOL_LOW_WATERMARK,
     PORT,
     PRIVATE_KEY,
+    PRIVATE_KEY_ALGORITHM,
+    PRIVATE_KEY_ID,
+    PROFILER_INTERVAL,
+    RATE_LIMIT_BURST,
+    RATE_LIMIT_CLAIM_PREFIX,
+    RATE_LIMIT_KEYS,
+    RATE_LIMIT_RATE,
+    READY_TIMEOUT,
+    RETIRED_KEYS,
     SATS_AMOUNT,
+    SHUTDOWN_TIMEOUT,
+    SIGN_EXECUTOR,
+    SIGN_WORKERS,
+    STATUS_CACHE_SIZE,
+    STATUS_CACHE_TTL,
+    SWEEP_CALLS_PER_SECOND,
+    SWEEP_CONCURRENCY,
+    SWEEP_EXPIRE_AFTER,
+    SWEEP_INTERVAL,
+    SWEEP_MIN_AGE,
+    SWEEP_PAGE_SIZE,
+    SWEEP_PAYMENTS_LIMIT,
     URL_CLAIM,
     URL_PAYMENT_SUCCESS_CALLBACK,
+    URL_VERIFY_KEYS,
+    VERIFY_CHUNK_SIZE,
+    VERIFY_MAX_BODY_SIZE,
+    VERIFY_MAX_KEYS,
+    WEB_WORKERS,
 )
-from sign.sign import DonationKeySigner
+from sign.sign import DonationKeySigner, SigningKey, create_sign_executor, load_signing_key, load_signing_keys
 from success_callback.callback_handler import CallbackHandler
+from success_callback.callback_queue_worker import CallbackQueueWorker
+from success_callback.reconciliation_sweeper import ReconciliationSweeper
+from supervisor import Supervisor
+from verify_keys.verify_keys_handler import VerifyKeysApi, VerifyKeysHandler
 
 root = logging.getLogger()
-root.setLevel(logging.DEBUG)
+root.setLevel(LOG_LEVEL)
 
+ROOT_RESPONSE = dumps({"ok": True})
 
-if not os.path.exists(PRIVATE_KEY):
-    raise Exception(f"Private key {PRIVATE_KEY} not found")
 
-dirname = os.path.dirname(__file__)
+# Behind a proxy the client address is the last one the proxy appended to CLIENT_IP_HEADER
+def client_ip(request: web.Request) -> str:
+    forwarded = request.headers.get(CLIENT_IP_HEADER) if CLIENT_IP_HEADER else None
+    if forwarded:
+        return forwarded.split(",")[-1].strip()
 
+    return request.remote or ""
 
-async def run() -> None:
-    donation_key_signer = DonationKeySigner(PRIVATE_KEY)
+
+def rate_limited(retry_after: float) -> web.HTTPTooManyRequests:
+    return web.HTTPTooManyRequests(headers={"Retry-After": str(math.ceil(retry_after))})
+
+
+# For routes allowed larger bodies than client_max_size, read from the stream so the limit applies while reading
+async def read_body(request: web.Request, limit: int) -> bytes:
+    body = bytearray()
+    async for chunk in request.content.iter_any():
+        body.extend(chunk)
+        if len(body) > limit:
+            raise web.HTTPRequestEntityTooLarge(max_size=limit, actual_size=len(body))
+
+    return bytes(body)
+
+
+# One JSON object per line, so clients can process results before the last chunk is verified
+async def stream_json_lines(request: web.Request, lines: AsyncIterator[bytes]) -> web.StreamResponse:
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    async for line in lines:
+        await response.write(line)
+    await response.write_eof()
+
+    return response
+
+
+# Workers of other processes or replicas write to the same claims
+shared_storage = DB_URL != "" or WEB_WORKERS > 1
+
+
+sql_lite_pragmas = SqlLitePragmas(DB_SYNCHRONOUS, DB_MMAP_SIZE, DB_CACHE_SIZE)
+
+
+def log_recovered_callbacks(recovered: RecoveredCallbacks) -> None:
+    if recovered.recovered > 0:
+        logging.warning(f"Recovered {recovered.recovered} in-flight callbacks")
+    if recovered.failed > 0:
+        logging.error(f"{recovered.failed} callbacks taken {CALLBACK_MAX_ATTEMPTS} times failed")
+
+
+# Runs once before the workers start, so they don't race creating the tables. Webhooks left in flight by the last run
+# are recovered here too: a worker restarted by the supervisor would take back the ones its siblings are processing.
+def prepare_database() -> None:
+    started = time.perf_counter()
+
+    if DB_URL != "":
+
+        async def create_tables() -> None:
+            postgres_storage = AsyncPostgresClaimStorage(datetime.now, await AsyncpgDatabase.connect(DB_URL, 1, 1))
+            await postgres_storage.create_tables()
+            log_recovered_callbacks(await postgres_storage.recover_callbacks(CALLBACK_MAX_ATTEMPTS))
+            await postgres_storage.close()
+
+        asyncio.run(create_tables())
+        logging.info(f"Database ready in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return
+
+    sql_lite_storage = AsyncSqlLiteClaimStorage(datetime.now, DB_PATH, readers=1, pragmas=sql_lite_pragmas)
+    applied = sql_lite_storage.create_tables()
+    log_recovered_callbacks(asyncio.run(sql_lite_storage.recover_callbacks(CALLBACK_MAX_ATTEMPTS)))
+    sql_lite_storage.close()
+
+    logging.info(
+        f"Database ready in {(time.perf_counter() - started) * 1000:.1f} ms, {applied} migrations applied to {DB_PATH}"
+    )
+
+
+# Also once before the workers start: the keys are loaded and checked while the database is migrated, forked workers
+# inherit both the keys and their parsed backends
+def warm_up() -> Tuple[SigningKey, List[SigningKey]]:
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=3, thread_name_prefix="warm-up") as executor:
+        database = executor.submit(prepare_database)
+        active_key = executor.submit(load_signing_key, PRIVATE_KEY_ID, PRIVATE_KEY_ALGORITHM, PRIVATE_KEY)
+        retired_keys = executor.submit(load_signing_keys, RETIRED_KEYS)
+        database.result()
+        keys = active_key.result(), retired_keys.result()
+
+    logging.info(f"Warm-up done in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    return keys
+
+
+async def open_postgres_storage(status_cache: ClaimStatusCache) -> AsyncClaimStorage:
+    # The whole pool is connected now instead of by the first requests
+    database = await AsyncpgDatabase.connect(DB_URL, DB_POOL_SIZE, DB_POOL_SIZE)
+
+    return AsyncPostgresClaimStorage(datetime.now, database, status_cache)
+
+
+async def open_sql_lite_storage(
+    status_cache: ClaimStatusCache, claim_filter: Optional[ClaimFilter]
+) -> AsyncClaimStorage:
+    loop = asyncio.get_running_loop()
+
+    # Opening the connections and setting their PRAGMAs touches the file, off the event loop
+    return await loop.run_in_executor(
+        None,
+        lambda: AsyncSqlLiteClaimStorage(
+            datetime.now, DB_PATH, DB_READERS, DB_GROUP_COMMIT, status_cache, sql_lite_pragmas, claim_filter
+        ),
+    )
+
+
+# In the background, until it is loaded every lookup goes to the database
+async def load_claim_filter(storage: AsyncSqlLiteClaimStorage, claim_filter: ClaimFilter) -> None:
+    started = time.perf_counter()
+    loaded = await storage.load_claim_filter()
+    logging.info(
+        f"Claim filter loaded {loaded} claims in {(time.perf_counter() - started) * 1000:.1f} ms, "
+        + f"{claim_filter.memory_bytes / 1024:.0f} KiB, false positive rate {claim_filter.false_positive_rate:.4f}"
+    )
+
+
+# Opens the first pooled LNbits connection, a failure only delays readiness
+async def prime_ln_bits(ln_bits_api: LnBitsApi) -> None:
+    try:
+        await ln_bits_api.ping()
+    except Exception as e:
+        logging.warning(f"LNbits not reachable at startup: {e!r}")
+
+
+async def run(active_key: SigningKey, retired_keys: List[SigningKey], worker: int = 0) -> None:
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+
+    # SIGTERM and SIGINT drain the worker, see the end of run
+    stopping = asyncio.Event()
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        loop.add_signal_handler(signum, stopping.set)
+    draining: asyncio.Future[None] = loop.create_future()
+
+    sign_executor = create_sign_executor(SIGN_EXECUTOR, SIGN_WORKERS)
+    donation_key_signer = DonationKeySigner(active_key, sign_executor, retired_keys)
 
     routes = web.RouteTableDef()
-    db_path = f"{dirname}/database.db"
-    is_first_start = os.path.exists(db_path)
-    sql_lite_connection = sqlite3.connect(db_path)
-    sql_lite_storage = SqlLiteClaimStorage(datetime.now, sql_lite_connection)
+    status_cache = ClaimStatusCache(STATUS_CACHE_SIZE, STATUS_CACHE_TTL, paid_only=shared_storage)
+    # Claims added by other workers or replicas would be missing from it
+    claim_filter: Optional[ClaimFilter] = None
+    if CLAIM_FILTER_CAPACITY > 0 and not shared_storage:
+        claim_filter = ClaimFilter(CLAIM_FILTER_CAPACITY, CLAIM_FILTER_ERROR_RATE)
+
+    session, ln_bits_connection_stats = create_ln_bits_session(
+        LN_BITS_POOL_SIZE, LN_BITS_POOL_SIZE_PER_HOST, LN_BITS_KEEPALIVE_TIMEOUT, LN_BITS_DNS_CACHE_TTL
+    )
 
-    if not is_first_start:
-        logging.info(f"Fresh database, creating tables.")
-        sql_lite_storage.create_tables()
+    ln_bits_api = CoalescingLnBitsApi(
+        session,
+        LN_BITS_URL,
+        LN_BITS_API_KEY,
+        LN_BITS_TIMEOUT,
+        LN_BITS_RETRIES,
+        body_log=BodyLog(logging.getLogger("lnbits"), LOG_BODY_LIMIT, LOG_BODY_SAMPLE_RATE),
+        cache_ttl=LN_BITS_CACHE_TTL,
+        batch_window=LN_BITS_BATCH_WINDOW,
+        batch_limit=LN_BITS_BATCH_LIMIT,
+    )
+    request_body_log = BodyLog(logging.getLogger(), LOG_BODY_LIMIT, LOG_BODY_SAMPLE_RATE)
 
-    claim_storage: ClaimStorage = sql_lite_storage
+    claim_storage, _ = await asyncio.gather(
+        open_postgres_storage(status_cache) if DB_URL != "" else open_sql_lite_storage(status_cache, claim_filter),
+        prime_ln_bits(ln_bits_api),
+    )
+    sql_lite_storage = claim_storage if isinstance(claim_storage, AsyncSqlLiteClaimStorage) else None
+    postgres_storage = claim_storage if isinstance(claim_storage, AsyncPostgresClaimStorage) else None
 
-    session = aiohttp.ClientSession()
+    claim_filter_loading: Optional[asyncio.Task[None]] = None
+    if sql_lite_storage is not None and claim_filter is not None:
+        claim_filter_loading = loop.create_task(load_claim_filter(sql_lite_storage, claim_filter))
 
-    ln_bits_api = LnBitsApi(session, LN_BITS_URL, LN_BITS_API_KEY)
+    claim_events = ClaimEvents()
+    callback_handler = CallbackHandler(claim_storage, ln_bits_api, donation_key_signer, claim_events)
 
-    callback_handler = CallbackHandler(claim_storage, ln_bits_api, donation_key_signer)
-    create_claim_handler = CreateClaimHandler(claim_storage, ln_bits_api)
+    pay_link_pool: Optional[PayLinkPool] = None
+    if PAY_LINK_POOL_HIGH_WATERMARK > 0:
+        pay_link_pool = PayLinkPool(
+            claim_storage,
+            lambda: create_pay_link(
+                ln_bits_api,
+                SATS_AMOUNT,
+                "Donation key",
+                DOMAIN + URL_PAYMENT_SUCCESS_CALLBACK,
+                LN_BITS_LNURL_URL,
+            ),
+            PAY_LINK_POOL_LOW_WATERMARK,
+            PAY_LINK_POOL_HIGH_WATERMARK,
+        )
+        await pay_link_pool.start()
 
-    create_claim_semaphore = asyncio.Semaphore(1)
+    # Concurrent requests for the same claim are resolved by the claims primary key, see CreateClaimHandler
+    create_claim_handler = CreateClaimHandler(
+        claim_storage, ln_bits_api, DOMAIN + URL_PAYMENT_SUCCESS_CALLBACK, LN_BITS_LNURL_URL, pay_link_pool
+    )
 
+    # Liveness, answered without checking anything
     @routes.get("/donation/api")
     async def root(request: web.Request) -> web.Response:
-        return web.Response(body=json.dumps({"ok": True}))
+        return web.Response(body=ROOT_RESPONSE)
+
+    readiness = ReadinessProbe(READY_TIMEOUT)
+    readiness.add("database", claim_storage.ping)
+    readiness.add("signer", lambda: donation_key_signer.sign_async("readiness"))
+    readiness.add("lnbits", ln_bits_api.ping)
+
+    # 503 while any check fails and while draining
+    @routes.get("/donation/api/ready")
+    async def ready(request: web.Request) -> web.Response:
+        result = await readiness.check()
+
+        return web.Response(
+            body=dumps({"ready": result.ready, "checks": result.checks}), status=200 if result.ready else 503
+        )
+
+    # Limits are per worker, with WEB_WORKERS > 1 a client gets up to WEB_WORKERS times the rate
+    rate_limiter = TokenBucketLimiter(RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_KEYS)
+    admission = AdmissionController(CLAIM_MAX_CONCURRENCY, CLAIM_MAX_QUEUE)
 
     @routes.post(URL_CLAIM)
     async def create_claim(request: web.Request) -> web.Response:
-        json_request = await request.json()
-        logging.info(f"WebServer: POST {URL_CLAIM}, body: {json_request}")
-        create_claim_api = CreateClaimApi(**json_request)
+        retry_after = rate_limiter.acquire("ip", client_ip(request))
+        if retry_after > 0:
+            raise rate_limited(retry_after)
+
+        body = await request.read()
+        request_body_log.log(f"WebServer: POST {URL_CLAIM}", body)
+        create_claim_api = parse_body(CreateClaimApi, body)
 
-        async with create_claim_semaphore:
+        if RATE_LIMIT_CLAIM_PREFIX > 0:
+            retry_after = rate_limiter.acquire("claim", create_claim_api.claim[:RATE_LIMIT_CLAIM_PREFIX])
+            if retry_after > 0:
+                raise rate_limited(retry_after)
+
+        async with admission.admit():
             lnurl = await create_claim_handler.handle(create_claim_api, SATS_AMOUNT)
 
-        return web.Response(body=json.dumps({"lnurl": lnurl}))
+        return web.Response(body=dumps({"lnurl": lnurl}))
+
+    verify_keys_handler = VerifyKeysHandler(donation_key_signer, VERIFY_CHUNK_SIZE)
 
-    lnurl_payment_success_callback_semaphore = asyncio.Semaphore(1)
+    @routes.post(URL_VERIFY_KEYS)
+    async def verify_keys(request: web.Request) -> web.StreamResponse:
+        body = await read_body(request, VERIFY_MAX_BODY_SIZE)
+        verify_keys_api = parse_body(VerifyKeysApi, body)
+        if len(verify_keys_api.keys) > VERIFY_MAX_KEYS:
+            raise web.HTTPRequestEntityTooLarge(
+                max_size=VERIFY_MAX_KEYS,
+                actual_size=len(verify_keys_api.keys),
+                text=f"At most {VERIFY_MAX_KEYS} keys per request",
+            )
 
+        async def results() -> AsyncIterator[bytes]:
+            async for chunk in verify_keys_handler.handle(verify_keys_api):
+                yield b"".join(dumps({"claim": claim, "valid": valid}) + b"\n" for claim, valid in chunk)
+
+        return await stream_json_lines(request, results())
+
+    callback_queue_worker = CallbackQueueWorker(
+        claim_storage,
+        lambda callback_data: callback_handler.handle(callback_data, SATS_AMOUNT),
+        CALLBACK_WORKERS,
+        CALLBACK_MAX_ATTEMPTS,
+        retention=CALLBACK_RETENTION,
+    )
+    await callback_queue_worker.start(recover=False)
+
+    reconciliation_sweeper = ReconciliationSweeper(
+        claim_storage,
+        ln_bits_api,
+        callback_queue_worker.enqueue,
+        SWEEP_MIN_AGE,
+        SWEEP_EXPIRE_AFTER,
+        SWEEP_PAGE_SIZE,
+        SWEEP_PAYMENTS_LIMIT,
+        SWEEP_CONCURRENCY,
+        SWEEP_CALLS_PER_SECOND,
+    )
+    # One sweeper is enough for all workers
+    if SWEEP_INTERVAL > 0 and worker == 0:
+        reconciliation_sweeper.start(SWEEP_INTERVAL)
+
+    # Persisted and acknowledged right away, CallbackQueueWorker does the LNbits lookup and signing
     @routes.post(URL_PAYMENT_SUCCESS_CALLBACK)
     async def lnurl_payment_success_callback(request: web.Request) -> web.Response:
-        json_request = await request.json()
-        logging.info(f"WebServer: POST {URL_CLAIM}, body: {json_request}")
-        callback_data = LnBitsCallbackData(**json_request)
+        body = await request.read()
+        request_body_log.log(f"WebServer: POST {URL_PAYMENT_SUCCESS_CALLBACK}", body)
+        callback_data = parse_body(LnBitsCallbackData, body)
 
-        async with lnurl_payment_success_callback_semaphore:
-            await callback_handler.handle(callback_data, SATS_AMOUNT)
+        if not await callback_queue_worker.enqueue(callback_data, body.decode("utf-8")):
+            logging.info(f"WebServer: callback for payment hash {callback_data.payment_hash} already queued")
 
         return web.Response(body="", status=200)
 
+    REGISTRY.gauge("long_poll_claims", "Claims with a waiting long-poll", lambda: len(claim_events))
+    REGISTRY.gauge("callback_queue_in_flight", "Webhooks being processed", lambda: callback_queue_worker.in_flight)
+    REGISTRY.gauge("callback_queue_pending", "Webhooks waiting to be processed", lambda: callback_queue_worker.pending)
+    if sql_lite_storage is not None:
+        REGISTRY.gauge(
+            "db_group_commit_pending",
+            "Writes waiting for the next group commit",
+            lambda: sql_lite_storage.pending_writes if sql_lite_storage is not None else 0,
+        )
+    REGISTRY.gauge("claim_admission_active", "Claim creations running", lambda: admission.active)
+    REGISTRY.gauge("claim_admission_queued", "Claim creations waiting for admission", lambda: admission.queued)
+    REGISTRY.gauge(
+        "rate_limiter_keys", "Client IPs and claim prefixes tracked by the rate limiter", rate_limiter.__len__
+    )
+    if claim_filter is not None:
+        REGISTRY.gauge("claim_filter_claims", "Claims added to the claim filter", lambda: claim_filter.items)
+        REGISTRY.gauge(
+            "claim_filter_memory_bytes", "Memory of the claim filter's bit arrays", lambda: claim_filter.memory_bytes
+        )
+        REGISTRY.gauge(
+            "claim_filter_false_positive_rate",
+            "Expected share of unknown claims the claim filter can't rule out",
+            lambda: claim_filter.false_positive_rate,
+        )
+    if pay_link_pool is not None:
+        REGISTRY.gauge(
+            "pay_link_pool_depth",
+            "Pre-created pay links left",
+            lambda: pay_link_pool.depth if pay_link_pool is not None else 0,
+        )
+
+    loop_lag_monitor = LoopLagMonitor()
+    loop_lag_monitor.start()
+
+    profiler: Optional[SamplingProfiler] = None
+    if PROFILER_INTERVAL > 0:
+        profiler = SamplingProfiler(PROFILER_INTERVAL)
+        profiler.start()
+
+    @routes.get("/donation/api/metrics")
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(body=REGISTRY.render(), headers={"Content-Type": CONTENT_TYPE})
+
+    # Collapsed stacks sampled since start, only with PROFILER_INTERVAL
+    @routes.get("/donation/api/metrics/profile")
+    async def profile(request: web.Request) -> web.Response:
+        if profiler is None:
+            return web.Response(status=404)
+
+        return web.Response(body=profiler.render())
+
     @routes.get(URL_CLAIM + "/{claim}")
     async def get_claim_status(request: web.Request) -> web.Response:
         claim = DonationTokenClaim(request.match_info["claim"])
-        result = claim_storage.get_claim_status(claim)
+        if len(claim) > CLAIM_MAX_LENGTH:
+            return web.Response(status=404)
+        result = await claim_storage.get_claim_status(claim)
+
+        if result is None:
+            return web.Response(status=404)
+
+        key, status = result
+
+        return web.Response(body=dumps({"key": key, "status": status}), status=200)
+
+    # Long-poll: answers as soon as the donation key is issued, or with the pending status after LONG_POLL_TIMEOUT
+    # or once the worker drains. Keys issued by another worker are not published here, so shared storage is re-read
+    # every LONG_POLL_RECHECK.
+    @routes.get(URL_CLAIM + "/{claim}/events")
+    async def wait_for_claim_status(request: web.Request) -> web.Response:
+        claim = DonationTokenClaim(request.match_info["claim"])
+        if len(claim) > CLAIM_MAX_LENGTH:
+            return web.Response(status=404)
+        deadline = loop.time() + LONG_POLL_TIMEOUT
+        recheck = LONG_POLL_RECHECK if shared_storage else LONG_POLL_TIMEOUT
+
+        with claim_events.subscribe(claim) as issued_key:
+            wake_ups: List["asyncio.Future[Any]"] = [issued_key, draining]
+            result = await claim_storage.get_claim_status(claim)
+
+            if result is None:
+                return web.Response(status=404)
+
+            while result is not None and result[0] is None and loop.time() < deadline and not draining.done():
+                # Neither future is cancelled by asyncio.wait, other waiters share them
+                done, _ = await asyncio.wait(
+                    wake_ups, timeout=min(recheck, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if len(done) == 0 and not shared_storage:
+                    break
+                result = await claim_storage.get_claim_status(claim)
 
         if result is None:
             return web.Response(status=404)
 
         key, status = result
 
-        return web.Response(body=json.dumps({"key": key, "status": status}), status=200)
+        return web.Response(body=dumps({"key": key, "status": status}), status=200)
 
-    app = web.Application()
+    # Larger bodies are answered with a 413 while reading, before they are parsed
+    app = web.Application(middlewares=[metrics_middleware], client_max_size=MAX_BODY_SIZE)
     app.add_routes(routes)
 
     try:
-        runner = web.AppRunner(app)
+        runner = web.AppRunner(app, shutdown_timeout=SHUTDOWN_TIMEOUT)
         await runner.setup()
-        site = web.TCPSite(runner, host="0.0.0.0", port=PORT)
+        site = web.TCPSite(runner, host="0.0.0.0", port=PORT, reuse_port=WEB_WORKERS > 1)
         await site.start()
-        logging.info(f"Server running at port: {PORT}")
+        logging.info(
+            f"Server worker {worker} running at port: {PORT}, started in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+        # Debug stats every 10 seconds until SIGTERM or SIGINT
         while True:
-            await asyncio.sleep(10)
-        # await runner.cleanup()
+            try:
+                await asyncio.wait_for(stopping.wait(), 10)
+                break
+            except asyncio.TimeoutError:
+                pass
+            logging.debug(
+                f"LNbits connections: {ln_bits_connection_stats.created} created, "
+                + f"{ln_bits_connection_stats.reused} reused"
+            )
+            logging.debug(
+                f"LNbits payments: {ln_bits_api.payments.calls} calls, {ln_bits_api.payments.hits} cached, "
+                + f"{ln_bits_api.payments.coalesced} coalesced, {ln_bits_api.batched} batched"
+            )
+            if pay_link_pool is not None:
+                logging.debug(
+                    f"Pay link pool: depth {pay_link_pool.depth}, "
+                    + f"{pay_link_pool.hits} hits, {pay_link_pool.misses} misses"
+                )
+
+        # Reported not ready so the load balancer moves on, no new connections are accepted, and running requests
+        # and webhooks get SHUTDOWN_TIMEOUT seconds to finish. Webhooks not started yet stay queued for the next start.
+        drain_started = time.perf_counter()
+        logging.info(f"Server worker {worker} draining")
+        readiness.draining = True
+        draining.set_result(None)
+        await asyncio.gather(runner.cleanup(), callback_queue_worker.close(SHUTDOWN_TIMEOUT))
+        logging.info(f"Server worker {worker} drained in {(time.perf_counter() - drain_started) * 1000:.1f} ms")
     finally:
+        if claim_filter_loading is not None:
+            claim_filter_loading.cancel()
+        await loop_lag_monitor.close()
+        await reconciliation_sweeper.close()
+        await callback_queue_worker.close()
+        if pay_link_pool is not None:
+            await pay_link_pool.close()
         await session.close()
-        sql_lite_connection.close()
+        if sql_lite_storage is not None:
+            sql_lite_storage.close()
+        if postgres_storage is not None:
+            await postgres_storage.close()
+        sign_executor.shutdown()
+        if profiler is not None:
+            profiler.stop()
+
+
+if __name__ == "__main__":
+    if not os.path.exists(PRIVATE_KEY):
+        raise Exception(f"Private key {PRIVATE_KEY} not found")
 
+    active_key, retired_keys = warm_up()
 
-asyncio.run(run())
+    if WEB_WORKERS > 1:
+        # Killed when they are still draining a few seconds after SHUTDOWN_TIMEOUT
+        Supervisor(
+            WEB_WORKERS,
+            lambda worker: asyncio.run(run(active_key, retired_keys, worker)),
+            stop_timeout=SHUTDOWN_TIMEOUT + 5,
+        ).run()
+    else:
+        asyncio.run(run(active_key, retired_keys))
@@ -0,0 +1,84 @@
+import argparse
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+from typing import Callable, TypeVar
+
+from claim.archive import (
+    ARCHIVE_BATCH,
+    ArchiveResult,
+    archivable_records,
+    backup,
+    delete_archived,
+    incremental_vacuum,
+    vacuum_full,
+    write_archive,
+)
+from get_env import get_env
+
+T = TypeVar("T")
+
+
+def timed(name: str, phase: Callable[[], T]) -> T:
+    started = time.perf_counter()
+    result = phase()
+    elapsed = time.perf_counter() - started
+
+    if isinstance(result, ArchiveResult):
+        rows = result.claims + result.statuses
+        logging.info(
+            f"{name}: {result.claims} claims, {result.statuses} statuses in {elapsed:.2f} s, "
+            + f"{rows / max(elapsed, 1e-9):.0f} rows/sec"
+        )
+    else:
+        logging.info(f"{name}: done in {elapsed:.2f} s")
+
+    return result
+
+
+# Moves paid claims and statuses of expired claims older than --days out of a live SQLite database: exports them to
+# gzipped NDJSON, deletes them in small transactions and returns the freed pages to the file system
+def main(args: argparse.Namespace) -> None:
+    connection = sqlite3.connect(args.db, timeout=args.busy_timeout)
+    cutoff = time.time() - args.days * 24 * 60 * 60
+
+    try:
+        if args.backup:
+            timed(f"Backup to {args.backup}", lambda: backup(connection, args.backup))
+
+        archive_path = args.output or f"claims-{datetime.now():%Y%m%d-%H%M%S}.ndjson.gz"
+        timed(
+            f"Export to {archive_path}",
+            lambda: write_archive(archivable_records(connection, cutoff, args.batch_size), archive_path),
+        )
+        if args.export_only:
+            return
+
+        timed("Delete", lambda: delete_archived(connection, cutoff, args.batch_size, args.pause))
+        if args.vacuum_full:
+            timed("Full vacuum", lambda: vacuum_full(connection))
+        freed = timed("Incremental vacuum", lambda: incremental_vacuum(connection))
+        logging.info(f"{freed} pages freed")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(get_env("LOG_LEVEL", "INFO"))
+    parser = argparse.ArgumentParser(description="Archive and delete old claims of a running server's database")
+    parser.add_argument("--db", default=get_env("DB_PATH", os.path.join(os.path.dirname(__file__), "database.db")))
+    parser.add_argument("--days", type=float, default=90, help="archive claims without a status for this many days")
+    parser.add_argument("--output", help="gzipped NDJSON archive, claims-<time>.ndjson.gz by default")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH, help="claims read or deleted at once")
+    parser.add_argument("--pause", type=float, default=0.05, help="seconds between delete transactions")
+    parser.add_argument("--busy-timeout", type=float, default=5, help="seconds to wait for the server's writer")
+    parser.add_argument("--backup", help="copy the whole database here first")
+    parser.add_argument("--export-only", action="store_true", help="keep the archived rows in the database")
+    parser.add_argument(
+        "--vacuum-full",
+        action="store_true",
+        help="rewrite databases created before incremental vacuum, blocks the server's writes while it runs",
+    )
+    main(parser.parse_args())
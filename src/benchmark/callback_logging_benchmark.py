@@ -0,0 +1,78 @@
+import io
+import json
+import logging
+import time
+from typing import Callable
+
+from body_log import BodyLog
+from lnbits import LnBitsCallbackData, LnBitsPayment
+
+ITERATIONS = 20000
+
+callback_body = json.dumps(
+    {"payment_hash": "a" * 64, "payment_request": "lnbc" + "x" * 300, "amount": 1000, "comment": None, "lnurlp": 1}
+).encode("utf-8")
+
+payment_body = json.dumps(
+    {
+        "paid": True,
+        "preimage": "b" * 64,
+        "details": {
+            "checking_id": "c" * 64,
+            "pending": False,
+            "amount": 1000000,
+            "fee": 0,
+            "memo": "Donation key",
+            "time": 1660000000,
+            "bolt11": "lnbc" + "x" * 300,
+            "preimage": "b" * 64,
+            "payment_hash": "a" * 64,
+            "extra": {"tag": "lnurlp", "link": 1, "comment": None, "extra": "1000"},
+            "wallet_id": "d" * 32,
+        },
+    }
+).encode("utf-8")
+
+logger = logging.getLogger("benchmark")
+logger.propagate = False
+logger.addHandler(logging.StreamHandler(io.StringIO()))
+
+
+def legacy_callback_path() -> None:
+    # Previous implementation: json decoded into a dict, formatted into an INFO line, then copied into the model,
+    # and the LNbits response decoded twice by text() and json()
+    json_request = json.loads(callback_body)
+    logger.info(f"WebServer: POST /callback, body: {json_request}")
+    LnBitsCallbackData(**json_request)
+
+    text = payment_body.decode("utf-8")
+    logger.info(f"Outgoing >>: GET /payment, Result: 200 {text}")
+    LnBitsPayment(**json.loads(payment_body))
+
+
+body_log = BodyLog(logger)
+
+
+def callback_path() -> None:
+    body_log.log("WebServer: POST /callback", callback_body)
+    LnBitsCallbackData.model_validate_json(callback_body)
+
+    logger.info("Outgoing >>: GET %s, Result: %s", "/payment", 200)
+    body_log.log("Outgoing >>: GET /payment", payment_body)
+    LnBitsPayment.model_validate_json(payment_body)
+
+
+def bench(name: str, path: Callable[[], None], level: int) -> None:
+    logger.setLevel(level)
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        path()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<36} {ITERATIONS / elapsed:>10.1f} callbacks/sec")
+
+
+if __name__ == "__main__":
+    bench("legacy, logging on (DEBUG)", legacy_callback_path, logging.DEBUG)
+    bench("legacy, logging off (WARNING)", legacy_callback_path, logging.WARNING)
+    bench("single read, logging on (DEBUG)", callback_path, logging.DEBUG)
+    bench("single read, logging off (WARNING)", callback_path, logging.WARNING)
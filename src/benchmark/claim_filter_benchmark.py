@@ -0,0 +1,89 @@
+import asyncio
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from typing import Optional
+
+from claim.async_claim_storage import AsyncSqlLiteClaimStorage
+from claim.claim import DonationTokenClaim
+from claim.claim_filter import ClaimFilter
+
+CLAIMS = 100000
+LOOKUPS = 5000
+CONCURRENCY = 32
+
+
+def fill(db_path: str) -> None:
+    storage = AsyncSqlLiteClaimStorage(datetime.now, db_path, readers=1)
+    storage.create_tables()
+    storage.close()
+
+    connection = sqlite3.connect(db_path)
+    with connection:
+        connection.executemany(
+            "INSERT INTO claims (claim, lnbit_payment_link_id) VALUES (?, ?)",
+            ((f"claim-{i}", i) for i in range(CLAIMS)),
+        )
+    connection.close()
+
+
+# Status lookups of claims that don't exist, like a scanner trying random claims
+def bench_unknown_lookups(db_path: str, claim_filter: Optional[ClaimFilter]) -> None:
+    storage = AsyncSqlLiteClaimStorage(datetime.now, db_path, claim_filter=claim_filter)
+
+    async def run() -> None:
+        if claim_filter is not None:
+            started = time.perf_counter()
+            await storage.load_claim_filter()
+            print(
+                f"loaded {CLAIMS} claims in {(time.perf_counter() - started) * 1000:.0f} ms, "
+                + f"{claim_filter.memory_bytes / 1024:.0f} KiB, "
+                + f"expected false positive rate {claim_filter.false_positive_rate:.4f}"
+            )
+
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for i in range(LOOKUPS):
+            queue.put_nowait(i)
+        found = 0
+
+        async def client() -> None:
+            nonlocal found
+            while not queue.empty():
+                i = queue.get_nowait()
+                if await storage.get_claim_status(DonationTokenClaim(f"unknown-{i}")) is not None:
+                    found += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[client() for _ in range(CONCURRENCY)])
+        elapsed = time.perf_counter() - started
+        assert found == 0
+        print(f"{'claim filter' if claim_filter else 'database only':<16} {LOOKUPS / elapsed:>10.1f} lookups/sec")
+
+    asyncio.run(run())
+    storage.close()
+
+
+def bench_false_positives(error_rate: float) -> None:
+    claim_filter = ClaimFilter(CLAIMS // 10, error_rate)
+    for i in range(CLAIMS):
+        claim_filter.add_claim(DonationTokenClaim(f"claim-{i}"))
+    claim_filter.loaded = True
+
+    false_positives = sum(claim_filter.might_have_claim(DonationTokenClaim(f"unknown-{i}")) for i in range(CLAIMS))
+    print(
+        f"error rate {error_rate:<6} measured {false_positives / CLAIMS:.4f}, "
+        + f"expected {claim_filter.false_positive_rate:.4f}, {claim_filter.memory_bytes / 1024:.0f} KiB"
+    )
+
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = f"{directory}/benchmark.db"
+        fill(db_path)
+        bench_unknown_lookups(db_path, None)
+        bench_unknown_lookups(db_path, ClaimFilter(CLAIMS, 0.01))
+
+    # Starts 10 times too small, so the filter has to grow
+    for error_rate in [0.1, 0.01, 0.001]:
+        bench_false_positives(error_rate)
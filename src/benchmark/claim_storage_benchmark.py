@@ -0,0 +1,82 @@
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable
+
+from claim.async_claim_storage import AsyncSqlLiteClaimStorage
+from claim.claim import DonationTokenClaim
+from claim.claim_storage import SqlLiteClaimStorage
+from claim.statuses import CREATED_STATUS
+from lnbits import LnBitsPaymentLinkId
+
+CLAIMS = 500
+CONCURRENCY = 32
+
+
+def legacy_add(connection: sqlite3.Connection, claim: DonationTokenClaim, id: LnBitsPaymentLinkId) -> None:
+    # Previous implementation: claim row and status row committed separately
+    connection.execute("INSERT INTO claims (claim, lnbit_payment_link_id) VALUES (?, ?)", (claim, id))
+    connection.commit()
+    connection.execute(
+        "INSERT INTO statuses (claim, created_at, status) VALUES (?, ?, ?)",
+        (claim, datetime.now().timestamp(), CREATED_STATUS),
+    )
+    connection.commit()
+
+
+def report(name: str, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    print(f"{name:<36} {CLAIMS / elapsed:>10.1f} claims/sec")
+
+
+def bench_sync(name: str, add: Callable[[sqlite3.Connection, SqlLiteClaimStorage, int], None]) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(f"{directory}/benchmark.db")
+        storage = SqlLiteClaimStorage(datetime.now, connection)
+        storage.create_tables()
+
+        started = time.perf_counter()
+        for i in range(CLAIMS):
+            add(connection, storage, i)
+        report(name, started)
+
+        connection.close()
+
+
+def bench_async(group_commit: bool) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        storage = AsyncSqlLiteClaimStorage(datetime.now, f"{directory}/benchmark.db", group_commit=group_commit)
+        storage.create_tables()
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for i in range(CLAIMS):
+            queue.put_nowait(i)
+
+        async def client() -> None:
+            while not queue.empty():
+                i = queue.get_nowait()
+                await storage.add(DonationTokenClaim(f"claim-{i}"), LnBitsPaymentLinkId(i))
+
+        async def run() -> None:
+            await asyncio.gather(*[client() for _ in range(CONCURRENCY)])
+
+        started = time.perf_counter()
+        asyncio.run(run())
+        report(f"async add (WAL, group_commit={group_commit})", started)
+
+        storage.close()
+
+
+if __name__ == "__main__":
+    bench_sync(
+        "legacy add (two commits)",
+        lambda connection, _, i: legacy_add(connection, DonationTokenClaim(f"claim-{i}"), LnBitsPaymentLinkId(i)),
+    )
+    bench_sync(
+        "add (one transaction)",
+        lambda _, storage, i: storage.add(DonationTokenClaim(f"claim-{i}"), LnBitsPaymentLinkId(i)),
+    )
+    bench_async(group_commit=False)
+    bench_async(group_commit=True)
@@ -0,0 +1,69 @@
+import json
+import time
+from typing import Callable
+
+from aiohttp import web
+
+from create_claim.create_claim_handler import CreateClaimApi
+from json_codec import dumps, parse_body
+from lnbits import LnBitsCallbackData
+
+ITERATIONS = 50000
+
+claim_body = json.dumps({"claim": "c" * 64}).encode("utf-8")
+invalid_claim_body = json.dumps({"claim": ""}).encode("utf-8")
+callback_body = json.dumps(
+    {"payment_hash": "a" * 64, "payment_request": "lnbc" + "x" * 300, "amount": 1000, "comment": None, "lnurlp": 1}
+).encode("utf-8")
+status = {"key": "k" * 344, "status": ["paid"]}
+
+
+def legacy_create_claim() -> None:
+    CreateClaimApi(**json.loads(claim_body))
+    json.dumps({"lnurl": "LNURL1" + "x" * 100}).encode("utf-8")
+
+
+def create_claim() -> None:
+    parse_body(CreateClaimApi, claim_body)
+    dumps({"lnurl": "LNURL1" + "x" * 100})
+
+
+def legacy_callback() -> None:
+    LnBitsCallbackData(**json.loads(callback_body))
+
+
+def callback() -> None:
+    parse_body(LnBitsCallbackData, callback_body)
+
+
+def legacy_claim_status() -> None:
+    json.dumps(status).encode("utf-8")
+
+
+def claim_status() -> None:
+    dumps(status)
+
+
+def invalid_claim() -> None:
+    try:
+        parse_body(CreateClaimApi, invalid_claim_body)
+    except web.HTTPBadRequest:
+        pass
+
+
+def bench(name: str, route: Callable[[], None]) -> None:
+    started = time.perf_counter()
+    for _ in range(ITERATIONS):
+        route()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<36} {elapsed / ITERATIONS * 1e6:>8.2f} us/request")
+
+
+if __name__ == "__main__":
+    bench("POST claim, json + model(**)", legacy_create_claim)
+    bench("POST claim, parse_body + dumps", create_claim)
+    bench("POST callback, json + model(**)", legacy_callback)
+    bench("POST callback, parse_body", callback)
+    bench("GET claim, json.dumps", legacy_claim_status)
+    bench("GET claim, dumps", claim_status)
+    bench("POST claim, invalid body (400)", invalid_claim)
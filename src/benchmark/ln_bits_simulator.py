@@ -0,0 +1,163 @@
+import asyncio
+import json
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import aiohttp
+from aiohttp import web
+
+from lnbits import LnBitsCallbackData, LnBitsPaymentLinkId, PaymentHash
+from lnurl import encode_lnurl
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+class _SimulatedPayment:
+    def __init__(self, link: LnBitsPaymentLinkId, payment_hash: PaymentHash, msats: int) -> None:
+        self.link = link
+        self.payment_hash = payment_hash
+        self.msats = msats
+        self.time = int(time.time())
+
+    def details(self) -> Dict[str, object]:
+        return {
+            "checking_id": self.payment_hash,
+            "pending": False,
+            "amount": self.msats,
+            "fee": 0,
+            "memo": "",
+            "time": self.time,
+            "bolt11": f"lnbc{self.payment_hash}",
+            "preimage": "0" * 64,
+            "payment_hash": self.payment_hash,
+            "extra": {"tag": "lnurlp", "link": self.link, "comment": None, "extra": ""},
+            "wallet_id": "simulator",
+        }
+
+
+# Local stand-in for the LNbits endpoints the server uses. Every response is delayed by latency seconds (with
+# jitter), error_rate of them fail with a 500. pay() pays a pay link and sends its webhook like LNbits does.
+class LnBitsSimulator:
+    def __init__(self, latency: float = 0, jitter: float = 0, error_rate: float = 0, seed: int = 0) -> None:
+        self._latency = latency
+        self._jitter = jitter
+        self._error_rate = error_rate
+        self._random = random.Random(seed)
+        self._links: Dict[LnBitsPaymentLinkId, Dict[str, object]] = {}
+        self._payments: Dict[PaymentHash, _SimulatedPayment] = {}
+        self._paid_links: Set[LnBitsPaymentLinkId] = set()
+        self._last_id = 0
+        self._runner: Optional[web.AppRunner] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.url = ""
+        self.requests = 0
+        self.errors = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        app = web.Application(middlewares=[self._simulate])
+        app.router.add_post("/lnurlp/api/v1/links", self._create_link)
+        app.router.add_get("/lnurlp/api/v1/links/{id}", self._get_link)
+        app.router.add_delete("/lnurlp/api/v1/links/{id}", self._delete_link)
+        app.router.add_get("/api/v1/payments", self._get_payments)
+        app.router.add_get("/api/v1/payments/{payment_hash}", self._get_payment)
+        app.router.add_get("/api/v1/wallet", self._get_wallet)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self.url = f"http://{host}:{self._runner.addresses[0][1]}"
+        self._session = aiohttp.ClientSession()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def unpaid_links(self) -> List[LnBitsPaymentLinkId]:
+        return [id for id in self._links if id not in self._paid_links]
+
+    # Pays the pay link with msats and returns the webhook it sent, without the webhook when the link has none
+    async def pay(self, id: LnBitsPaymentLinkId, msats: int, send_webhook: bool = True) -> LnBitsCallbackData:
+        link = self._links[id]
+        payment = _SimulatedPayment(id, PaymentHash(f"{self._random.getrandbits(256):064x}"), msats)
+        self._payments[payment.payment_hash] = payment
+        self._paid_links.add(id)
+
+        callback_data = LnBitsCallbackData.model_validate(
+            {
+                "payment_hash": payment.payment_hash,
+                "payment_request": f"lnbc{payment.payment_hash}",
+                "amount": msats // 1000,
+                "comment": None,
+                "lnurlp": id,
+            }
+        )
+
+        webhook_url = link["webhook_url"]
+        if send_webhook and isinstance(webhook_url, str) and self._session is not None:
+            async with self._session.post(webhook_url, data=callback_data.model_dump_json()) as response:
+                await response.read()
+
+        return callback_data
+
+    @web.middleware
+    async def _simulate(self, request: web.Request, handler: Handler) -> web.StreamResponse:
+        self.requests += 1
+        if self._latency > 0 or self._jitter > 0:
+            await asyncio.sleep(max(0.0, self._random.gauss(self._latency, self._jitter)))
+        if self._random.random() < self._error_rate:
+            self.errors += 1
+            return web.Response(status=500, text="simulated error")
+
+        return await handler(request)
+
+    async def _create_link(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self._last_id += 1
+        id = LnBitsPaymentLinkId(self._last_id)
+        self._links[id] = {
+            "id": id,
+            "wallet": "simulator",
+            "description": body["description"],
+            "min": body["min"],
+            "max": body["max"],
+            "served_meta": 0,
+            "served_pr": 0,
+            "webhook_url": body.get("webhook_url"),
+            "comment_chars": body.get("comment_chars", 0),
+            "lnurl": encode_lnurl(f"{self.url}/lnurlp/{id}"),
+        }
+
+        return web.json_response(self._links[id], status=201)
+
+    async def _get_link(self, request: web.Request) -> web.Response:
+        link = self._links.get(LnBitsPaymentLinkId(int(request.match_info["id"])))
+        if link is None:
+            return web.Response(status=404)
+
+        return web.json_response(link)
+
+    async def _delete_link(self, request: web.Request) -> web.Response:
+        if self._links.pop(LnBitsPaymentLinkId(int(request.match_info["id"])), None) is None:
+            return web.Response(status=404)
+
+        return web.json_response({"success": True})
+
+    async def _get_payment(self, request: web.Request) -> web.Response:
+        payment = self._payments.get(PaymentHash(request.match_info["payment_hash"]))
+        if payment is None:
+            return web.Response(status=404)
+
+        return web.json_response({"paid": True, "preimage": "0" * 64, "details": payment.details()})
+
+    async def _get_wallet(self, request: web.Request) -> web.Response:
+        return web.json_response({"id": "simulator", "name": "simulator", "balance": 0})
+
+    async def _get_payments(self, request: web.Request) -> web.Response:
+        limit = int(request.query.get("limit", "100"))
+        offset = int(request.query.get("offset", "0"))
+        newest_first = list(reversed(self._payments.values()))
+
+        return web.Response(body=json.dumps([payment.details() for payment in newest_first[offset : offset + limit]]))
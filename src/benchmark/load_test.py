@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+from typing import Any, Coroutine, Dict, List, Optional, Tuple
+
+import aiohttp
+import rsa
+
+from benchmark.ln_bits_simulator import LnBitsSimulator
+from lnbits import LnBitsPaymentLinkId
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SATS_AMOUNT = 1000
+# settings.URL_CLAIM, settings itself needs the server env
+URL_CLAIM = "/donation/api/key/claim"
+LAG_BUCKET = re.compile(r'^event_loop_lag_seconds_bucket\{le="([^"]+)"\} (\S+)$')
+
+
+class Recorder:
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, operation: str, seconds: float, ok: bool) -> None:
+        self.latencies.setdefault(operation, []).append(seconds)
+        if not ok:
+            self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def summary(self, duration: float) -> Dict[str, Dict[str, float]]:
+        result = {}
+        for operation, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies)
+            result[operation] = {
+                "count": len(latencies),
+                "errors": self.errors.get(operation, 0),
+                "rps": round(len(latencies) / duration, 1),
+                "p50_ms": percentile(latencies, 0.5),
+                "p95_ms": percentile(latencies, 0.95),
+                "p99_ms": percentile(latencies, 0.99),
+                "max_ms": round(latencies[-1] * 1000, 2),
+            }
+
+        return result
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    return round(sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))] * 1000, 2)
+
+
+# Cumulative event_loop_lag_seconds buckets from the metrics endpoint
+def parse_loop_lag(metrics: str) -> List[Tuple[float, float]]:
+    buckets = []
+    for line in metrics.splitlines():
+        match = LAG_BUCKET.match(line)
+        if match is not None:
+            buckets.append((float(match.group(1)), float(match.group(2))))
+
+    return buckets
+
+
+# Percentiles are bucket upper bounds, so they are as coarse as the histogram buckets
+def loop_lag_summary(before: List[Tuple[float, float]], after: List[Tuple[float, float]]) -> Dict[str, float]:
+    counts = [(le, count - dict(before).get(le, 0)) for le, count in after]
+    total = counts[-1][1] if counts else 0
+    result: Dict[str, float] = {"samples": total}
+
+    for name, q in [("p50_ms", 0.5), ("p95_ms", 0.95), ("p99_ms", 0.99)]:
+        bound = next((le for le, count in counts if total > 0 and count >= q * total), float("inf"))
+        result[name] = bound * 1000
+
+    return result
+
+
+class LoadTest:
+    def __init__(self, base_url: str, simulator: LnBitsSimulator, args: argparse.Namespace) -> None:
+        self._base_url = base_url
+        self._simulator = simulator
+        self._args = args
+        self._random = random.Random(args.seed)
+        self._claims: List[str] = []
+        self._recorder = Recorder()
+        self._tasks: List["asyncio.Task[None]"] = []
+
+    async def run(self, session: aiohttp.ClientSession) -> Dict[str, Dict[str, float]]:
+        operations, weights = zip(*self._args.mix.items())
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        next_burst = started + self._args.burst_interval
+        requests = int(self._args.rps * self._args.duration)
+
+        # Open loop: requests are sent on schedule whether or not earlier ones finished, and latency is measured
+        # from the scheduled time, so a stalled server shows up in the percentiles instead of lowering the rate
+        for i in range(requests):
+            scheduled = started + i / self._args.rps
+            await asyncio.sleep(max(0.0, scheduled - loop.time()))
+
+            if self._args.burst_size > 0 and scheduled >= next_burst:
+                next_burst += self._args.burst_interval
+                for id in self._simulator.unpaid_links()[: self._args.burst_size]:
+                    self._spawn(self._pay(id, loop.time()))
+
+            operation = self._random.choices(operations, weights)[0]
+            if operation == "status" and self._claims:
+                self._spawn(self._status(session, self._random.choice(self._claims), scheduled))
+            else:
+                self._spawn(self._create(session, scheduled))
+
+        await asyncio.gather(*self._tasks)
+
+        return self._recorder.summary(loop.time() - started)
+
+    def _spawn(self, coroutine: Coroutine[Any, Any, None]) -> None:
+        self._tasks.append(asyncio.create_task(coroutine))
+
+    async def _create(self, session: aiohttp.ClientSession, scheduled: float) -> None:
+        claim = f"load-{self._random.getrandbits(64):016x}"
+        ok = await self._request(session, "POST", self._base_url + URL_CLAIM, {"claim": claim})
+        if ok:
+            self._claims.append(claim)
+        self._recorder.record("create_claim", asyncio.get_running_loop().time() - scheduled, ok)
+
+    async def _status(self, session: aiohttp.ClientSession, claim: str, scheduled: float) -> None:
+        ok = await self._request(session, "GET", f"{self._base_url}{URL_CLAIM}/{claim}")
+        self._recorder.record("claim_status", asyncio.get_running_loop().time() - scheduled, ok)
+
+    # Webhook latency is how long the server takes to acknowledge it, issuing the key happens after that
+    async def _pay(self, id: LnBitsPaymentLinkId, scheduled: float) -> None:
+        ok = True
+        try:
+            await self._simulator.pay(id, SATS_AMOUNT * 1000)
+        except aiohttp.ClientError:
+            ok = False
+        self._recorder.record("webhook", asyncio.get_running_loop().time() - scheduled, ok)
+
+    async def _request(
+        self, session: aiohttp.ClientSession, method: str, url: str, body: Optional[Dict[str, str]] = None
+    ) -> bool:
+        try:
+            async with session.request(method, url, json=body) as response:
+                await response.read()
+                return response.status == 200
+        except aiohttp.ClientError:
+            return False
+
+
+async def wait_until_up(session: aiohttp.ClientSession, base_url: str, server: "subprocess.Popen[bytes]") -> None:
+    for _ in range(200):
+        if server.poll() is not None:
+            raise Exception(f"Server exited with {server.returncode}")
+        try:
+            async with session.get(base_url + "/donation/api") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.05)
+
+    raise Exception("Server did not start")
+
+
+# With several workers each scrape reaches whichever worker accepts the connection
+async def scrape_loop_lag(session: aiohttp.ClientSession, base_url: str) -> List[Tuple[float, float]]:
+    async with session.get(base_url + "/donation/api/metrics") as response:
+        return parse_loop_lag(await response.text())
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=SRC, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args: argparse.Namespace) -> Dict[str, object]:
+    simulator = LnBitsSimulator(args.latency, args.jitter, args.error_rate, args.seed)
+    await simulator.start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        private_key = os.path.join(directory, "private.pem")
+        with open(private_key, "wb") as f:
+            f.write(rsa.newkeys(args.key_bits)[1].save_pkcs1())
+
+        base_url = f"http://127.0.0.1:{args.port}"
+        env = {
+            **os.environ,
+            "PORT": str(args.port),
+            "DOMAIN": base_url,
+            "LN_BITS_URL": simulator.url,
+            "LN_BITS_API_KEY": "simulator",
+            "PRIVATE_KEY": private_key,
+            "SATS_AMOUNT": str(SATS_AMOUNT),
+            "DB_PATH": os.path.join(directory, "database.db"),
+            "WEB_WORKERS": str(args.workers),
+            "LOG_LEVEL": "WARNING",
+        }
+        server = subprocess.Popen([sys.executable, "app.py"], cwd=SRC, env=env)
+
+        try:
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.connections)) as session:
+                await wait_until_up(session, base_url, server)
+                lag_before = await scrape_loop_lag(session, base_url)
+                operations = await LoadTest(base_url, simulator, args).run(session)
+                lag_after = await scrape_loop_lag(session, base_url)
+        finally:
+            server.terminate()
+            server.wait()
+            await simulator.close()
+
+    return {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items() if key not in ["output", "compare"]},
+        "operations": operations,
+        "event_loop_lag": loop_lag_summary(lag_before, lag_after),
+        "ln_bits": {"requests": simulator.requests, "errors": simulator.errors},
+    }
+
+
+def compare(previous: Dict[str, object], current: Dict[str, object]) -> None:
+    print(f"Compared with {previous.get('commit')}")
+    for section in ["operations", "event_loop_lag"]:
+        before_section = previous.get(section, {})
+        after_section = current[section]
+        assert isinstance(before_section, dict) and isinstance(after_section, dict)
+
+        rows = after_section.items() if section == "operations" else [("event_loop_lag", after_section)]
+        for name, after in rows:
+            before = before_section.get(name, {}) if section == "operations" else before_section
+            for metric in ["rps", "p50_ms", "p95_ms", "p99_ms"]:
+                if metric in after and metric in before:
+                    print(f"{name:<16} {metric:<8} {before[metric]:>10} -> {after[metric]:>10}")
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        operation, weight = part.split("=")
+        if operation not in ["create", "status"]:
+            raise argparse.ArgumentTypeError(f"Unknown operation {operation}")
+        mix[operation] = float(weight)
+
+    return mix
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs app.py against a local LNbits simulator")
+    parser.add_argument("--rps", type=float, default=100, help="Claim creations and status polls per second")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--mix", type=parse_mix, default="create=1,status=4", help="Weights, e.g. create=1,status=4")
+    parser.add_argument("--burst-size", type=int, default=20, help="Webhooks sent at once, 0 disables them")
+    parser.add_argument("--burst-interval", type=float, default=1)
+    parser.add_argument("--latency", type=float, default=0.05, help="LNbits latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--workers", type=int, default=1, help="WEB_WORKERS of the server")
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8123)
+    parser.add_argument("--key-bits", type=int, default=2048)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--compare", help="JSON results of an earlier run")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    print(json.dumps(results, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,67 @@
+import asyncio
+import base64
+import os
+import time
+from typing import Callable, List
+import rsa
+
+from claim.donation_key import DonationKey
+from sign.sign import (
+    ALGORITHM_RSA_SHA1,
+    SIGN_EXECUTOR_PROCESS,
+    SIGN_EXECUTOR_THREAD,
+    DonationKeySigner,
+    create_sign_executor,
+    load_signing_key,
+)
+
+dirname = os.path.dirname(__file__)
+private_key_path = f"{dirname}/../sign/test_privatekey.pem"
+
+SIGNATURES = 200
+WORKERS = os.cpu_count() or 1
+
+
+def legacy_sign(message: str) -> DonationKey:
+    # Previous implementation: reads and parses the PEM file for every signature
+    with open(private_key_path, "rb") as p:
+        private_key = rsa.PrivateKey.load_pkcs1(p.read())
+        signature = rsa.sign(message.encode("utf-8"), private_key, "SHA-1")
+
+        return DonationKey(base64.b64encode(signature).decode("utf-8"))
+
+
+def report(name: str, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    print(f"{name:<32} {SIGNATURES / elapsed:>10.1f} signatures/sec")
+
+
+def bench_sync(name: str, sign: Callable[[str], DonationKey]) -> None:
+    started = time.perf_counter()
+    for i in range(SIGNATURES):
+        sign(f"claim-{i}")
+    report(name, started)
+
+
+def bench_async(kind: str) -> None:
+    executor = create_sign_executor(kind, WORKERS)
+    signer = DonationKeySigner(load_signing_key("1", ALGORITHM_RSA_SHA1, private_key_path), executor)
+
+    async def sign_all() -> List[DonationKey]:
+        return await asyncio.gather(*[signer.sign_async(f"claim-{i}") for i in range(SIGNATURES)])
+
+    # Spawn workers before measuring
+    asyncio.run(sign_all())
+
+    started = time.perf_counter()
+    asyncio.run(sign_all())
+    report(f"sign_async ({kind} x{WORKERS})", started)
+
+    executor.shutdown()
+
+
+if __name__ == "__main__":
+    bench_sync("legacy (load key per sign)", legacy_sign)
+    bench_sync("sign (cached key)", DonationKeySigner(load_signing_key("1", ALGORITHM_RSA_SHA1, private_key_path)).sign)
+    bench_async(SIGN_EXECUTOR_THREAD)
+    bench_async(SIGN_EXECUTOR_PROCESS)
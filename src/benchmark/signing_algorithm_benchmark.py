@@ -0,0 +1,84 @@
+import time
+from typing import Callable, List, Tuple
+import rsa
+
+from sign.sign import (
+    ALGORITHM_ED25519,
+    ALGORITHM_RSA_SHA1,
+    ALGORITHM_RSA_SHA256,
+    BACKEND_OPENSSL,
+    BACKEND_RSA,
+    OPENSSL_AVAILABLE,
+    KeyBackend,
+    create_key_backend,
+)
+
+DURATION = 1.0
+MESSAGE = b"claim-0123456789abcdef"
+# Pure Python key generation takes minutes for the larger sizes
+PURE_RSA_KEY_SIZES = [1024, 2048]
+OPENSSL_RSA_KEY_SIZES = [1024, 2048, 3072, 4096]
+
+
+def rsa_pem(bits: int) -> bytes:
+    if OPENSSL_AVAILABLE:
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa as openssl_rsa
+
+        return openssl_rsa.generate_private_key(public_exponent=65537, key_size=bits).private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL, serialization.NoEncryption()
+        )
+
+    return rsa.newkeys(bits)[1].save_pkcs1()
+
+
+def ed25519_pem() -> bytes:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+
+    return ed25519.Ed25519PrivateKey.generate().private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    )
+
+
+# Calls per second over DURATION
+def rate(call: Callable[[], object]) -> float:
+    calls = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < DURATION:
+        call()
+        calls += 1
+
+    return calls / (time.perf_counter() - started)
+
+
+def bench(name: str, key_backend: KeyBackend) -> None:
+    signature = key_backend.sign(MESSAGE)
+    signs = rate(lambda: key_backend.sign(MESSAGE))
+    verifies = rate(lambda: key_backend.verify(MESSAGE, signature))
+    print(f"{name:<32} {signs:>10.1f} signatures/sec {verifies:>10.1f} verifications/sec {len(signature):>4} bytes")
+
+
+def cases() -> List[Tuple[str, str, str, bytes]]:
+    key_sizes = OPENSSL_RSA_KEY_SIZES if OPENSSL_AVAILABLE else PURE_RSA_KEY_SIZES
+    rsa_pems = {bits: rsa_pem(bits) for bits in key_sizes}
+    backends = [BACKEND_RSA, BACKEND_OPENSSL] if OPENSSL_AVAILABLE else [BACKEND_RSA]
+    result = []
+
+    for backend in backends:
+        for algorithm in [ALGORITHM_RSA_SHA1, ALGORITHM_RSA_SHA256]:
+            for bits, pem in rsa_pems.items():
+                if backend == BACKEND_OPENSSL or bits in PURE_RSA_KEY_SIZES:
+                    result.append((f"{algorithm} {bits} ({backend})", algorithm, backend, pem))
+
+    if OPENSSL_AVAILABLE:
+        result.append((f"{ALGORITHM_ED25519} ({BACKEND_OPENSSL})", ALGORITHM_ED25519, BACKEND_OPENSSL, ed25519_pem()))
+    else:
+        print("cryptography not installed, only the pure Python rsa backend is measured")
+
+    return result
+
+
+if __name__ == "__main__":
+    for name, algorithm, backend, pem in cases():
+        bench(name, create_key_backend(algorithm, pem, backend))
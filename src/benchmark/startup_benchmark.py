@@ -0,0 +1,112 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import aiohttp
+import rsa
+
+from benchmark.ln_bits_simulator import LnBitsSimulator
+
+SRC = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def wait_until_ready(session: aiohttp.ClientSession, base_url: str, server: "subprocess.Popen[bytes]") -> None:
+    while True:
+        if server.poll() is not None:
+            raise Exception(f"Server exited with {server.returncode}")
+        try:
+            async with session.get(base_url + "/donation/api/ready") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.005)
+
+
+# Starts app.py, measures the time until GET /donation/api/ready answers 200, then the time SIGTERM takes to drain.
+# A fresh database includes its migrations, with --reuse-database only the first run does.
+async def measure(args: argparse.Namespace, env: Dict[str, str], base_url: str) -> Dict[str, float]:
+    async with aiohttp.ClientSession() as session:
+        started = time.perf_counter()
+        server = subprocess.Popen([sys.executable, "app.py"], cwd=SRC, env=env)
+        try:
+            await asyncio.wait_for(wait_until_ready(session, base_url, server), args.timeout)
+            ready = time.perf_counter()
+
+            server.send_signal(signal.SIGTERM)
+            await asyncio.get_running_loop().run_in_executor(None, server.wait, args.timeout)
+            stopped = time.perf_counter()
+        finally:
+            if server.poll() is None:
+                server.kill()
+                server.wait()
+
+    return {"ready_ms": (ready - started) * 1000, "drain_ms": (stopped - ready) * 1000}
+
+
+def summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "min": round(min(values), 1),
+        "median": round(statistics.median(values), 1),
+        "max": round(max(values), 1),
+    }
+
+
+async def main(args: argparse.Namespace) -> Dict[str, object]:
+    simulator = LnBitsSimulator(args.latency)
+    await simulator.start()
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            private_key = os.path.join(directory, "private.pem")
+            with open(private_key, "wb") as f:
+                f.write(rsa.newkeys(args.key_bits)[1].save_pkcs1())
+
+            base_url = f"http://127.0.0.1:{args.port}"
+            runs = []
+            for run in range(args.runs):
+                database = os.path.join(directory, "database.db" if args.reuse_database else f"database-{run}.db")
+                env = {
+                    **os.environ,
+                    "PORT": str(args.port),
+                    "DOMAIN": base_url,
+                    "LN_BITS_URL": simulator.url,
+                    "LN_BITS_API_KEY": "simulator",
+                    "PRIVATE_KEY": private_key,
+                    "SATS_AMOUNT": "1000",
+                    "DB_PATH": database,
+                    "WEB_WORKERS": str(args.workers),
+                    "SIGN_EXECUTOR": args.sign_executor,
+                    "LOG_LEVEL": "WARNING",
+                }
+                runs.append(await measure(args, env, base_url))
+    finally:
+        await simulator.close()
+
+    return {
+        "config": vars(args),
+        "ready_ms": summary([run["ready_ms"] for run in runs]),
+        "drain_ms": summary([run["drain_ms"] for run in runs]),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time-to-ready and drain time of app.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=1, help="WEB_WORKERS of the server")
+    parser.add_argument("--sign-executor", default="thread", choices=["thread", "process"])
+    parser.add_argument("--key-bits", type=int, default=2048)
+    parser.add_argument("--latency", type=float, default=0, help="LNbits latency in seconds")
+    parser.add_argument("--reuse-database", action="store_true")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--port", type=int, default=8198)
+
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
@@ -0,0 +1,24 @@
+import logging
+import random
+
+
+# Logs request and response bodies at DEBUG only, truncated to `limit` bytes and for a `sample_rate` share of calls,
+# so nothing is decoded or formatted while DEBUG is off.
+class BodyLog:
+    def __init__(self, logger: logging.Logger, limit: int = 1000, sample_rate: float = 1.0) -> None:
+        self._logger = logger
+        self._limit = limit
+        self._sample_rate = sample_rate
+
+    def log(self, message: str, body: bytes) -> None:
+        if not self._logger.isEnabledFor(logging.DEBUG):
+            return
+
+        if self._sample_rate < 1 and random.random() >= self._sample_rate:
+            return
+
+        truncated = body[: self._limit].decode("utf-8", errors="replace")
+        if len(body) > self._limit:
+            truncated += f"... ({len(body)} bytes)"
+
+        self._logger.debug("%s, body: %s", message, truncated)
@@ -0,0 +1,28 @@
+import logging
+
+import pytest
+
+from body_log import BodyLog
+
+body = b'{"claim": "' + b"A" * 100 + b'"}'
+
+
+def test_body_is_truncated(caplog: pytest.LogCaptureFixture) -> None:
+    caplog.set_level(logging.DEBUG)
+    BodyLog(logging.getLogger("test"), limit=10).log("POST /claim", body)
+
+    assert caplog.messages == ['POST /claim, body: {"claim": ... (113 bytes)']
+
+
+def test_body_is_not_logged_above_debug(caplog: pytest.LogCaptureFixture) -> None:
+    caplog.set_level(logging.INFO)
+    BodyLog(logging.getLogger("test")).log("POST /claim", body)
+
+    assert caplog.messages == []
+
+
+def test_body_is_sampled(caplog: pytest.LogCaptureFixture) -> None:
+    caplog.set_level(logging.DEBUG)
+    BodyLog(logging.getLogger("test"), sample_rate=0).log("POST /claim", body)
+
+    assert caplog.messages == []
@@ -0,0 +1,175 @@
+import gzip
+import os
+import time
+from sqlite3 import Connection
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Sequence, Tuple
+
+from claim.statuses import render_status
+from json_codec import dumps
+
+ARCHIVE_BATCH = 500
+
+# Paid claims whose last status is older than the cutoff, paid claims of databases from before statuses had a time
+# count as old
+SELECT_ARCHIVABLE_CLAIMS = """
+    SELECT claim, lnbit_payment_link_id, payment_hash, donation_key, lnurl, key_id FROM claims
+    WHERE payment_hash IS NOT NULL AND claim > ?
+        AND (SELECT COALESCE(MAX(created_at), 0) FROM status_events WHERE status_events.claim = claims.claim) < ?
+    ORDER BY claim
+    LIMIT ?
+"""
+# Statuses left by claims expired before their statuses were deleted with them, whose claims row is already gone
+SELECT_ARCHIVABLE_EXPIRED = """
+    SELECT claim FROM status_events
+    WHERE claim > ? AND NOT EXISTS (SELECT 1 FROM claims WHERE claims.claim = status_events.claim)
+    GROUP BY claim
+    HAVING MAX(created_at) < ?
+    ORDER BY claim
+    LIMIT ?
+"""
+ARCHIVABLE = [SELECT_ARCHIVABLE_CLAIMS, SELECT_ARCHIVABLE_EXPIRED]
+
+
+class ArchiveResult(NamedTuple):
+    claims: int
+    statuses: int
+
+
+def _in(values: Sequence[object]) -> str:
+    return ", ".join("?" * len(values))
+
+
+# Keyset pages of one of the ARCHIVABLE queries, no page is read before the previous one was consumed
+def _pages(connection: Connection, query: str, cutoff: float, batch_size: int) -> Iterator[List[Tuple[Any, ...]]]:
+    after = ""
+    while True:
+        rows = connection.execute(query, (after, cutoff, batch_size)).fetchall()
+        if len(rows) == 0:
+            return
+
+        yield rows
+        after = rows[-1][0]
+
+
+def _statuses(connection: Connection, claims: Sequence[str]) -> Dict[str, List[Dict[str, Any]]]:
+    statuses: Dict[str, List[Dict[str, Any]]] = {claim: [] for claim in claims}
+    rows = connection.execute(
+        f"""
+        SELECT claim, created_at, code, actual, expected FROM status_events
+        WHERE claim IN ({_in(claims)})
+        ORDER BY claim, created_at, id
+        """,
+        claims,
+    )
+    for claim, created_at, code, actual, expected in rows:
+        statuses[claim].append(
+            {
+                "created_at": created_at,
+                "code": code,
+                "actual": actual,
+                "expected": expected,
+                "message": render_status(code, actual, expected),
+            }
+        )
+
+    return statuses
+
+
+# One record per claim with all its statuses. A generator reading a page at a time, so memory stays the same however
+# many claims are archived. Expired claims only have their statuses.
+def archivable_records(
+    connection: Connection, cutoff: float, batch_size: int = ARCHIVE_BATCH
+) -> Iterator[Dict[str, Any]]:
+    for page in _pages(connection, SELECT_ARCHIVABLE_CLAIMS, cutoff, batch_size):
+        statuses = _statuses(connection, [row[0] for row in page])
+        for claim, lnbit_payment_link_id, payment_hash, donation_key, lnurl, key_id in page:
+            yield {
+                "claim": claim,
+                "lnbit_payment_link_id": lnbit_payment_link_id,
+                "payment_hash": payment_hash,
+                "donation_key": donation_key,
+                "lnurl": lnurl,
+                "key_id": key_id,
+                "statuses": statuses[claim],
+            }
+
+    for page in _pages(connection, SELECT_ARCHIVABLE_EXPIRED, cutoff, batch_size):
+        statuses = _statuses(connection, [row[0] for row in page])
+        for (claim,) in page:
+            yield {"claim": claim, "expired": True, "statuses": statuses[claim]}
+
+
+# Gzipped NDJSON, synced to disk before it returns so the archived rows can be deleted
+def write_archive(records: Iterable[Dict[str, Any]], archive_path: str) -> ArchiveResult:
+    claims = 0
+    statuses = 0
+
+    with open(archive_path, "xb") as archive_file:
+        with gzip.GzipFile(fileobj=archive_file, mode="wb") as archive:
+            for record in records:
+                archive.write(dumps(record) + b"\n")
+                claims += 1
+                statuses += len(record["statuses"])
+        archive_file.flush()
+        os.fsync(archive_file.fileno())
+
+    return ArchiveResult(claims, statuses)
+
+
+# Deletes what archivable_records returned, each batch in its own short write transaction with a pause in between, so
+# the server's writer never waits long for the lock. The selection runs again inside the transaction with the same
+# cutoff: claims that got a newer status since the export are kept.
+def delete_archived(
+    connection: Connection, cutoff: float, batch_size: int = ARCHIVE_BATCH, pause: float = 0.05
+) -> ArchiveResult:
+    claims = 0
+    statuses = 0
+
+    for query in ARCHIVABLE:
+        after = ""
+        while True:
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                batch = [row[0] for row in connection.execute(query, (after, cutoff, batch_size)).fetchall()]
+                if len(batch) == 0:
+                    break
+
+                statuses += connection.execute(
+                    f"DELETE FROM status_events WHERE claim IN ({_in(batch)})", batch
+                ).rowcount
+                connection.execute(f"DELETE FROM claims WHERE claim IN ({_in(batch)})", batch)
+                claims += len(batch)
+
+            after = batch[-1]
+            time.sleep(pause)
+
+    return ArchiveResult(claims, statuses)
+
+
+# Returns freed pages to the file system a few at a time. Only for databases with auto_vacuum INCREMENTAL, which new
+# ones get in migrate. Older ones are converted once with vacuum_full.
+def incremental_vacuum(connection: Connection, pages_per_step: int = 1000, pause: float = 0.01) -> int:
+    if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+
+    freed = 0
+    while True:
+        free_pages = int(connection.execute("PRAGMA freelist_count").fetchone()[0])
+        if free_pages == 0:
+            return freed
+
+        # execute() would only step the pragma once, freeing a single page
+        connection.executescript(f"PRAGMA incremental_vacuum({int(pages_per_step)})")
+        freed += min(free_pages, pages_per_step)
+        time.sleep(pause)
+
+
+# Rewrites the whole database and switches it to auto_vacuum INCREMENTAL. Blocks writers until it is done.
+def vacuum_full(connection: Connection) -> None:
+    connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    connection.execute("VACUUM")
+
+
+# Consistent copy of a live database. It reads one snapshot, in WAL mode the server keeps writing meanwhile.
+def backup(connection: Connection, backup_path: str) -> None:
+    connection.execute("VACUUM INTO ?", (backup_path,))
@@ -0,0 +1,82 @@
+import gzip
+import json
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+from claim.archive import archivable_records, backup, delete_archived, incremental_vacuum, write_archive
+from claim.claim import DonationTokenClaim
+from claim.claim_storage import SqlLiteClaimStorage
+from claim.donation_key import DonationKey
+from claim.statuses import EXPIRED_STATUS, NOT_PAID_STATUS
+from lnbits import LnBitsPaymentLinkId, PaymentHash
+
+DAY = 24 * 60 * 60
+CREATED_MESSAGE = "Claim created, waiting for payment..."
+
+
+def test_archive_old_claims(tmp_path: Path) -> None:
+    now = [0.0]
+    connection = sqlite3.connect(tmp_path / "claims.db")
+    connection.execute("PRAGMA synchronous = OFF")
+    storage = SqlLiteClaimStorage(lambda: datetime.fromtimestamp(now[0]), connection)
+    storage.create_tables()
+
+    # Enough paid claims to free pages when they are deleted
+    fillers = [DonationTokenClaim(f"filler {i:04} " + "x" * 200) for i in range(2000)]
+    for i, filler in enumerate(fillers):
+        storage.add(filler, LnBitsPaymentLinkId(100 + i))
+        storage.save_success(filler, PaymentHash(filler), DonationKey("key"))
+    for i, claim in enumerate(["old paid", "old expired", "old paid, recent status", "unpaid", "recent paid"]):
+        storage.add(DonationTokenClaim(claim), LnBitsPaymentLinkId(i))
+    for claim in ["old paid", "old paid, recent status"]:
+        storage.save_success(DonationTokenClaim(claim), PaymentHash(claim), DonationKey("key"), "1")
+    # Expired by an older version, which kept the statuses of the claim
+    storage.change_status(DonationTokenClaim("old expired"), EXPIRED_STATUS)
+    with connection:
+        connection.execute("DELETE FROM claims WHERE claim = 'old expired'")
+    now[0] = 20 * DAY
+    storage.change_status(DonationTokenClaim("old paid, recent status"), NOT_PAID_STATUS)
+    storage.save_success(DonationTokenClaim("recent paid"), PaymentHash("recent paid"), DonationKey("key"))
+
+    cutoff = 10 * DAY
+    archived = [record["claim"] for record in archivable_records(connection, cutoff, batch_size=7)]
+    assert archived == [*fillers, "old paid", "old expired"]
+
+    backup_path = str(tmp_path / "backup.db")
+    backup(connection, backup_path)
+    archive_path = str(tmp_path / "claims.ndjson.gz")
+
+    assert write_archive(archivable_records(connection, cutoff), archive_path) == (2002, 4004)
+
+    with gzip.open(archive_path, "rt") as archive:
+        records = [json.loads(line) for line in archive]
+    assert records[-2] == {
+        "claim": "old paid",
+        "lnbit_payment_link_id": 0,
+        "payment_hash": "old paid",
+        "donation_key": "key",
+        "lnurl": None,
+        "key_id": "1",
+        "statuses": [
+            {"created_at": 0.0, "code": 1, "actual": None, "expected": None, "message": CREATED_MESSAGE},
+            {"created_at": 0.0, "code": 2, "actual": None, "expected": None, "message": "Sucessfully claimed."},
+        ],
+    }
+    assert records[-1]["claim"] == "old expired"
+    assert [status["code"] for status in records[-1]["statuses"]] == [1, 4]
+
+    # A status added after the export keeps its claim in the database
+    now[0] = 30 * DAY
+    storage.change_status(DonationTokenClaim("old paid"), NOT_PAID_STATUS)
+
+    assert delete_archived(connection, cutoff, batch_size=100, pause=0) == (2001, 4002)
+    assert claims(connection) == ["old paid", "old paid, recent status", "recent paid", "unpaid"]
+    assert incremental_vacuum(connection, pages_per_step=10, pause=0) > 0
+    assert connection.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    assert len(claims(sqlite3.connect(backup_path))) == 2004
+
+
+def claims(connection: sqlite3.Connection) -> List[str]:
+    return [row[0] for row in connection.execute("SELECT claim FROM claims ORDER BY claim")]
@@ -0,0 +1,449 @@
+import asyncio
+import sqlite3
+import time
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from queue import Queue
+from typing import Callable, List, NamedTuple, Optional, Tuple, TypeVar
+
+from claim.claim import DonationTokenClaim
+from claim.claim_filter import ClaimFilter
+from claim.claim_status_cache import ClaimStatusCache
+from claim.claim_storage import (
+    IssuedDonationKey,
+    PendingClaim,
+    RecoveredCallbacks,
+    SqlLiteClaimStorage,
+    SqlLiteWrite,
+)
+from claim.donation_key import DonationKey
+from claim.statuses import Status
+
+from lnbits import LnBitsPaymentLinkId, LnUrl, PaymentHash
+from metrics import REGISTRY
+
+T = TypeVar("T")
+
+DB_WAIT_SECONDS = REGISTRY.histogram(
+    "db_wait_seconds", "Time a storage call waits for a free SQLite connection", ["connection"]
+)
+DB_GROUP_COMMIT_WRITES = REGISTRY.histogram(
+    "db_group_commit_writes", "Writes committed together in one transaction", buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+
+
+class AsyncClaimStorage(metaclass=ABCMeta):
+    @abstractmethod
+    async def add(self, claim: DonationTokenClaim, id: LnBitsPaymentLinkId, lnurl: Optional[LnUrl] = None) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def save_lnurl(self, claim: DonationTokenClaim, lnurl: LnUrl) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def change_status(self, claim: DonationTokenClaim, status: Status) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def save_success(
+        self,
+        claim: DonationTokenClaim,
+        payment_hash: PaymentHash,
+        donation_key: DonationKey,
+        key_id: Optional[str] = None,
+    ) -> bool:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_claim_by_id(self, id: LnBitsPaymentLinkId) -> Optional[DonationTokenClaim]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_claim_status(self, claim: DonationTokenClaim) -> Optional[Tuple[Optional[DonationKey], List[str]]]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_claim(self, claim: DonationTokenClaim) -> Optional[LnBitsPaymentLinkId]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_lnurl(self, claim: DonationTokenClaim) -> Optional[LnUrl]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def is_payment_hashed_used(self, payment_hash: PaymentHash) -> bool:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def add_pooled_pay_link(self, id: LnBitsPaymentLinkId, lnurl: LnUrl) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def count_pooled_pay_links(self) -> int:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def ping(self) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def add_from_pool(self, claim: DonationTokenClaim) -> Optional[Tuple[LnBitsPaymentLinkId, LnUrl]]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def enqueue_callback(self, payment_hash: PaymentHash, body: str) -> bool:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def take_callback(self, max_attempts: int) -> Optional[Tuple[PaymentHash, str]]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def finish_callback(self, payment_hash: PaymentHash, state: str) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def recover_callbacks(self, max_attempts: int) -> RecoveredCallbacks:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def prune_callbacks(self, before: float) -> int:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def count_pending_callbacks(self) -> int:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_pending_claims(self, after: str, limit: int) -> List[PendingClaim]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def expire_claim(self, claim: DonationTokenClaim) -> bool:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def get_donation_keys(self, after: str, limit: int) -> List[IssuedDonationKey]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def replace_donation_keys(
+        self, keys: List[Tuple[DonationTokenClaim, DonationKey]], key_id: Optional[str] = None
+    ) -> int:
+        raise NotImplementedError()
+
+
+# Set on every connection. synchronous NORMAL skips an fsync per commit, but in WAL mode the last commits can be lost
+# on a power failure (not on a crash of the server). Negative cache_size is in KiB.
+class SqlLitePragmas(NamedTuple):
+    synchronous: str = "FULL"
+    mmap_size: int = 256 * 1024 * 1024
+    cache_size: int = -64 * 1024
+
+
+# Runs SqlLiteClaimStorage off the event loop: a single writer connection on its own thread (SQLite allows one writer
+# at a time anyway) and a pool of reader connections, which WAL mode lets read concurrently with the writer.
+# With group_commit, writes arriving while the writer is busy are committed together in one transaction.
+class AsyncSqlLiteClaimStorage(AsyncClaimStorage):
+    def __init__(
+        self,
+        now_date_function: Callable[[], datetime],
+        db_path: str,
+        readers: int = 4,
+        group_commit: bool = False,
+        status_cache: Optional[ClaimStatusCache] = None,
+        pragmas: SqlLitePragmas = SqlLitePragmas(),
+        claim_filter: Optional[ClaimFilter] = None,
+    ) -> None:
+        self._connections: List[sqlite3.Connection] = [self._connect(db_path, pragmas) for _ in range(readers + 1)]
+
+        self._writer = SqlLiteClaimStorage(now_date_function, self._connections[0])
+        self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="claim-storage-writer")
+
+        self._readers: Queue[SqlLiteClaimStorage] = Queue()
+        for connection in self._connections[1:]:
+            self._readers.put(SqlLiteClaimStorage(now_date_function, connection))
+        self._reader_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="claim-storage-reader")
+
+        self._group_commit = group_commit
+        self._pending_writes: List[Tuple[SqlLiteWrite, asyncio.Future[None]]] = []
+        self._flush_task: Optional[asyncio.Task[None]] = None
+
+        self._status_cache = status_cache
+        self._claim_filter = claim_filter
+
+    @staticmethod
+    def _connect(db_path: str, pragmas: SqlLitePragmas) -> sqlite3.Connection:
+        if pragmas.synchronous.upper() not in ["OFF", "NORMAL", "FULL", "EXTRA"]:
+            raise Exception(f"Unknown SQLite synchronous mode {pragmas.synchronous}")
+
+        connection = sqlite3.connect(db_path, check_same_thread=False)
+        # Only takes effect on a new database and before WAL mode initializes it, see archive.incremental_vacuum
+        connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(f"PRAGMA synchronous={pragmas.synchronous}")
+        connection.execute(f"PRAGMA mmap_size={int(pragmas.mmap_size)}")
+        connection.execute(f"PRAGMA cache_size={int(pragmas.cache_size)}")
+
+        return connection
+
+    def create_tables(self) -> int:
+        return self._writer.create_tables()
+
+    def close(self) -> None:
+        self._writer_executor.shutdown()
+        self._reader_executor.shutdown()
+        for connection in self._connections:
+            connection.close()
+
+    # Writes waiting for the next group commit
+    @property
+    def pending_writes(self) -> int:
+        return len(self._pending_writes)
+
+    async def _write(self, write: SqlLiteWrite) -> None:
+        loop = asyncio.get_running_loop()
+        wait = DB_WAIT_SECONDS.labels("writer")
+        submitted = time.perf_counter()
+
+        def timed_write(storage: SqlLiteClaimStorage) -> None:
+            wait.observe(time.perf_counter() - submitted)
+            write(storage)
+
+        if not self._group_commit:
+            return await loop.run_in_executor(self._writer_executor, timed_write, self._writer)
+
+        future: asyncio.Future[None] = loop.create_future()
+        self._pending_writes.append((timed_write, future))
+        if self._flush_task is None:
+            self._flush_task = loop.create_task(self._flush())
+
+        return await future
+
+    async def _flush(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        try:
+            while self._pending_writes:
+                batch, self._pending_writes = self._pending_writes, []
+                DB_GROUP_COMMIT_WRITES.labels().observe(len(batch))
+                try:
+                    errors = await loop.run_in_executor(
+                        self._writer_executor, self._writer.write_batch, [write for write, _ in batch]
+                    )
+                except Exception as e:
+                    errors = [e] * len(batch)
+
+                for (_, future), error in zip(batch, errors):
+                    if future.cancelled():
+                        continue
+                    if error is None:
+                        future.set_result(None)
+                    else:
+                        future.set_exception(error)
+        finally:
+            self._flush_task = None
+
+    async def _read(self, query: Callable[[SqlLiteClaimStorage], T]) -> T:
+        wait = DB_WAIT_SECONDS.labels("reader")
+        submitted = time.perf_counter()
+
+        def run() -> T:
+            storage = self._readers.get()
+            wait.observe(time.perf_counter() - submitted)
+            try:
+                return query(storage)
+            finally:
+                self._readers.put(storage)
+
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self._reader_executor, run)
+
+    async def _write_claim(self, claim: DonationTokenClaim, write: SqlLiteWrite) -> None:
+        try:
+            await self._write(write)
+        finally:
+            if self._status_cache is not None:
+                self._status_cache.invalidate(claim)
+
+    async def add(self, claim: DonationTokenClaim, id: LnBitsPaymentLinkId, lnurl: Optional[LnUrl] = None) -> None:
+        if self._claim_filter is not None:
+            self._claim_filter.add(claim, id)
+        await self._write_claim(claim, lambda storage: storage.add(claim, id, lnurl))
+
+    async def save_lnurl(self, claim: DonationTokenClaim, lnurl: LnUrl) -> None:
+        await self._write(lambda storage: storage.save_lnurl(claim, lnurl))
+
+    async def change_status(self, claim: DonationTokenClaim, status: Status) -> None:
+        await self._write_claim(claim, lambda storage: storage.change_status(claim, status))
+
+    async def save_success(
+        self,
+        claim: DonationTokenClaim,
+        payment_hash: PaymentHash,
+        donation_key: DonationKey,
+        key_id: Optional[str] = None,
+    ) -> bool:
+        saved: List[bool] = []
+        await self._write_claim(
+            claim, lambda storage: saved.append(storage.save_success(claim, payment_hash, donation_key, key_id))
+        )
+
+        return saved[0]
+
+    # Webhooks for pay links that were never created are answered by the claim filter
+    async def get_claim_by_id(self, id: LnBitsPaymentLinkId) -> Optional[DonationTokenClaim]:
+        if self._claim_filter is not None and not self._claim_filter.might_have_link(id):
+            return None
+
+        claim = await self._read(lambda storage: storage.get_claim_by_id(id))
+        if claim is None and self._claim_filter is not None:
+            self._claim_filter.false_positive("links")
+
+        return claim
+
+    async def get_claim_status(self, claim: DonationTokenClaim) -> Optional[Tuple[Optional[DonationKey], List[str]]]:
+        cached = self._status_cache.get(claim) if self._status_cache is not None else None
+        if cached is not None:
+            return cached
+
+        if not self._might_have_claim(claim):
+            return None
+
+        version = self._status_cache.version() if self._status_cache is not None else 0
+        status = await self._read(lambda storage: storage.get_claim_status(claim))
+        if status is None:
+            self._claim_missing()
+        elif self._status_cache is not None:
+            self._status_cache.put(claim, status, version)
+
+        return status
+
+    async def get_claim(self, claim: DonationTokenClaim) -> Optional[LnBitsPaymentLinkId]:
+        if not self._might_have_claim(claim):
+            return None
+
+        id = await self._read(lambda storage: storage.get_claim(claim))
+        if id is None:
+            self._claim_missing()
+
+        return id
+
+    async def get_lnurl(self, claim: DonationTokenClaim) -> Optional[LnUrl]:
+        if not self._might_have_claim(claim):
+            return None
+
+        # Also None for claims created before the lnurl column, not counted as a false positive
+        return await self._read(lambda storage: storage.get_lnurl(claim))
+
+    def _might_have_claim(self, claim: DonationTokenClaim) -> bool:
+        return self._claim_filter is None or self._claim_filter.might_have_claim(claim)
+
+    def _claim_missing(self) -> None:
+        if self._claim_filter is not None:
+            self._claim_filter.false_positive("claims")
+
+    async def is_payment_hashed_used(self, payment_hash: PaymentHash) -> bool:
+        return await self._read(lambda storage: storage.is_payment_hashed_used(payment_hash))
+
+    async def add_pooled_pay_link(self, id: LnBitsPaymentLinkId, lnurl: LnUrl) -> None:
+        await self._write(lambda storage: storage.add_pooled_pay_link(id, lnurl))
+
+    async def count_pooled_pay_links(self) -> int:
+        return await self._read(lambda storage: storage.count_pooled_pay_links())
+
+    async def ping(self) -> None:
+        await self._read(lambda storage: storage.ping())
+
+    async def add_from_pool(self, claim: DonationTokenClaim) -> Optional[Tuple[LnBitsPaymentLinkId, LnUrl]]:
+        if self._claim_filter is not None:
+            self._claim_filter.add_claim(claim)
+
+        # Writes return nothing so they can be group committed, results are passed out through the closure
+        taken: List[Optional[Tuple[LnBitsPaymentLinkId, LnUrl]]] = []
+        await self._write_claim(claim, lambda storage: taken.append(storage.add_from_pool(claim)))
+
+        # The pay link is only known now, its webhook can't come before its LNURL was returned
+        if self._claim_filter is not None and taken[0] is not None:
+            self._claim_filter.add_link(taken[0][0])
+
+        return taken[0]
+
+    async def enqueue_callback(self, payment_hash: PaymentHash, body: str) -> bool:
+        enqueued: List[bool] = []
+        await self._write(lambda storage: enqueued.append(storage.enqueue_callback(payment_hash, body)))
+
+        return enqueued[0]
+
+    async def take_callback(self, max_attempts: int) -> Optional[Tuple[PaymentHash, str]]:
+        taken: List[Optional[Tuple[PaymentHash, str]]] = []
+        await self._write(lambda storage: taken.append(storage.take_callback(max_attempts)))
+
+        return taken[0]
+
+    async def finish_callback(self, payment_hash: PaymentHash, state: str) -> None:
+        await self._write(lambda storage: storage.finish_callback(payment_hash, state))
+
+    async def recover_callbacks(self, max_attempts: int) -> RecoveredCallbacks:
+        recovered: List[RecoveredCallbacks] = []
+        await self._write(lambda storage: recovered.append(storage.recover_callbacks(max_attempts)))
+
+        return recovered[0]
+
+    async def prune_callbacks(self, before: float) -> int:
+        pruned: List[int] = []
+        await self._write(lambda storage: pruned.append(storage.prune_callbacks(before)))
+
+        return pruned[0]
+
+    async def count_pending_callbacks(self) -> int:
+        return await self._read(lambda storage: storage.count_pending_callbacks())
+
+    async def get_pending_claims(self, after: str, limit: int) -> List[PendingClaim]:
+        return await self._read(lambda storage: storage.get_pending_claims(after, limit))
+
+    async def expire_claim(self, claim: DonationTokenClaim) -> bool:
+        expired: List[bool] = []
+        await self._write_claim(claim, lambda storage: expired.append(storage.expire_claim(claim)))
+
+        return expired[0]
+
+    async def get_donation_keys(self, after: str, limit: int) -> List[IssuedDonationKey]:
+        return await self._read(lambda storage: storage.get_donation_keys(after, limit))
+
+    # Streams the claims table into the claim filter, a page per read so requests are served in between, and returns
+    # how many claims were loaded. Pages are small as they are added to the filter on the event loop.
+    async def load_claim_filter(self, page_size: int = 1000) -> int:
+        if self._claim_filter is None:
+            return 0
+
+        after = ""
+        loaded = 0
+        while True:
+            page = await self._read(lambda storage: storage.get_claim_ids(after, page_size))
+            for claim, id in page:
+                self._claim_filter.add(claim, id)
+            loaded += len(page)
+            if len(page) < page_size:
+                break
+            after = page[-1][0]
+
+        self._claim_filter.loaded = True
+
+        return loaded
+
+    async def replace_donation_keys(
+        self, keys: List[Tuple[DonationTokenClaim, DonationKey]], key_id: Optional[str] = None
+    ) -> int:
+        replaced: List[int] = []
+        try:
+            await self._write(lambda storage: replaced.append(storage.replace_donation_keys(keys, key_id)))
+        finally:
+            if self._status_cache is not None:
+                for claim, _ in keys:
+                    self._status_cache.invalidate(claim)
+
+        return replaced[0]
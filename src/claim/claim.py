@@ -1,4 +1,6 @@
 from typing import NewType
 
-
 DonationTokenClaim = NewType("DonationTokenClaim", str)
+
+# Longer claims are rejected before any storage lookup
+CLAIM_MAX_LENGTH = 1024
@@ -0,0 +1,43 @@
+import asyncio
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+from claim.claim import DonationTokenClaim
+from claim.donation_key import DonationKey
+
+
+class _ClaimEventsEntry:
+    def __init__(self) -> None:
+        self.key: asyncio.Future[DonationKey] = asyncio.get_running_loop().create_future()
+        self.subscribers = 0
+
+
+# In-process pub/sub of issued donation keys. All waiters of a claim share one future, so an idle waiter costs
+# a single suspended task, and entries only live while somebody is subscribed.
+class ClaimEvents:
+    def __init__(self) -> None:
+        self._entries: Dict[DonationTokenClaim, _ClaimEventsEntry] = {}
+
+    # Subscribe before reading the current status, otherwise a key published in between is missed
+    @contextmanager
+    def subscribe(self, claim: DonationTokenClaim) -> Iterator["asyncio.Future[DonationKey]"]:
+        entry = self._entries.get(claim)
+        if entry is None:
+            entry = _ClaimEventsEntry()
+            self._entries[claim] = entry
+
+        entry.subscribers += 1
+        try:
+            yield entry.key
+        finally:
+            entry.subscribers -= 1
+            if entry.subscribers == 0:
+                del self._entries[claim]
+
+    def publish(self, claim: DonationTokenClaim, key: DonationKey) -> None:
+        entry = self._entries.get(claim)
+        if entry is not None and not entry.key.done():
+            entry.key.set_result(key)
+
+    def __len__(self) -> int:
+        return len(self._entries)
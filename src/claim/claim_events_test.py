@@ -0,0 +1,43 @@
+import asyncio
+
+from claim.claim import DonationTokenClaim
+from claim.claim_events import ClaimEvents
+from claim.donation_key import DonationKey
+
+claim_A = DonationTokenClaim("A")
+claim_B = DonationTokenClaim("B")
+key_A = DonationKey("A/XY12==")
+
+
+def test_waiters_receive_published_key() -> None:
+    events = ClaimEvents()
+
+    async def wait() -> DonationKey:
+        with events.subscribe(claim_A) as key:
+            return await key
+
+    async def run() -> None:
+        waiters = asyncio.gather(*[wait() for _ in range(1000)])
+        await asyncio.sleep(0)
+        assert len(events) == 1
+
+        events.publish(claim_B, DonationKey("other"))
+        events.publish(claim_A, key_A)
+
+        assert await waiters == [key_A] * 1000
+        assert len(events) == 0
+
+    asyncio.run(run())
+
+
+def test_publish_without_subscribers_is_ignored() -> None:
+    events = ClaimEvents()
+
+    async def run() -> None:
+        events.publish(claim_A, key_A)
+        with events.subscribe(claim_A) as key:
+            assert not key.done()
+
+    asyncio.run(run())
+
+    assert len(events) == 0
@@ -0,0 +1,129 @@
+import hashlib
+import math
+from typing import List
+
+from claim.claim import DonationTokenClaim
+from lnbits import LnBitsPaymentLinkId
+from metrics import REGISTRY
+
+# "miss" is answered without the database, "maybe" goes to it, "false_positive" counts the maybes it didn't have
+CLAIM_FILTER_LOOKUPS = REGISTRY.counter(
+    "claim_filter_lookups", "Claim and pay link lookups by the claim filter", ["filter", "result"]
+)
+
+
+# Fixed size bit array with k hash functions, derived from one blake2b digest by double hashing. Sized so that
+# capacity items give error_rate false positives, more items make them more likely.
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        self.capacity = capacity
+        self._size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+        self.items = 0
+
+    def _positions(self, key: str) -> List[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+
+        return [(first + i * second) % self._size for i in range(self._hashes)]
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.items += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._bits)
+
+    # Expected for the items added so far, assuming they are distinct
+    @property
+    def false_positive_rate(self) -> float:
+        return float((1 - math.exp(-self._hashes * self.items / self._size)) ** self._hashes)
+
+
+# Bloom filters added as the previous one fills up, each twice as large with half the error rate, so the combined
+# false positive rate stays below twice error_rate however many items are added
+class ScalableBloomFilter:
+    def __init__(self, initial_capacity: int, error_rate: float) -> None:
+        self._error_rate = error_rate
+        self._filters = [BloomFilter(initial_capacity, error_rate / 2)]
+
+    def add(self, key: str) -> None:
+        last = self._filters[-1]
+        if last.items >= last.capacity:
+            last = BloomFilter(last.capacity * 2, self._error_rate / 2 ** (len(self._filters) + 1))
+            self._filters.append(last)
+        last.add(key)
+
+    def __contains__(self, key: str) -> bool:
+        return any(key in bloom_filter for bloom_filter in self._filters)
+
+    @property
+    def items(self) -> int:
+        return sum(bloom_filter.items for bloom_filter in self._filters)
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(bloom_filter.memory_bytes for bloom_filter in self._filters)
+
+    @property
+    def false_positive_rate(self) -> float:
+        return 1 - math.prod(1 - bloom_filter.false_positive_rate for bloom_filter in self._filters)
+
+
+# Claims and pay link ids in the claims table, so lookups of ones that don't exist are answered without the database.
+# Filled from the claims table at startup, until it is loaded everything might exist. Removed claims stay in the
+# filter, which only costs a database lookup. Only valid while this process is the only one adding claims.
+class ClaimFilter:
+    def __init__(self, initial_capacity: int, error_rate: float) -> None:
+        self._claims = ScalableBloomFilter(initial_capacity, error_rate)
+        self._links = ScalableBloomFilter(initial_capacity, error_rate)
+        self.loaded = False
+
+    # Before the claim is written, so a reader never misses a claim that was committed
+    def add(self, claim: DonationTokenClaim, id: LnBitsPaymentLinkId) -> None:
+        self.add_claim(claim)
+        self.add_link(id)
+
+    def add_claim(self, claim: DonationTokenClaim) -> None:
+        self._claims.add(claim)
+
+    def add_link(self, id: LnBitsPaymentLinkId) -> None:
+        self._links.add(str(id))
+
+    def might_have_claim(self, claim: DonationTokenClaim) -> bool:
+        return self._lookup("claims", claim in self._claims)
+
+    def might_have_link(self, id: LnBitsPaymentLinkId) -> bool:
+        return self._lookup("links", str(id) in self._links)
+
+    def _lookup(self, name: str, found: bool) -> bool:
+        if not self.loaded:
+            return True
+
+        CLAIM_FILTER_LOOKUPS.labels(name, "maybe" if found else "miss").inc()
+
+        return found
+
+    # After a "maybe" the database didn't have
+    def false_positive(self, name: str) -> None:
+        if self.loaded:
+            CLAIM_FILTER_LOOKUPS.labels(name, "false_positive").inc()
+
+    @property
+    def items(self) -> int:
+        return self._claims.items
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._claims.memory_bytes + self._links.memory_bytes
+
+    @property
+    def false_positive_rate(self) -> float:
+        return self._claims.false_positive_rate
@@ -0,0 +1,42 @@
+from claim.claim import DonationTokenClaim
+from claim.claim_filter import BloomFilter, ClaimFilter, ScalableBloomFilter
+from lnbits import LnBitsPaymentLinkId
+
+
+def test_bloom_filter_has_no_false_negatives_and_few_false_positives() -> None:
+    bloom_filter = BloomFilter(10000, 0.01)
+    for i in range(10000):
+        bloom_filter.add(f"claim-{i}")
+
+    assert all(f"claim-{i}" in bloom_filter for i in range(10000))
+    false_positives = sum(f"unknown-{i}" in bloom_filter for i in range(10000))
+    assert false_positives < 200
+    assert 0.005 < bloom_filter.false_positive_rate < 0.02
+    # About 9.6 bits per item at 1 %
+    assert bloom_filter.memory_bytes < 10000 * 10 / 8 + 1
+
+
+def test_scalable_bloom_filter_keeps_its_error_rate_when_growing() -> None:
+    bloom_filter = ScalableBloomFilter(100, 0.01)
+    for i in range(5000):
+        bloom_filter.add(f"claim-{i}")
+
+    assert bloom_filter.items == 5000
+    assert all(f"claim-{i}" in bloom_filter for i in range(5000))
+    assert sum(f"unknown-{i}" in bloom_filter for i in range(10000)) < 200
+    assert bloom_filter.false_positive_rate < 0.02
+
+
+def test_claim_filter_might_have_everything_until_loaded() -> None:
+    claim_filter = ClaimFilter(100, 0.01)
+    claim_filter.add(DonationTokenClaim("A"), LnBitsPaymentLinkId(1))
+
+    assert claim_filter.might_have_claim(DonationTokenClaim("B"))
+    assert claim_filter.might_have_link(LnBitsPaymentLinkId(2))
+
+    claim_filter.loaded = True
+
+    assert claim_filter.might_have_claim(DonationTokenClaim("A"))
+    assert claim_filter.might_have_link(LnBitsPaymentLinkId(1))
+    assert not claim_filter.might_have_claim(DonationTokenClaim("B"))
+    assert not claim_filter.might_have_link(LnBitsPaymentLinkId(2))
@@ -0,0 +1,61 @@
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from claim.claim import DonationTokenClaim
+from claim.donation_key import DonationKey
+
+ClaimStatus = Tuple[Optional[DonationKey], List[str]]
+
+
+# Bounded LRU of get_claim_status responses with a TTL, so clients polling a pending claim are served from memory.
+# Writes invalidate the claim. A read that raced with a write is not cached, the invalidation counter tells them apart.
+# When workers share the storage, writes of the other workers can't invalidate it, so paid_only keeps just paid
+# claims, whose status no longer changes.
+class ClaimStatusCache:
+    def __init__(
+        self, max_size: int, ttl_seconds: float, now: Callable[[], float] = time.monotonic, paid_only: bool = False
+    ) -> None:
+        self._max_size = max_size
+        self._paid_only = paid_only
+        self._ttl_seconds = ttl_seconds
+        self._now = now
+        self._entries: OrderedDict[DonationTokenClaim, Tuple[float, ClaimStatus]] = OrderedDict()
+        self._invalidations = 0
+
+    def get(self, claim: DonationTokenClaim) -> Optional[ClaimStatus]:
+        entry = self._entries.get(claim)
+        if entry is None:
+            return None
+
+        expires_at, status = entry
+        if expires_at <= self._now():
+            del self._entries[claim]
+            return None
+
+        self._entries.move_to_end(claim)
+
+        return status
+
+    # Taken before reading from the database and passed back to put
+    def version(self) -> int:
+        return self._invalidations
+
+    def put(self, claim: DonationTokenClaim, status: ClaimStatus, version: int) -> None:
+        if version != self._invalidations or self._max_size <= 0:
+            return
+
+        if self._paid_only and status[0] is None:
+            return
+
+        self._entries[claim] = (self._now() + self._ttl_seconds, status)
+        self._entries.move_to_end(claim)
+        if len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, claim: DonationTokenClaim) -> None:
+        self._invalidations += 1
+        self._entries.pop(claim, None)
+
+    def __len__(self) -> int:
+        return len(self._entries)
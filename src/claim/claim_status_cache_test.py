@@ -0,0 +1,43 @@
+from typing import List
+
+from claim.claim import DonationTokenClaim
+from claim.claim_status_cache import ClaimStatusCache
+
+claim_A = DonationTokenClaim("A")
+claim_B = DonationTokenClaim("B")
+claim_C = DonationTokenClaim("C")
+status = (None, ["[1970-01-01T01:00:00] Claim created, waiting for payment..."])
+
+
+def test_least_recently_used_is_evicted() -> None:
+    cache = ClaimStatusCache(2, 60)
+    cache.put(claim_A, status, cache.version())
+    cache.put(claim_B, status, cache.version())
+    cache.get(claim_A)
+    cache.put(claim_C, status, cache.version())
+
+    assert cache.get(claim_A) == status
+    assert cache.get(claim_B) is None
+    assert cache.get(claim_C) == status
+
+
+def test_entries_expire() -> None:
+    now: List[float] = [0]
+    cache = ClaimStatusCache(2, 60, lambda: now[0])
+    cache.put(claim_A, status, cache.version())
+
+    now[0] = 59
+    assert cache.get(claim_A) == status
+
+    now[0] = 60
+    assert cache.get(claim_A) is None
+    assert len(cache) == 0
+
+
+def test_read_racing_with_write_is_not_cached() -> None:
+    cache = ClaimStatusCache(2, 60)
+    version = cache.version()
+    cache.invalidate(claim_A)
+    cache.put(claim_A, status, version)
+
+    assert cache.get(claim_A) is None
@@ -1,26 +1,59 @@
+from contextlib import contextmanager
 from datetime import datetime
 from abc import ABCMeta, abstractmethod
 from sqlite3 import Connection
-from typing import Callable, List, Optional, Tuple
+from typing import Callable, Iterator, List, NamedTuple, Optional, Tuple
 
 from claim.claim import DonationTokenClaim
 from claim.donation_key import DonationKey
-from claim.statuses import CREATED_STATUS, SUCCESS_STATUS
+from claim.migrations import migrate, verify_indexes
+from claim.statuses import CREATED_STATUS, SUCCESS_STATUS, Status, render_status
 
-from lnbits import LnBitsPaymentLinkId, PaymentHash
+from lnbits import LnBitsPaymentLinkId, LnUrl, PaymentHash
+from metrics import REGISTRY
+
+# Claim, its pay link and when it was created (None for claims without a status row)
+PendingClaim = Tuple[DonationTokenClaim, LnBitsPaymentLinkId, Optional[float]]
+
+# Paid claim, its donation key and the id of the key that signed it (None for keys issued before key ids were stored)
+IssuedDonationKey = Tuple[DonationTokenClaim, DonationKey, Optional[str]]
+
+
+# Webhooks put back in the queue and webhooks failed as they were taken too often
+class RecoveredCallbacks(NamedTuple):
+    recovered: int
+    failed: int
+
+
+# Raised by add and add_from_pool when the claim already exists, e.g. created concurrently by another worker
+class ClaimExistsError(Exception):
+    def __init__(self, claim: DonationTokenClaim) -> None:
+        super().__init__(f"Claim {claim} already exists")
+        self.claim = claim
 
 
 class ClaimStorage(metaclass=ABCMeta):
     @abstractmethod
-    def add(self, claim: DonationTokenClaim, id: LnBitsPaymentLinkId) -> None:
+    def add(self, claim: DonationTokenClaim, id: LnBitsPaymentLinkId, lnurl: Optional[LnUrl] = None) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def save_lnurl(self, claim: DonationTokenClaim, lnurl: LnUrl) -> None:
         raise NotImplementedError()
 
     @abstractmethod
-    def change_status(self, claim: DonationTokenClaim, status: str) -> None:
+    def change_status(self, claim: DonationTokenClaim, status: Status) -> None:
         raise NotImplementedError()
 
+    # Returns False when the claim was already paid, the first payment keeps its donation key
     @abstractmethod
-    def save_success(self, claim: DonationTokenClaim, payment_hash: PaymentHash, donation_key: DonationKey) -> None:
+    def save_success(
+        self,
+        claim: DonationTokenClaim,
+        payment_hash: PaymentHash,
+        donation_key: DonationKey,
+        key_id: Optional[str] = None,
+    ) -> bool:
         raise NotImplementedError()
 
     @abstractmethod
@@ -35,41 +68,151 @@ class ClaimStorage(metaclass=ABCMeta):
     def get_claim(self, claim: DonationTokenClaim) -> Optional[LnBitsPaymentLinkId]:
         raise NotImplementedError()
 
+    @abstractmethod
+    def get_lnurl(self, claim: DonationTokenClaim) -> Optional[LnUrl]:
+        raise NotImplementedError()
+
     @abstractmethod
     def is_payment_hashed_used(self, payment_hash: PaymentHash) -> bool:
         raise NotImplementedError()
 
+    @abstractmethod
+    def add_pooled_pay_link(self, id: LnBitsPaymentLinkId, lnurl: LnUrl) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def count_pooled_pay_links(self) -> int:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def ping(self) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def add_from_pool(self, claim: DonationTokenClaim) -> Optional[Tuple[LnBitsPaymentLinkId, LnUrl]]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def enqueue_callback(self, payment_hash: PaymentHash, body: str) -> bool:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def take_callback(self, max_attempts: int) -> Optional[Tuple[PaymentHash, str]]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def finish_callback(self, payment_hash: PaymentHash, state: str) -> None:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def recover_callbacks(self, max_attempts: int) -> RecoveredCallbacks:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def prune_callbacks(self, before: float) -> int:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def count_pending_callbacks(self) -> int:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_pending_claims(self, after: str, limit: int) -> List[PendingClaim]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def expire_claim(self, claim: DonationTokenClaim) -> bool:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def get_donation_keys(self, after: str, limit: int) -> List[IssuedDonationKey]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def replace_donation_keys(
+        self, keys: List[Tuple[DonationTokenClaim, DonationKey]], key_id: Optional[str] = None
+    ) -> int:
+        raise NotImplementedError()
+
+
+# Statements are kept as constants so every call hits the connection's prepared statement cache
+INSERT_CLAIM = """
+    INSERT INTO claims (claim, lnbit_payment_link_id, lnurl) VALUES (?, ?, ?) ON CONFLICT (claim) DO NOTHING
+"""
+INSERT_STATUS = "INSERT INTO status_events (claim, created_at, code, actual, expected) VALUES (?, ?, ?, ?, ?)"
+UPDATE_SUCCESS = """
+    UPDATE claims SET payment_hash = ?, donation_key = ?, key_id = ? WHERE claim = ? AND payment_hash IS NULL
+"""
+UPDATE_LNURL = "UPDATE claims SET lnurl = ? WHERE claim = ?"
+INSERT_POOLED_PAY_LINK = "INSERT INTO pay_link_pool (lnbit_payment_link_id, lnurl) VALUES (?, ?)"
+TAKE_POOLED_PAY_LINK = """
+    DELETE FROM pay_link_pool WHERE rowid = (SELECT rowid FROM pay_link_pool ORDER BY rowid LIMIT 1)
+    RETURNING lnbit_payment_link_id, lnurl
+"""
+SELECT_CLAIM_STATUS = """
+    SELECT claims.donation_key, status_events.created_at, status_events.code, status_events.actual,
+        status_events.expected
+    FROM claims LEFT JOIN status_events ON status_events.claim = claims.claim
+    WHERE claims.claim = :claim
+    ORDER BY status_events.created_at, status_events.id
+"""
+
+CALLBACK_PENDING = "pending"
+CALLBACK_IN_FLIGHT = "in_flight"
+CALLBACK_DONE = "done"
+CALLBACK_FAILED = "failed"
+
+INSERT_CALLBACK = "INSERT OR IGNORE INTO callback_queue (payment_hash, body, state, created_at) VALUES (?, ?, ?, ?)"
+TAKE_CALLBACK = """
+    UPDATE callback_queue SET state = :in_flight, attempts = attempts + 1
+    WHERE payment_hash = (
+        SELECT payment_hash FROM callback_queue
+        WHERE state = :pending AND attempts < :max_attempts
+        ORDER BY created_at
+        LIMIT 1
+    )
+    RETURNING payment_hash, body
+"""
+SELECT_PENDING_CLAIMS = """
+    SELECT claim, lnbit_payment_link_id,
+        (SELECT MIN(created_at) FROM status_events WHERE status_events.claim = claims.claim)
+    FROM claims
+    WHERE payment_hash IS NULL AND claim > :after
+    ORDER BY claim
+    LIMIT :limit
+"""
+SELECT_DONATION_KEYS = """
+    SELECT claim, donation_key, key_id FROM claims
+    WHERE payment_hash IS NOT NULL AND claim > :after
+    ORDER BY claim
+    LIMIT :limit
+"""
+SELECT_CLAIM_IDS = """
+    SELECT claim, lnbit_payment_link_id FROM claims WHERE claim > :after ORDER BY claim LIMIT :limit
+"""
+UPDATE_DONATION_KEY = """
+    UPDATE claims SET donation_key = ?, key_id = ? WHERE claim = ? AND payment_hash IS NOT NULL
+"""
+UPDATE_CALLBACK_STATE = "UPDATE callback_queue SET state = ?, attempts = attempts + ? WHERE payment_hash = ?"
+
+SqlLiteWrite = Callable[["SqlLiteClaimStorage"], None]
+
+DB_QUERY_SECONDS = REGISTRY.histogram("db_query_seconds", "Time spent in claim storage methods", ["method"])
+
 
 class SqlLiteClaimStorage(ClaimStorage):
     def __init__(self, now_date_function: Callable[[], datetime], connction: Connection) -> None:
         self._now_date_function = now_date_function
         self._connection = connction
 
-    def create_tables(self) -> None:
-        self._connection.execute(
-            """
-            CREATE TABLE claims (
-                claim text NOT NULL PRIMARY KEY, 
-                lnbit_payment_link_id int NOT NULL,
-                payment_hash text NULL UNIQUE,
-                donation_key text NULL
-            )
-        """
-        )
-        self._connection.execute("CREATE INDEX claims_payment_hash ON claims (payment_hash)")
-        self._connection.execute("CREATE INDEX claims_lnbit_payment_link_id ON claims (lnbit_payment_link_id)")
-        self._connection.execute(
-            """
-            CREATE TABLE statuses (
-                claim text NOT NULL, 
-                created_at timestamp,
-                status text NOT NULL
-            )
-        """
-        )
-        self._connection.execute("CREATE INDEX statuses_claim ON statuses (claim)")
-        self._connection.commit()
+    # Brings a new or older database to the current schema, returns how many migrations were applied
+    def create_tables(self) -> int:
+        applied = migrate(self._connection)
+        verify_indexes(self._connection)
+
+        return applied
 
+    @DB_QUERY_SECONDS.timed
     def get_claim(self, claim: DonationTokenClaim) -> Optional[LnBitsPaymentLinkId]:
         cur = self._connection.cursor()
         cur.execute("SELECT lnbit_payment_link_id FROM claims WHERE claim = :claim", {"claim": claim})
@@ -81,18 +224,224 @@ class SqlLiteClaimStorage(ClaimStorage):
 
         return LnBitsPaymentLinkId(row[0])
 
-    def add(self, claim: DonationTokenClaim, id: LnBitsPaymentLinkId) -> None:
-        self._connection.execute("INSERT INTO claims (claim, lnbit_payment_link_id) VALUES (?, ?)", (claim, id))
-        self._connection.commit()
-        self.change_status(claim, CREATED_STATUS)
+    @DB_QUERY_SECONDS.timed
+    def get_lnurl(self, claim: DonationTokenClaim) -> Optional[LnUrl]:
+        cur = self._connection.cursor()
+        cur.execute("SELECT lnurl FROM claims WHERE claim = :claim", {"claim": claim})
+        row = cur.fetchone()
+        cur.close()
 
-    def change_status(self, claim: DonationTokenClaim, status: str) -> None:
-        self._connection.execute(
-            "INSERT INTO statuses (claim, created_at, status) VALUES (?, ?, ?)",
-            (claim, self._now_date_function().timestamp(), status),
-        )
-        self._connection.commit()
+        if row is None or row[0] is None:
+            return None
+
+        return LnUrl(row[0])
+
+    # Takes the write lock up front, so processes sharing the file can't both read a row before either writes it
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # Joins the transaction opened by write_batch instead of committing on its own
+        if self._connection.in_transaction:
+            yield
+            return
+
+        with self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            yield
+
+    def _insert_status(self, claim: DonationTokenClaim, status: Status) -> None:
+        self._connection.execute(INSERT_STATUS, (claim, self._now_date_function().timestamp(), *status))
+
+    @DB_QUERY_SECONDS.timed
+    def add(self, claim: DonationTokenClaim, id: LnBitsPaymentLinkId, lnurl: Optional[LnUrl] = None) -> None:
+        with self._transaction():
+            if self._connection.execute(INSERT_CLAIM, (claim, id, lnurl)).rowcount == 0:
+                raise ClaimExistsError(claim)
+            self._insert_status(claim, CREATED_STATUS)
+
+    @DB_QUERY_SECONDS.timed
+    def save_lnurl(self, claim: DonationTokenClaim, lnurl: LnUrl) -> None:
+        with self._transaction():
+            self._connection.execute(UPDATE_LNURL, (lnurl, claim))
+
+    @DB_QUERY_SECONDS.timed
+    def change_status(self, claim: DonationTokenClaim, status: Status) -> None:
+        with self._transaction():
+            self._insert_status(claim, status)
+
+    @DB_QUERY_SECONDS.timed
+    def add_pooled_pay_link(self, id: LnBitsPaymentLinkId, lnurl: LnUrl) -> None:
+        with self._transaction():
+            self._connection.execute(INSERT_POOLED_PAY_LINK, (id, lnurl))
+
+    @DB_QUERY_SECONDS.timed
+    def count_pooled_pay_links(self) -> int:
+        cur = self._connection.cursor()
+        cur.execute("SELECT COUNT(*) FROM pay_link_pool")
+        row = cur.fetchone()
+        cur.close()
+
+        return int(row[0])
+
+    # Cheapest query that still needs a working connection, for the readiness probe
+    @DB_QUERY_SECONDS.timed
+    def ping(self) -> None:
+        self._connection.execute("SELECT 1").fetchone()
+
+    # Takes the oldest pooled pay link and binds it to the claim in one transaction, the pay link is deleted by the
+    # same statement that selects it, so no two claims get it
+    @DB_QUERY_SECONDS.timed
+    def add_from_pool(self, claim: DonationTokenClaim) -> Optional[Tuple[LnBitsPaymentLinkId, LnUrl]]:
+        with self._transaction():
+            rows = self._connection.execute(TAKE_POOLED_PAY_LINK).fetchall()
+
+            if len(rows) == 0:
+                return None
+
+            id, lnurl = LnBitsPaymentLinkId(rows[0][0]), LnUrl(rows[0][1])
+            self.add(claim, id, lnurl)
+
+        return id, lnurl
+
+    # Returns False when a webhook with the same payment hash was already queued
+    @DB_QUERY_SECONDS.timed
+    def enqueue_callback(self, payment_hash: PaymentHash, body: str) -> bool:
+        with self._transaction():
+            cur = self._connection.execute(
+                INSERT_CALLBACK, (payment_hash, body, CALLBACK_PENDING, self._now_date_function().timestamp())
+            )
+
+        return cur.rowcount == 1
+
+    # Marks the oldest pending webhook taken less than max_attempts times in flight, it stays in flight until
+    # finish_callback or recover_callbacks
+    @DB_QUERY_SECONDS.timed
+    def take_callback(self, max_attempts: int) -> Optional[Tuple[PaymentHash, str]]:
+        with self._transaction():
+            rows = self._connection.execute(
+                TAKE_CALLBACK,
+                {"in_flight": CALLBACK_IN_FLIGHT, "pending": CALLBACK_PENDING, "max_attempts": max_attempts},
+            ).fetchall()
+
+        if len(rows) == 0:
+            return None
+
+        return PaymentHash(rows[0][0]), str(rows[0][1])
+
+    @DB_QUERY_SECONDS.timed
+    def finish_callback(self, payment_hash: PaymentHash, state: str) -> None:
+        with self._transaction():
+            self._connection.execute(UPDATE_CALLBACK_STATE, (state, 0, payment_hash))
+
+    # Webhooks left in flight by a crash are processed again. Ones already taken max_attempts times failed, so a
+    # webhook that crashes the server isn't retried on every start. Returns how many were recovered and failed.
+    @DB_QUERY_SECONDS.timed
+    def recover_callbacks(self, max_attempts: int) -> RecoveredCallbacks:
+        with self._transaction():
+            failed = self._connection.execute(
+                "UPDATE callback_queue SET state = ? WHERE state IN (?, ?) AND attempts >= ?",
+                (CALLBACK_FAILED, CALLBACK_PENDING, CALLBACK_IN_FLIGHT, max_attempts),
+            )
+            recovered = self._connection.execute(
+                "UPDATE callback_queue SET state = ? WHERE state = ?", (CALLBACK_PENDING, CALLBACK_IN_FLIGHT)
+            )
+
+        return RecoveredCallbacks(recovered.rowcount, failed.rowcount)
+
+    @DB_QUERY_SECONDS.timed
+    def count_pending_callbacks(self) -> int:
+        cur = self._connection.cursor()
+        cur.execute("SELECT COUNT(*) FROM callback_queue WHERE state = ?", (CALLBACK_PENDING,))
+        row = cur.fetchone()
+        cur.close()
 
+        return int(row[0])
+
+    # Done webhooks queued before the timestamp `before`, kept until then so retries by LNbits are not queued again.
+    # Returns how many were deleted.
+    @DB_QUERY_SECONDS.timed
+    def prune_callbacks(self, before: float) -> int:
+        with self._transaction():
+            cur = self._connection.execute(
+                "DELETE FROM callback_queue WHERE state = ? AND created_at < ?", (CALLBACK_DONE, before)
+            )
+
+        return cur.rowcount
+
+    # Unpaid claims in pages ordered by claim, pass the last claim of a page as `after` to get the next one
+    @DB_QUERY_SECONDS.timed
+    def get_pending_claims(self, after: str, limit: int) -> List[PendingClaim]:
+        cur = self._connection.cursor()
+        cur.execute(SELECT_PENDING_CLAIMS, {"after": after, "limit": limit})
+        rows = cur.fetchall()
+        cur.close()
+
+        return [(DonationTokenClaim(row[0]), LnBitsPaymentLinkId(row[1]), row[2]) for row in rows]
+
+    # Drops an unpaid claim with its statuses, so the same claim can be created again with a new pay link and starts
+    # with fresh statuses. Returns False when the claim was paid or removed in the meantime.
+    @DB_QUERY_SECONDS.timed
+    def expire_claim(self, claim: DonationTokenClaim) -> bool:
+        with self._transaction():
+            cur = self._connection.execute("DELETE FROM claims WHERE claim = ? AND payment_hash IS NULL", (claim,))
+            if cur.rowcount != 1:
+                return False
+            self._connection.execute("DELETE FROM status_events WHERE claim = ?", (claim,))
+
+        return True
+
+    # Paid claims in pages ordered by claim, pass the last claim of a page as `after` to get the next one
+    @DB_QUERY_SECONDS.timed
+    def get_donation_keys(self, after: str, limit: int) -> List[IssuedDonationKey]:
+        cur = self._connection.cursor()
+        cur.execute(SELECT_DONATION_KEYS, {"after": after, "limit": limit})
+        rows = cur.fetchall()
+        cur.close()
+
+        return [(DonationTokenClaim(row[0]), DonationKey(row[1]), row[2]) for row in rows]
+
+    # All claims with their pay link in pages ordered by claim, for ClaimFilter
+    @DB_QUERY_SECONDS.timed
+    def get_claim_ids(self, after: str, limit: int) -> List[Tuple[DonationTokenClaim, LnBitsPaymentLinkId]]:
+        cur = self._connection.cursor()
+        cur.execute(SELECT_CLAIM_IDS, {"after": after, "limit": limit})
+        rows = cur.fetchall()
+        cur.close()
+
+        return [(DonationTokenClaim(row[0]), LnBitsPaymentLinkId(row[1])) for row in rows]
+
+    # All keys in one transaction, returns how many paid claims got a new key
+    @DB_QUERY_SECONDS.timed
+    def replace_donation_keys(
+        self, keys: List[Tuple[DonationTokenClaim, DonationKey]], key_id: Optional[str] = None
+    ) -> int:
+        with self._transaction():
+            replaced = self._connection.executemany(
+                UPDATE_DONATION_KEY, [(donation_key, key_id, claim) for claim, donation_key in keys]
+            ).rowcount
+
+        return replaced
+
+    # Group commit: runs every write in its own savepoint of one transaction, so the whole batch costs a single
+    # fsync and a failing write only rolls back itself. Returns the error of each write, None when it succeeded.
+    @DB_QUERY_SECONDS.timed
+    def write_batch(self, writes: List[SqlLiteWrite]) -> List[Optional[Exception]]:
+        errors: List[Optional[Exception]] = []
+
+        with self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            for write in writes:
+                self._connection.execute("SAVEPOINT write")
+                try:
+                    write(self)
+                    errors.append(None)
+                except Exception as e:
+                    self._connection.execute("ROLLBACK TO write")
+                    errors.append(e)
+                self._connection.execute("RELEASE write")
+
+        return errors
+
+    @DB_QUERY_SECONDS.timed
     def get_claim_by_id(self, id: LnBitsPaymentLinkId) -> Optional[DonationTokenClaim]:
         cur = self._connection.cursor()
         cur.execute(
@@ -107,32 +456,38 @@ class SqlLiteClaimStorage(ClaimStorage):
 
         return DonationTokenClaim(row[0])
 
+    @DB_QUERY_SECONDS.timed
     def get_claim_status(self, claim: DonationTokenClaim) -> Optional[Tuple[Optional[DonationKey], List[str]]]:
         cur = self._connection.cursor()
-        cur.execute("SELECT created_at, status FROM statuses WHERE claim = :claim", {"claim": claim})
-        status_rows = cur.fetchall()
+        cur.execute(SELECT_CLAIM_STATUS, {"claim": claim})
+        rows = cur.fetchall()
         cur.close()
 
-        if status_rows is None:
+        if len(rows) == 0:
             return None
 
-        cur = self._connection.cursor()
-        cur.execute("SELECT donation_key FROM claims WHERE claim = :claim", {"claim": claim})
-        row = cur.fetchone()
-        cur.close()
-
-        if row is None:
-            return None
+        return rows[0][0], [
+            f"[{datetime.fromtimestamp(created_at).isoformat()}] {render_status(code, actual, expected)}"
+            for _, created_at, code, actual, expected in rows
+            if code is not None
+        ]
 
-        return row[0], [f"[{datetime.fromtimestamp(row[0]).isoformat()}] {row[1]}" for row in status_rows]
+    @DB_QUERY_SECONDS.timed
+    def save_success(
+        self,
+        claim: DonationTokenClaim,
+        payment_hash: PaymentHash,
+        donation_key: DonationKey,
+        key_id: Optional[str] = None,
+    ) -> bool:
+        with self._transaction():
+            if self._connection.execute(UPDATE_SUCCESS, (payment_hash, donation_key, key_id, claim)).rowcount == 0:
+                return False
+            self._insert_status(claim, SUCCESS_STATUS)
 
-    def save_success(self, claim: DonationTokenClaim, payment_hash: PaymentHash, donation_key: DonationKey) -> None:
-        self._connection.execute(
-            "UPDATE claims SET payment_hash = ?, donation_key = ? WHERE claim = ?", (payment_hash, donation_key, claim)
-        )
-        self._connection.commit()
-        self.change_status(claim, SUCCESS_STATUS)
+        return True
 
+    @DB_QUERY_SECONDS.timed
     def is_payment_hashed_used(self, payment_hash: PaymentHash) -> bool:
         cur = self._connection.cursor()
         cur.execute("SELECT claim FROM claims WHERE payment_hash = :payment_hash", {"payment_hash": payment_hash})
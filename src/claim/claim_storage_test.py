@@ -1,16 +1,35 @@
-import os
+import asyncio
+import re
 import sqlite3
+import threading
 import pytest
 
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Coroutine, List, Optional, Tuple, TypeVar
 
+from claim.async_claim_storage import DB_WAIT_SECONDS, AsyncClaimStorage, AsyncSqlLiteClaimStorage
 from claim.claim import DonationTokenClaim
-from claim.claim_storage import ClaimStorage, SqlLiteClaimStorage
+from claim.claim_filter import CLAIM_FILTER_LOOKUPS, ClaimFilter
+from claim.claim_status_cache import ClaimStatusCache
+from claim.claim_storage import (
+    CALLBACK_DONE,
+    ClaimExistsError,
+    ClaimStorage,
+    IssuedDonationKey,
+    PendingClaim,
+    RecoveredCallbacks,
+    SqlLiteClaimStorage,
+)
+from claim.postgres_claim_storage import AsyncPostgresClaimStorage
+from claim.sql_database import Row, SqlConnection, SqlDatabase
 
 from claim.donation_key import DonationKey
-from lnbits import LnBitsPaymentLinkId, PaymentHash
+from claim.migrations import MIGRATIONS, migrate_statuses
+from claim.statuses import EXPIRED_STATUS, Status, StatusCode, amount_too_low_status
+from lnbits import LnBitsPaymentLinkId, LnUrl, PaymentHash
 
-dirname = os.path.dirname(__file__)
+T = TypeVar("T")
 
 claim_A = DonationTokenClaim("A")
 link_1 = LnBitsPaymentLinkId(1)
@@ -18,15 +37,14 @@ link_1 = LnBitsPaymentLinkId(1)
 claim_B = DonationTokenClaim("B")
 link_2 = LnBitsPaymentLinkId(2)
 
+MAX_ATTEMPTS = 5
+
 
 def test_now() -> datetime:
     return datetime.fromtimestamp(0)
 
 
-def create_fresh_sql_live_storage() -> SqlLiteClaimStorage:
-    db_path = f"{dirname}/test_database.db"
-    if os.path.exists(db_path):
-        os.remove(db_path)
+def create_fresh_sql_live_storage(db_path: str) -> SqlLiteClaimStorage:
     sql_lite_connection = sqlite3.connect(db_path)
     storage = SqlLiteClaimStorage(test_now, sql_lite_connection)
     storage.create_tables()
@@ -34,11 +52,173 @@ def create_fresh_sql_live_storage() -> SqlLiteClaimStorage:
     return storage
 
 
-@pytest.mark.parametrize(
-    "storage",
-    [create_fresh_sql_live_storage()],
-)
-def test_storage_happy_path(storage: ClaimStorage) -> None:
+# Runs the contract tests written against ClaimStorage on an AsyncClaimStorage
+class BlockingClaimStorage(ClaimStorage):
+    def __init__(self, storage: AsyncClaimStorage) -> None:
+        self._storage = storage
+
+    def _run(self, query: Callable[[], Coroutine[None, None, T]]) -> T:
+        return asyncio.run(query())
+
+    def add(self, claim: DonationTokenClaim, id: LnBitsPaymentLinkId, lnurl: Optional[LnUrl] = None) -> None:
+        self._run(lambda: self._storage.add(claim, id, lnurl))
+
+    def save_lnurl(self, claim: DonationTokenClaim, lnurl: LnUrl) -> None:
+        self._run(lambda: self._storage.save_lnurl(claim, lnurl))
+
+    def change_status(self, claim: DonationTokenClaim, status: Status) -> None:
+        self._run(lambda: self._storage.change_status(claim, status))
+
+    def save_success(
+        self,
+        claim: DonationTokenClaim,
+        payment_hash: PaymentHash,
+        donation_key: DonationKey,
+        key_id: Optional[str] = None,
+    ) -> bool:
+        return self._run(lambda: self._storage.save_success(claim, payment_hash, donation_key, key_id))
+
+    def get_claim_by_id(self, id: LnBitsPaymentLinkId) -> Optional[DonationTokenClaim]:
+        return self._run(lambda: self._storage.get_claim_by_id(id))
+
+    def get_claim_status(self, claim: DonationTokenClaim) -> Optional[Tuple[Optional[DonationKey], List[str]]]:
+        return self._run(lambda: self._storage.get_claim_status(claim))
+
+    def get_claim(self, claim: DonationTokenClaim) -> Optional[LnBitsPaymentLinkId]:
+        return self._run(lambda: self._storage.get_claim(claim))
+
+    def get_lnurl(self, claim: DonationTokenClaim) -> Optional[LnUrl]:
+        return self._run(lambda: self._storage.get_lnurl(claim))
+
+    def is_payment_hashed_used(self, payment_hash: PaymentHash) -> bool:
+        return self._run(lambda: self._storage.is_payment_hashed_used(payment_hash))
+
+    def add_pooled_pay_link(self, id: LnBitsPaymentLinkId, lnurl: LnUrl) -> None:
+        self._run(lambda: self._storage.add_pooled_pay_link(id, lnurl))
+
+    def count_pooled_pay_links(self) -> int:
+        return self._run(lambda: self._storage.count_pooled_pay_links())
+
+    def ping(self) -> None:
+        self._run(lambda: self._storage.ping())
+
+    def add_from_pool(self, claim: DonationTokenClaim) -> Optional[Tuple[LnBitsPaymentLinkId, LnUrl]]:
+        return self._run(lambda: self._storage.add_from_pool(claim))
+
+    def enqueue_callback(self, payment_hash: PaymentHash, body: str) -> bool:
+        return self._run(lambda: self._storage.enqueue_callback(payment_hash, body))
+
+    def take_callback(self, max_attempts: int) -> Optional[Tuple[PaymentHash, str]]:
+        return self._run(lambda: self._storage.take_callback(max_attempts))
+
+    def finish_callback(self, payment_hash: PaymentHash, state: str) -> None:
+        self._run(lambda: self._storage.finish_callback(payment_hash, state))
+
+    def recover_callbacks(self, max_attempts: int) -> RecoveredCallbacks:
+        return self._run(lambda: self._storage.recover_callbacks(max_attempts))
+
+    def prune_callbacks(self, before: float) -> int:
+        return self._run(lambda: self._storage.prune_callbacks(before))
+
+    def count_pending_callbacks(self) -> int:
+        return self._run(lambda: self._storage.count_pending_callbacks())
+
+    def get_pending_claims(self, after: str, limit: int) -> List[PendingClaim]:
+        return self._run(lambda: self._storage.get_pending_claims(after, limit))
+
+    def expire_claim(self, claim: DonationTokenClaim) -> bool:
+        return self._run(lambda: self._storage.expire_claim(claim))
+
+    def get_donation_keys(self, after: str, limit: int) -> List[IssuedDonationKey]:
+        return self._run(lambda: self._storage.get_donation_keys(after, limit))
+
+    def replace_donation_keys(
+        self, keys: List[Tuple[DonationTokenClaim, DonationKey]], key_id: Optional[str] = None
+    ) -> int:
+        return self._run(lambda: self._storage.replace_donation_keys(keys, key_id))
+
+
+def create_fresh_async_sql_lite_storage(
+    db_path: str,
+    group_commit: bool = False,
+    status_cache: Optional[ClaimStatusCache] = None,
+    claim_filter: Optional[ClaimFilter] = None,
+) -> AsyncSqlLiteClaimStorage:
+    storage = AsyncSqlLiteClaimStorage(
+        test_now, db_path, readers=2, group_commit=group_commit, status_cache=status_cache, claim_filter=claim_filter
+    )
+    storage.create_tables()
+    asyncio.run(storage.load_claim_filter())
+
+    return storage
+
+
+# Embedded stand-in for Postgres: runs the Postgres queries on SQLite, translating the few dialect differences.
+# Nothing in it suspends, so transactions of concurrent tasks never interleave.
+class SqlLiteStandInDatabase(SqlDatabase):
+    def __init__(self, db_path: str) -> None:
+        self._connection = sqlite3.connect(db_path, isolation_level=None)
+
+    @staticmethod
+    def _translate(query: str) -> str:
+        query = re.sub(r"\$(\d+)", r"?\1", query)
+        query = query.replace("bigserial PRIMARY KEY", "INTEGER PRIMARY KEY")
+        # SQLite has no ADD COLUMN IF NOT EXISTS, the stand-in's tables are always created with every column
+        if "ADD COLUMN IF NOT EXISTS" in query:
+            return "SELECT 1"
+
+        return query.replace(" FOR UPDATE SKIP LOCKED", "")
+
+    async def execute(self, query: str, *args: Any) -> int:
+        return self._connection.execute(self._translate(query), args).rowcount
+
+    async def fetch(self, query: str, *args: Any) -> List[Row]:
+        return [tuple(row) for row in self._connection.execute(self._translate(query), args).fetchall()]
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[SqlConnection]:
+        self._connection.execute("BEGIN")
+        try:
+            yield self
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        self._connection.execute("COMMIT")
+
+    async def close(self) -> None:
+        self._connection.close()
+
+
+def create_fresh_postgres_storage(
+    db_path: str, status_cache: Optional[ClaimStatusCache] = None
+) -> AsyncPostgresClaimStorage:
+    storage = AsyncPostgresClaimStorage(test_now, SqlLiteStandInDatabase(db_path), status_cache)
+    asyncio.run(storage.create_tables())
+
+    return storage
+
+
+storage_factories: List[Callable[[str], ClaimStorage]] = [
+    create_fresh_sql_live_storage,
+    lambda db_path: BlockingClaimStorage(create_fresh_async_sql_lite_storage(db_path)),
+    lambda db_path: BlockingClaimStorage(create_fresh_async_sql_lite_storage(db_path, group_commit=True)),
+    lambda db_path: BlockingClaimStorage(
+        create_fresh_async_sql_lite_storage(db_path, status_cache=ClaimStatusCache(100, 60))
+    ),
+    lambda db_path: BlockingClaimStorage(
+        create_fresh_async_sql_lite_storage(
+            db_path, status_cache=ClaimStatusCache(100, 60), claim_filter=ClaimFilter(10, 0.01)
+        )
+    ),
+    lambda db_path: BlockingClaimStorage(create_fresh_postgres_storage(db_path)),
+    lambda db_path: BlockingClaimStorage(create_fresh_postgres_storage(db_path, ClaimStatusCache(100, 60))),
+]
+
+
+@pytest.mark.parametrize("create_storage", storage_factories)
+def test_storage_happy_path(create_storage: Callable[[str], ClaimStorage], db_path: str) -> None:
+    storage = create_storage(db_path)
+
     # User creates claim
     storage.add(claim_A, link_1)
     assert storage.get_claim_status(claim_A) == (None, ["[1970-01-01T01:00:00] Claim created, waiting for payment..."])
@@ -48,7 +228,7 @@ def test_storage_happy_path(storage: ClaimStorage) -> None:
     assert storage.get_claim(claim_B) is None
 
     # User pays the LNURL and payment hash and donation key are stored
-    storage.save_success(claim_A, PaymentHash("AAA"), DonationKey("A/XY12=="))
+    assert storage.save_success(claim_A, PaymentHash("AAA"), DonationKey("A/XY12==")) is True
 
     assert storage.is_payment_hashed_used(PaymentHash("AAA")) is True
     assert storage.get_claim_status(claim_A) == (
@@ -60,7 +240,460 @@ def test_storage_happy_path(storage: ClaimStorage) -> None:
     )
     assert storage.is_payment_hashed_used(PaymentHash("BBB")) is False
 
+    # Second payment of the same claim keeps the first donation key
+    assert storage.save_success(claim_A, PaymentHash("CCC"), DonationKey("A/ZZ34==")) is False
+    assert storage.get_claim_status(claim_A) == (
+        "A/XY12==",
+        [
+            "[1970-01-01T01:00:00] Claim created, waiting for payment...",
+            "[1970-01-01T01:00:00] Sucessfully claimed.",
+        ],
+    )
+    assert storage.is_payment_hashed_used(PaymentHash("CCC")) is False
+
 
-def test_storage_not_found() -> None:
-    storage = create_fresh_sql_live_storage()
+@pytest.mark.parametrize("create_storage", storage_factories)
+def test_storage_not_found(create_storage: Callable[[str], ClaimStorage], db_path: str) -> None:
+    storage = create_storage(db_path)
     assert storage.get_claim_status(DonationTokenClaim("non-existing")) is None
+    # Answers on an empty database too
+    storage.ping()
+
+
+@pytest.mark.parametrize("create_storage", storage_factories)
+def test_storage_lnurl(create_storage: Callable[[str], ClaimStorage], db_path: str) -> None:
+    storage = create_storage(db_path)
+    storage.add(claim_A, link_1, LnUrl("LNURL1A"))
+    storage.add(claim_B, link_2)
+
+    assert storage.get_lnurl(claim_A) == "LNURL1A"
+    assert storage.get_lnurl(claim_B) is None
+
+    storage.save_lnurl(claim_B, LnUrl("LNURL1B"))
+
+    assert storage.get_lnurl(claim_B) == "LNURL1B"
+    assert storage.get_lnurl(DonationTokenClaim("non-existing")) is None
+
+
+def test_create_tables_upgrades_older_database(db_path: str) -> None:
+    sql_lite_connection = sqlite3.connect(db_path)
+    sql_lite_connection.execute(
+        "CREATE TABLE claims (claim text PRIMARY KEY, lnbit_payment_link_id int, payment_hash text, donation_key text)"
+    )
+    sql_lite_connection.execute("CREATE TABLE statuses (claim text NOT NULL, created_at timestamp, status text)")
+    sql_lite_connection.execute("INSERT INTO claims (claim, lnbit_payment_link_id) VALUES ('A', 1)")
+    storage = SqlLiteClaimStorage(test_now, sql_lite_connection)
+
+    assert storage.create_tables() == len(MIGRATIONS)
+    assert storage.create_tables() == 0
+
+    assert storage.get_claim(claim_A) == link_1
+    assert storage.get_lnurl(claim_A) is None
+
+
+legacy_statuses = [
+    ("A", 1.5, "Claim created, waiting for payment..."),
+    ("B", 2.0, "Claim created, waiting for payment..."),
+    ("A", 3.0, "Amount send $90 is less then $100"),
+    ("A", 4.0, "Sucessfully claimed."),
+    ("B", 5.0, "Some message of an older version"),
+]
+
+
+def assert_legacy_statuses_migrated(storage: ClaimStorage) -> None:
+    assert storage.get_claim_status(claim_A) == (
+        "A/XY12==",
+        [
+            "[1970-01-01T01:00:01.500000] Claim created, waiting for payment...",
+            "[1970-01-01T01:00:03] Amount send $90 is less then $100",
+            "[1970-01-01T01:00:04] Sucessfully claimed.",
+        ],
+    )
+    assert storage.get_claim_status(claim_B) == (
+        None,
+        [
+            "[1970-01-01T01:00:02] Claim created, waiting for payment...",
+            "[1970-01-01T01:00:05] Some message of an older version",
+        ],
+    )
+
+    # Ordered by time, the test clock is at 0
+    storage.change_status(claim_B, EXPIRED_STATUS)
+    assert storage.get_claim_status(claim_B) == (
+        None,
+        [
+            "[1970-01-01T01:00:00] Claim expired without payment, payment link removed.",
+            "[1970-01-01T01:00:02] Claim created, waiting for payment...",
+            "[1970-01-01T01:00:05] Some message of an older version",
+        ],
+    )
+
+
+def test_create_tables_migrates_statuses_in_batches(db_path: str) -> None:
+    sql_lite_connection = sqlite3.connect(db_path)
+    sql_lite_connection.execute(
+        "CREATE TABLE claims (claim text PRIMARY KEY, lnbit_payment_link_id int, payment_hash text, donation_key text)"
+    )
+    sql_lite_connection.execute("CREATE TABLE statuses (claim text NOT NULL, created_at timestamp, status text)")
+    sql_lite_connection.execute("INSERT INTO claims VALUES ('A', 1, 'AAA', 'A/XY12=='), ('B', 2, NULL, NULL)")
+    sql_lite_connection.executemany("INSERT INTO statuses VALUES (?, ?, ?)", legacy_statuses)
+    sql_lite_connection.commit()
+    storage = SqlLiteClaimStorage(test_now, sql_lite_connection)
+
+    # Interrupted after the first batch
+    storage.create_tables()
+    sql_lite_connection.execute("DELETE FROM status_events WHERE id > 2")
+    sql_lite_connection.execute("PRAGMA user_version = 3")
+    sql_lite_connection.execute("CREATE TABLE statuses (claim text NOT NULL, created_at timestamp, status text)")
+    sql_lite_connection.executemany("INSERT INTO statuses VALUES (?, ?, ?)", legacy_statuses)
+    sql_lite_connection.commit()
+
+    migrate_statuses(sql_lite_connection, batch_size=2)
+    storage.create_tables()
+
+    legacy_table = "SELECT name FROM sqlite_master WHERE name = 'statuses'"
+    assert sql_lite_connection.execute(legacy_table).fetchone() is None
+    assert sql_lite_connection.execute("SELECT code, actual, expected FROM status_events WHERE id = 3").fetchone() == (
+        StatusCode.AMOUNT_TOO_LOW,
+        "90",
+        "100",
+    )
+    assert_legacy_statuses_migrated(storage)
+
+
+@pytest.mark.parametrize("create_storage", storage_factories)
+def test_storage_renders_status_details(create_storage: Callable[[str], ClaimStorage], db_path: str) -> None:
+    storage = create_storage(db_path)
+    storage.add(claim_A, link_1)
+    storage.change_status(claim_A, amount_too_low_status(90, 100))
+
+    assert storage.get_claim_status(claim_A) == (
+        None,
+        [
+            "[1970-01-01T01:00:00] Claim created, waiting for payment...",
+            "[1970-01-01T01:00:00] Amount send $90 is less then $100",
+        ],
+    )
+
+
+@pytest.mark.parametrize("create_storage", storage_factories)
+def test_storage_pay_link_pool(create_storage: Callable[[str], ClaimStorage], db_path: str) -> None:
+    storage = create_storage(db_path)
+    storage.add_pooled_pay_link(link_1, LnUrl("LNURL1A"))
+    storage.add_pooled_pay_link(link_2, LnUrl("LNURL1B"))
+    assert storage.count_pooled_pay_links() == 2
+
+    assert storage.add_from_pool(claim_A) == (link_1, "LNURL1A")
+    assert storage.get_claim(claim_A) == link_1
+    assert storage.get_lnurl(claim_A) == "LNURL1A"
+    assert storage.get_claim_status(claim_A) == (None, ["[1970-01-01T01:00:00] Claim created, waiting for payment..."])
+    assert storage.count_pooled_pay_links() == 1
+
+    # Already bound claim keeps the pooled pay link in the pool
+    with pytest.raises(ClaimExistsError):
+        storage.add_from_pool(claim_A)
+    assert storage.count_pooled_pay_links() == 1
+
+    assert storage.add_from_pool(claim_B) == (link_2, "LNURL1B")
+    assert storage.add_from_pool(DonationTokenClaim("C")) is None
+
+
+@pytest.mark.parametrize("create_storage", storage_factories)
+def test_storage_callback_queue(create_storage: Callable[[str], ClaimStorage], db_path: str) -> None:
+    storage = create_storage(db_path)
+    hash_A, hash_B = PaymentHash("AAA"), PaymentHash("BBB")
+
+    assert storage.enqueue_callback(hash_A, "body A") is True
+    assert storage.enqueue_callback(hash_A, "body A retried") is False
+    assert storage.enqueue_callback(hash_B, "body B") is True
+    assert storage.count_pending_callbacks() == 2
+
+    assert storage.take_callback(MAX_ATTEMPTS) == (hash_A, "body A")
+    assert storage.take_callback(MAX_ATTEMPTS) == (hash_B, "body B")
+    assert storage.take_callback(MAX_ATTEMPTS) is None
+
+    # Crash while both were in flight, A had been finished
+    storage.finish_callback(hash_A, CALLBACK_DONE)
+    assert storage.recover_callbacks(MAX_ATTEMPTS) == (1, 0)
+    assert storage.count_pending_callbacks() == 1
+
+    assert storage.take_callback(MAX_ATTEMPTS) == (hash_B, "body B")
+    storage.finish_callback(hash_B, CALLBACK_DONE)
+    assert storage.take_callback(MAX_ATTEMPTS) is None
+    assert storage.enqueue_callback(hash_A, "body A retried") is False
+
+    # Queued at the test clock's 0
+    assert storage.prune_callbacks(0) == 0
+    assert storage.prune_callbacks(1) == 2
+    assert storage.enqueue_callback(hash_A, "body A retried") is True
+
+    # Taken once more after every crash until it ran out of attempts
+    assert storage.take_callback(2) == (hash_A, "body A retried")
+    assert storage.recover_callbacks(2) == (1, 0)
+    assert storage.take_callback(2) == (hash_A, "body A retried")
+    assert storage.recover_callbacks(2) == (0, 1)
+    assert storage.take_callback(MAX_ATTEMPTS) is None
+    assert storage.count_pending_callbacks() == 0
+
+    # Never taken beyond the limit while pending
+    assert storage.enqueue_callback(hash_B, "body B retried") is True
+    assert storage.take_callback(1) == (hash_B, "body B retried")
+    assert storage.recover_callbacks(MAX_ATTEMPTS) == (1, 0)
+    assert storage.take_callback(1) is None
+
+
+@pytest.mark.parametrize("create_storage", storage_factories)
+def test_storage_pending_claims(create_storage: Callable[[str], ClaimStorage], db_path: str) -> None:
+    storage = create_storage(db_path)
+    claim_C = DonationTokenClaim("C")
+    storage.add(claim_A, link_1)
+    storage.add(claim_B, link_2)
+    storage.add(claim_C, LnBitsPaymentLinkId(3))
+    storage.save_success(claim_B, PaymentHash("BBB"), DonationKey("B/XY12=="))
+
+    assert storage.get_pending_claims("", 1) == [(claim_A, link_1, 0)]
+    assert storage.get_pending_claims("A", 1) == [(claim_C, 3, 0)]
+    assert storage.get_pending_claims("C", 1) == []
+
+    assert storage.expire_claim(claim_A) is True
+    # Paid in the meantime, its claim and statuses stay as they are
+    assert storage.expire_claim(claim_B) is False
+    assert storage.expire_claim(claim_A) is False
+
+    assert storage.get_pending_claims("", 10) == [(claim_C, 3, 0)]
+    assert storage.get_claim(claim_B) == link_2
+    assert storage.get_claim_status(claim_B) == (
+        "B/XY12==",
+        [
+            "[1970-01-01T01:00:00] Claim created, waiting for payment...",
+            "[1970-01-01T01:00:00] Sucessfully claimed.",
+        ],
+    )
+    assert storage.get_claim(claim_A) is None
+    assert storage.get_claim_status(claim_A) is None
+
+    # Expired claim can be created again, without the statuses of the expired one
+    storage.add(claim_A, LnBitsPaymentLinkId(4))
+    assert storage.get_claim(claim_A) == 4
+    assert storage.get_claim_status(claim_A) == (None, ["[1970-01-01T01:00:00] Claim created, waiting for payment..."])
+
+
+@pytest.mark.parametrize("create_storage", storage_factories)
+def test_storage_donation_keys(create_storage: Callable[[str], ClaimStorage], db_path: str) -> None:
+    storage = create_storage(db_path)
+    claim_C = DonationTokenClaim("C")
+    storage.add(claim_A, link_1)
+    storage.add(claim_B, link_2)
+    storage.add(claim_C, LnBitsPaymentLinkId(3))
+    storage.save_success(claim_A, PaymentHash("AAA"), DonationKey("A/XY12=="))
+    storage.save_success(claim_C, PaymentHash("CCC"), DonationKey("C/XY12=="), "1")
+
+    assert storage.get_donation_keys("", 1) == [(claim_A, "A/XY12==", None)]
+    assert storage.get_donation_keys("A", 10) == [(claim_C, "C/XY12==", "1")]
+    assert storage.get_donation_keys("C", 10) == []
+    storage.get_claim_status(claim_A)
+
+    # Unpaid claims keep having no key
+    replaced = storage.replace_donation_keys([(claim_A, DonationKey("A/NEW=")), (claim_B, DonationKey("B/NEW="))], "2")
+
+    assert replaced == 1
+    assert storage.get_donation_keys("", 10) == [(claim_A, "A/NEW=", "2"), (claim_C, "C/XY12==", "1")]
+    assert storage.get_claim_status(claim_A) == (
+        "A/NEW=",
+        ["[1970-01-01T01:00:00] Claim created, waiting for payment...", "[1970-01-01T01:00:00] Sucessfully claimed."],
+    )
+    assert storage.get_claim_status(claim_B) == (None, ["[1970-01-01T01:00:00] Claim created, waiting for payment..."])
+
+
+@pytest.mark.parametrize("create_storage", storage_factories)
+def test_storage_failed_add_leaves_no_status(create_storage: Callable[[str], ClaimStorage], db_path: str) -> None:
+    storage = create_storage(db_path)
+    storage.add(claim_A, link_1)
+
+    with pytest.raises(ClaimExistsError):
+        storage.add(claim_A, link_2)
+
+    assert storage.get_claim_status(claim_A) == (None, ["[1970-01-01T01:00:00] Claim created, waiting for payment..."])
+
+
+@pytest.mark.parametrize("group_commit", [False, True])
+def test_async_storage_concurrent_writes(group_commit: bool, db_path: str) -> None:
+    storage = create_fresh_async_sql_lite_storage(db_path, group_commit)
+
+    async def run() -> None:
+        claims = [DonationTokenClaim(str(i)) for i in range(20)]
+        await asyncio.gather(*[storage.add(claim, LnBitsPaymentLinkId(i)) for i, claim in enumerate(claims)])
+        ids = await asyncio.gather(*[storage.get_claim(claim) for claim in claims])
+
+        assert ids == [LnBitsPaymentLinkId(i) for i in range(20)]
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+
+def test_group_commit_isolates_failed_writes(db_path: str) -> None:
+    storage = create_fresh_async_sql_lite_storage(db_path, group_commit=True)
+
+    async def run() -> None:
+        await storage.add(claim_A, link_1)
+        results = await asyncio.gather(
+            storage.add(claim_A, link_2), storage.add(claim_B, link_2), return_exceptions=True
+        )
+
+        assert isinstance(results[0], ClaimExistsError)
+        assert results[1] is None
+        assert await storage.get_claim(claim_A) == link_1
+        assert await storage.get_claim(claim_B) == link_2
+        assert await storage.get_claim_status(claim_A) == (
+            None,
+            ["[1970-01-01T01:00:00] Claim created, waiting for payment..."],
+        )
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+
+def test_status_cache_is_invalidated_by_writes(db_path: str) -> None:
+    status_cache = ClaimStatusCache(100, 60)
+    storage = create_fresh_async_sql_lite_storage(db_path, status_cache=status_cache)
+
+    async def run() -> None:
+        await storage.add(claim_A, link_1)
+        assert await storage.get_claim_status(claim_A) == (
+            None,
+            ["[1970-01-01T01:00:00] Claim created, waiting for payment..."],
+        )
+        assert len(status_cache) == 1
+
+        await storage.save_success(claim_A, PaymentHash("AAA"), DonationKey("A/XY12=="))
+        assert len(status_cache) == 0
+        assert await storage.get_claim_status(claim_A) == (
+            "A/XY12==",
+            [
+                "[1970-01-01T01:00:00] Claim created, waiting for payment...",
+                "[1970-01-01T01:00:00] Sucessfully claimed.",
+            ],
+        )
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+
+def reads() -> int:
+    return sum(DB_WAIT_SECONDS.labels("reader").counts)
+
+
+def test_claim_filter_answers_unknown_claims_without_the_database(db_path: str) -> None:
+    storage = create_fresh_async_sql_lite_storage(db_path)
+    claim_C = DonationTokenClaim("C")
+
+    async def fill() -> None:
+        await storage.add(claim_A, link_1)
+        await storage.add_pooled_pay_link(link_2, LnUrl("LNURL2"))
+
+    asyncio.run(fill())
+    storage.close()
+
+    # A restarted server loads the claims written before
+    claim_filter = ClaimFilter(10, 0.01)
+    storage = AsyncSqlLiteClaimStorage(test_now, db_path, readers=1, claim_filter=claim_filter)
+
+    async def run() -> None:
+        # Until loaded everything goes to the database
+        before = reads()
+        assert await storage.get_claim_status(claim_B) is None
+        assert reads() == before + 1
+
+        assert await storage.load_claim_filter() == 1
+        before = reads()
+        misses = CLAIM_FILTER_LOOKUPS.labels("claims", "miss").value
+
+        assert await storage.get_claim_status(claim_B) is None
+        assert await storage.get_claim(claim_B) is None
+        assert await storage.get_lnurl(claim_B) is None
+        assert await storage.get_claim_by_id(LnBitsPaymentLinkId(99)) is None
+        assert reads() == before
+        assert CLAIM_FILTER_LOOKUPS.labels("claims", "miss").value == misses + 3
+
+        assert await storage.get_claim_by_id(link_1) == claim_A
+        assert await storage.get_claim_status(claim_A) is not None
+
+        # Added before they are written, claims taken from the pool get their pay link afterwards
+        await storage.add(claim_B, LnBitsPaymentLinkId(3))
+        assert await storage.get_claim(claim_B) == 3
+        await storage.add_from_pool(claim_C)
+        assert await storage.get_claim_by_id(link_2) == claim_C
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    assert claim_filter.items == 3
+    assert claim_filter.memory_bytes > 0
+
+
+# Two workers sharing one database, only the constraints keep them apart
+def test_postgres_storage_workers_share_constraints(db_path: str) -> None:
+    workers = [AsyncPostgresClaimStorage(test_now, SqlLiteStandInDatabase(db_path)) for _ in range(2)]
+
+    async def run() -> None:
+        await workers[0].create_tables()
+        await workers[0].add(claim_A, link_1)
+        with pytest.raises(ClaimExistsError):
+            await workers[1].add(claim_A, link_2)
+
+        saved = await asyncio.gather(
+            workers[0].save_success(claim_A, PaymentHash("AAA"), DonationKey("A/XY12==")),
+            workers[1].save_success(claim_A, PaymentHash("BBB"), DonationKey("A/XY12==")),
+        )
+        assert sorted(saved) == [False, True]
+
+        await workers[0].enqueue_callback(PaymentHash("AAA"), "body A")
+        assert await workers[1].enqueue_callback(PaymentHash("AAA"), "body A retried") is False
+        await workers[1].enqueue_callback(PaymentHash("BBB"), "body B")
+        taken = await asyncio.gather(workers[0].take_callback(MAX_ATTEMPTS), workers[1].take_callback(MAX_ATTEMPTS))
+        assert set(taken) == {(PaymentHash("AAA"), "body A"), (PaymentHash("BBB"), "body B")}
+
+        for worker in workers:
+            await worker.close()
+
+    asyncio.run(run())
+
+
+# Worker processes sharing one SQLite file, each with its own connection, never take the same row twice
+def test_sql_lite_storages_sharing_a_file_take_each_row_once(db_path: str) -> None:
+    storage = create_fresh_sql_live_storage(db_path)
+    for i in range(40):
+        storage.add_pooled_pay_link(LnBitsPaymentLinkId(i), LnUrl(f"LNURL{i}"))
+        storage.enqueue_callback(PaymentHash(f"hash {i}"), f"body {i}")
+    start = threading.Barrier(4)
+    links: List[LnBitsPaymentLinkId] = []
+    callbacks: List[PaymentHash] = []
+
+    def take(worker: int) -> None:
+        worker_storage = SqlLiteClaimStorage(test_now, sqlite3.connect(db_path, timeout=10))
+        start.wait()
+        for i in range(10):
+            pooled = worker_storage.add_from_pool(DonationTokenClaim(f"claim {worker} {i}"))
+            callback = worker_storage.take_callback(MAX_ATTEMPTS)
+            assert pooled is not None and callback is not None
+            links.append(pooled[0])
+            callbacks.append(callback[0])
+
+    threads = [threading.Thread(target=take, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(links) == list(range(40))
+    assert len(set(callbacks)) == 40
+    assert storage.add_from_pool(claim_A) is None
+    assert storage.take_callback(MAX_ATTEMPTS) is None
@@ -0,0 +1,190 @@
+import logging
+from sqlite3 import Connection
+from typing import Callable, List, NamedTuple
+
+from claim.statuses import parse_legacy_status
+
+STATUS_MIGRATION_BATCH = 10000
+SELECT_LEGACY_STATUSES = "SELECT rowid, claim, created_at, status FROM statuses WHERE rowid > ? ORDER BY rowid LIMIT ?"
+MIGRATE_STATUS = """
+    INSERT INTO status_events (id, claim, created_at, code, actual, expected) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+class Migration(NamedTuple):
+    description: str
+    apply: Callable[[Connection], None]
+    # Applied in one transaction together with the new version, otherwise it commits on its own and has to be safe
+    # to run again after being interrupted
+    transactional: bool = True
+
+
+class MissingIndexError(Exception):
+    def __init__(self, indexes: List[str]) -> None:
+        super().__init__(f"Database indexes missing: {', '.join(indexes)}")
+        self.indexes = indexes
+
+
+# Databases created before versioning have some of these tables already, so the first steps only add what's missing
+def create_claims(connection: Connection) -> None:
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS claims (
+            claim text NOT NULL PRIMARY KEY,
+            lnbit_payment_link_id int NOT NULL,
+            payment_hash text NULL UNIQUE,
+            donation_key text NULL
+        )
+    """
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS claims_lnbit_payment_link_id ON claims (lnbit_payment_link_id)")
+
+    claims_columns = [row[1] for row in connection.execute("PRAGMA table_info(claims)")]
+    if "lnurl" not in claims_columns:
+        connection.execute("ALTER TABLE claims ADD COLUMN lnurl text NULL")
+
+    # Unpaid claims only, keeps the reconciliation sweep from scanning every claim ever made
+    connection.execute("CREATE INDEX IF NOT EXISTS claims_pending ON claims (claim) WHERE payment_hash IS NULL")
+
+
+def create_pay_link_pool_and_callback_queue(connection: Connection) -> None:
+    # Pay links created ahead of time and not yet bound to a claim
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS pay_link_pool (
+            lnbit_payment_link_id int NOT NULL PRIMARY KEY,
+            lnurl text NOT NULL
+        )
+    """
+    )
+
+    # Webhooks acknowledged to LNbits but not processed yet, deduplicated by payment hash
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS callback_queue (
+            payment_hash text NOT NULL PRIMARY KEY,
+            body text NOT NULL,
+            state text NOT NULL,
+            attempts int NOT NULL DEFAULT 0,
+            created_at timestamp
+        )
+    """
+    )
+    connection.execute("CREATE INDEX IF NOT EXISTS callback_queue_state ON callback_queue (state, created_at)")
+
+
+def create_status_events(connection: Connection) -> None:
+    # Append-only log of status changes, a code and the values its message is rendered with
+    connection.execute(
+        """
+        CREATE TABLE IF NOT EXISTS status_events (
+            id INTEGER PRIMARY KEY,
+            claim text NOT NULL,
+            created_at real NOT NULL,
+            code int NOT NULL,
+            actual text NULL,
+            expected text NULL
+        )
+    """
+    )
+    # Covers get_claim_status so the statuses of a claim are read from the index alone, already in order
+    connection.execute(
+        """
+        CREATE INDEX IF NOT EXISTS status_events_claim_created_at
+        ON status_events (claim, created_at, code, actual, expected)
+    """
+    )
+
+
+# Moves the text statuses of older databases to status_events in batches, each committed on its own. Rows keep
+# their rowid as id, so a migration that was interrupted continues after the last row it copied.
+def migrate_statuses(connection: Connection, batch_size: int = STATUS_MIGRATION_BATCH) -> None:
+    legacy_table = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'statuses'"
+    if connection.execute(legacy_table).fetchone() is not None:
+        last_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM status_events").fetchone()[0]
+        while True:
+            rows = connection.execute(SELECT_LEGACY_STATUSES, (last_id, batch_size)).fetchall()
+            if len(rows) == 0:
+                break
+
+            with connection:
+                connection.executemany(
+                    MIGRATE_STATUS,
+                    [
+                        (id, claim, created_at or 0, *parse_legacy_status(status))
+                        for id, claim, created_at, status in rows
+                    ],
+                )
+            last_id = rows[-1][0]
+
+    with connection:
+        connection.execute("DROP TABLE IF EXISTS statuses")
+
+
+# The UNIQUE constraint on payment_hash already has an index
+def drop_claims_payment_hash_index(connection: Connection) -> None:
+    connection.execute("DROP INDEX IF EXISTS claims_payment_hash")
+
+
+# Id of the key that signed the donation key, NULL for keys issued before key ids were recorded
+def add_claims_key_id(connection: Connection) -> None:
+    claims_columns = [row[1] for row in connection.execute("PRAGMA table_info(claims)")]
+    if "key_id" not in claims_columns:
+        connection.execute("ALTER TABLE claims ADD COLUMN key_id text NULL")
+
+
+# Append only, the database's PRAGMA user_version is the number of migrations applied
+MIGRATIONS = [
+    Migration("claims", create_claims),
+    Migration("pay link pool and callback queue", create_pay_link_pool_and_callback_queue),
+    Migration("status events", create_status_events),
+    Migration("statuses to status events", migrate_statuses, transactional=False),
+    Migration("drop claims_payment_hash index", drop_claims_payment_hash_index),
+    Migration("claims key id", add_claims_key_id),
+]
+
+# Every lookup of the storage relies on one of these, checked on each start
+REQUIRED_INDEXES = [
+    "claims_lnbit_payment_link_id",
+    "claims_pending",
+    "callback_queue_state",
+    "status_events_claim_created_at",
+]
+
+
+def schema_version(connection: Connection) -> int:
+    return int(connection.execute("PRAGMA user_version").fetchone()[0])
+
+
+# Applies the migrations the database doesn't have yet and returns how many
+def migrate(connection: Connection, migrations: List[Migration] = MIGRATIONS) -> int:
+    version = schema_version(connection)
+    if version > len(migrations):
+        raise Exception(f"Database schema version {version} is newer than this server ({len(migrations)})")
+
+    # Lets archive.incremental_vacuum return the pages of deleted rows. Only takes effect on a database that is still
+    # empty, older ones keep their mode until archive.vacuum_full.
+    if version == 0:
+        connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+    for number, migration in enumerate(migrations[version:], start=version + 1):
+        logging.info(f"Database migration {number}: {migration.description}")
+        if migration.transactional:
+            with connection:
+                if not connection.in_transaction:
+                    connection.execute("BEGIN")
+                migration.apply(connection)
+                connection.execute(f"PRAGMA user_version = {number}")
+        else:
+            migration.apply(connection)
+            with connection:
+                connection.execute(f"PRAGMA user_version = {number}")
+
+    return len(migrations) - version
+
+
+def verify_indexes(connection: Connection) -> None:
+    rows = connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'").fetchall()
+    missing = [index for index in REQUIRED_INDEXES if index not in {row[0] for row in rows}]
+    if missing:
+        raise MissingIndexError(missing)
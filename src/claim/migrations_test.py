@@ -0,0 +1,52 @@
+import sqlite3
+from sqlite3 import Connection
+
+import pytest
+
+from claim.migrations import MIGRATIONS, Migration, MissingIndexError, migrate, schema_version, verify_indexes
+
+
+def test_migrations_are_applied_once() -> None:
+    connection = sqlite3.connect(":memory:")
+
+    assert migrate(connection) == len(MIGRATIONS)
+    assert schema_version(connection) == len(MIGRATIONS)
+    assert migrate(connection) == 0
+    verify_indexes(connection)
+
+
+def test_failed_migration_is_rolled_back() -> None:
+    connection = sqlite3.connect(":memory:")
+
+    def create_table(connection: Connection) -> None:
+        connection.execute("CREATE TABLE a (id int)")
+
+    def fail(connection: Connection) -> None:
+        connection.execute("CREATE TABLE b (id int)")
+        raise Exception("failed")
+
+    with pytest.raises(Exception, match="failed"):
+        migrate(connection, [Migration("a", create_table), Migration("b", fail)])
+
+    tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    assert tables == ["a"]
+    assert schema_version(connection) == 1
+
+
+def test_newer_database_is_refused() -> None:
+    connection = sqlite3.connect(":memory:")
+    connection.execute(f"PRAGMA user_version = {len(MIGRATIONS) + 1}")
+
+    with pytest.raises(Exception, match="newer"):
+        migrate(connection)
+
+
+def test_missing_index_is_reported() -> None:
+    connection = sqlite3.connect(":memory:")
+    migrate(connection)
+    connection.execute("DROP INDEX claims_pending")
+
+    with pytest.raises(MissingIndexError) as e:
+        verify_indexes(connection)
+
+    assert e.value.indexes == ["claims_pending"]
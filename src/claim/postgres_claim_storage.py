@@ -0,0 +1,364 @@
+from datetime import datetime
+from typing import Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+from claim.async_claim_storage import AsyncClaimStorage
+from claim.claim import DonationTokenClaim
+from claim.claim_status_cache import ClaimStatusCache
+from claim.claim_storage import (
+    CALLBACK_DONE,
+    CALLBACK_FAILED,
+    CALLBACK_IN_FLIGHT,
+    CALLBACK_PENDING,
+    DB_QUERY_SECONDS,
+    ClaimExistsError,
+    IssuedDonationKey,
+    PendingClaim,
+    RecoveredCallbacks,
+)
+from claim.donation_key import DonationKey
+from claim.sql_database import SqlConnection, SqlDatabase
+from claim.statuses import CREATED_STATUS, SUCCESS_STATUS, Status, render_status
+
+from lnbits import LnBitsPaymentLinkId, LnUrl, PaymentHash
+
+T = TypeVar("T")
+
+CREATE_TABLES = [
+    """
+    CREATE TABLE IF NOT EXISTS claims (
+        claim text NOT NULL PRIMARY KEY,
+        lnbit_payment_link_id bigint NOT NULL,
+        payment_hash text NULL UNIQUE,
+        donation_key text NULL,
+        lnurl text NULL,
+        key_id text NULL
+    )
+    """,
+    # Claims created before key ids were recorded
+    "ALTER TABLE claims ADD COLUMN IF NOT EXISTS key_id text NULL",
+    "CREATE INDEX IF NOT EXISTS claims_lnbit_payment_link_id ON claims (lnbit_payment_link_id)",
+    "CREATE INDEX IF NOT EXISTS claims_pending ON claims (claim) WHERE payment_hash IS NULL",
+    """
+    CREATE TABLE IF NOT EXISTS status_events (
+        id bigserial PRIMARY KEY,
+        claim text NOT NULL,
+        created_at double precision NOT NULL,
+        code smallint NOT NULL,
+        actual text NULL,
+        expected text NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS status_events_claim_created_at ON status_events (claim, created_at, id)",
+    """
+    CREATE TABLE IF NOT EXISTS pay_link_pool (
+        id bigserial PRIMARY KEY,
+        lnbit_payment_link_id bigint NOT NULL UNIQUE,
+        lnurl text NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS callback_queue (
+        id bigserial PRIMARY KEY,
+        payment_hash text NOT NULL UNIQUE,
+        body text NOT NULL,
+        state text NOT NULL,
+        attempts int NOT NULL DEFAULT 0,
+        created_at double precision NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS callback_queue_state ON callback_queue (state, created_at, id)",
+]
+
+INSERT_CLAIM = """
+    INSERT INTO claims (claim, lnbit_payment_link_id, lnurl) VALUES ($1, $2, $3) ON CONFLICT (claim) DO NOTHING
+"""
+INSERT_STATUS = "INSERT INTO status_events (claim, created_at, code, actual, expected) VALUES ($1, $2, $3, $4, $5)"
+UPDATE_SUCCESS = """
+    UPDATE claims SET payment_hash = $1, donation_key = $2, key_id = $3 WHERE claim = $4 AND payment_hash IS NULL
+"""
+# SKIP LOCKED lets every worker take a different row instead of queueing behind the first one
+TAKE_POOLED_PAY_LINK = """
+    DELETE FROM pay_link_pool
+    WHERE id = (SELECT id FROM pay_link_pool ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED)
+    RETURNING lnbit_payment_link_id, lnurl
+"""
+INSERT_CALLBACK = """
+    INSERT INTO callback_queue (payment_hash, body, state, created_at) VALUES ($1, $2, $3, $4)
+    ON CONFLICT (payment_hash) DO NOTHING
+"""
+TAKE_CALLBACK = """
+    UPDATE callback_queue SET state = $1, attempts = attempts + 1
+    WHERE id = (
+        SELECT id FROM callback_queue
+        WHERE state = $2 AND attempts < $3
+        ORDER BY created_at, id
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING payment_hash, body
+"""
+SELECT_PENDING_CLAIMS = """
+    SELECT claim, lnbit_payment_link_id,
+        (SELECT MIN(created_at) FROM status_events WHERE status_events.claim = claims.claim)
+    FROM claims
+    WHERE payment_hash IS NULL AND claim > $1
+    ORDER BY claim
+    LIMIT $2
+"""
+SELECT_DONATION_KEYS = """
+    SELECT claim, donation_key, key_id FROM claims
+    WHERE payment_hash IS NOT NULL AND claim > $1
+    ORDER BY claim
+    LIMIT $2
+"""
+UPDATE_DONATION_KEY = "UPDATE claims SET donation_key = $1, key_id = $2 WHERE claim = $3 AND payment_hash IS NOT NULL"
+SELECT_CLAIM_STATUS = """
+    SELECT claims.donation_key, status_events.created_at, status_events.code, status_events.actual,
+        status_events.expected
+    FROM claims LEFT JOIN status_events ON status_events.claim = claims.claim
+    WHERE claims.claim = $1
+    ORDER BY status_events.created_at, status_events.id
+"""
+
+
+# Claims in Postgres, shared by every worker and replica. Claim and payment hash uniqueness and the single use of
+# pooled pay links and queued webhooks are enforced by the database, so workers need no locks between each other.
+class AsyncPostgresClaimStorage(AsyncClaimStorage):
+    def __init__(
+        self,
+        now_date_function: Callable[[], datetime],
+        database: SqlDatabase,
+        status_cache: Optional[ClaimStatusCache] = None,
+    ) -> None:
+        self._now_date_function = now_date_function
+        self._database = database
+        self._status_cache = status_cache
+
+    async def create_tables(self) -> None:
+        async with self._database.transaction() as connection:
+            for statement in CREATE_TABLES:
+                await connection.execute(statement)
+
+    async def close(self) -> None:
+        await self._database.close()
+
+    async def _write_claim(self, claim: DonationTokenClaim, write: Callable[[], Awaitable[T]]) -> T:
+        try:
+            return await write()
+        finally:
+            if self._status_cache is not None:
+                self._status_cache.invalidate(claim)
+
+    async def _insert_status(self, connection: SqlConnection, claim: DonationTokenClaim, status: Status) -> None:
+        await connection.execute(INSERT_STATUS, claim, self._now_date_function().timestamp(), *status)
+
+    async def _add(
+        self, connection: SqlConnection, claim: DonationTokenClaim, id: LnBitsPaymentLinkId, lnurl: Optional[LnUrl]
+    ) -> None:
+        if await connection.execute(INSERT_CLAIM, claim, id, lnurl) == 0:
+            raise ClaimExistsError(claim)
+        await self._insert_status(connection, claim, CREATED_STATUS)
+
+    @DB_QUERY_SECONDS.timed_async
+    async def add(self, claim: DonationTokenClaim, id: LnBitsPaymentLinkId, lnurl: Optional[LnUrl] = None) -> None:
+        async def write() -> None:
+            async with self._database.transaction() as connection:
+                await self._add(connection, claim, id, lnurl)
+
+        await self._write_claim(claim, write)
+
+    @DB_QUERY_SECONDS.timed_async
+    async def save_lnurl(self, claim: DonationTokenClaim, lnurl: LnUrl) -> None:
+        await self._database.execute("UPDATE claims SET lnurl = $1 WHERE claim = $2", lnurl, claim)
+
+    @DB_QUERY_SECONDS.timed_async
+    async def change_status(self, claim: DonationTokenClaim, status: Status) -> None:
+        await self._write_claim(claim, lambda: self._insert_status(self._database, claim, status))
+
+    @DB_QUERY_SECONDS.timed_async
+    async def save_success(
+        self,
+        claim: DonationTokenClaim,
+        payment_hash: PaymentHash,
+        donation_key: DonationKey,
+        key_id: Optional[str] = None,
+    ) -> bool:
+        async def write() -> bool:
+            async with self._database.transaction() as connection:
+                if await connection.execute(UPDATE_SUCCESS, payment_hash, donation_key, key_id, claim) == 0:
+                    return False
+                await self._insert_status(connection, claim, SUCCESS_STATUS)
+
+            return True
+
+        return await self._write_claim(claim, write)
+
+    @DB_QUERY_SECONDS.timed_async
+    async def get_claim_by_id(self, id: LnBitsPaymentLinkId) -> Optional[DonationTokenClaim]:
+        rows = await self._database.fetch("SELECT claim FROM claims WHERE lnbit_payment_link_id = $1", id)
+
+        return DonationTokenClaim(rows[0][0]) if rows else None
+
+    async def _get_claim_status(self, claim: DonationTokenClaim) -> Optional[Tuple[Optional[DonationKey], List[str]]]:
+        with DB_QUERY_SECONDS.labels("get_claim_status").time():
+            rows = await self._database.fetch(SELECT_CLAIM_STATUS, claim)
+
+        if len(rows) == 0:
+            return None
+
+        return rows[0][0], [
+            f"[{datetime.fromtimestamp(created_at).isoformat()}] {render_status(code, actual, expected)}"
+            for _, created_at, code, actual, expected in rows
+            if code is not None
+        ]
+
+    async def get_claim_status(self, claim: DonationTokenClaim) -> Optional[Tuple[Optional[DonationKey], List[str]]]:
+        if self._status_cache is None:
+            return await self._get_claim_status(claim)
+
+        cached = self._status_cache.get(claim)
+        if cached is not None:
+            return cached
+
+        version = self._status_cache.version()
+        status = await self._get_claim_status(claim)
+        if status is not None:
+            self._status_cache.put(claim, status, version)
+
+        return status
+
+    @DB_QUERY_SECONDS.timed_async
+    async def get_claim(self, claim: DonationTokenClaim) -> Optional[LnBitsPaymentLinkId]:
+        rows = await self._database.fetch("SELECT lnbit_payment_link_id FROM claims WHERE claim = $1", claim)
+
+        return LnBitsPaymentLinkId(rows[0][0]) if rows else None
+
+    @DB_QUERY_SECONDS.timed_async
+    async def get_lnurl(self, claim: DonationTokenClaim) -> Optional[LnUrl]:
+        rows = await self._database.fetch("SELECT lnurl FROM claims WHERE claim = $1", claim)
+
+        return LnUrl(rows[0][0]) if rows and rows[0][0] is not None else None
+
+    @DB_QUERY_SECONDS.timed_async
+    async def is_payment_hashed_used(self, payment_hash: PaymentHash) -> bool:
+        rows = await self._database.fetch("SELECT claim FROM claims WHERE payment_hash = $1", payment_hash)
+
+        return len(rows) > 0
+
+    @DB_QUERY_SECONDS.timed_async
+    async def add_pooled_pay_link(self, id: LnBitsPaymentLinkId, lnurl: LnUrl) -> None:
+        await self._database.execute(
+            "INSERT INTO pay_link_pool (lnbit_payment_link_id, lnurl) VALUES ($1, $2)", id, lnurl
+        )
+
+    @DB_QUERY_SECONDS.timed_async
+    async def count_pooled_pay_links(self) -> int:
+        rows = await self._database.fetch("SELECT COUNT(*) FROM pay_link_pool")
+
+        return int(rows[0][0])
+
+    @DB_QUERY_SECONDS.timed_async
+    async def ping(self) -> None:
+        await self._database.fetch("SELECT 1")
+
+    @DB_QUERY_SECONDS.timed_async
+    async def add_from_pool(self, claim: DonationTokenClaim) -> Optional[Tuple[LnBitsPaymentLinkId, LnUrl]]:
+        async def write() -> Optional[Tuple[LnBitsPaymentLinkId, LnUrl]]:
+            async with self._database.transaction() as connection:
+                rows = await connection.fetch(TAKE_POOLED_PAY_LINK)
+                if not rows:
+                    return None
+
+                id, lnurl = LnBitsPaymentLinkId(rows[0][0]), LnUrl(rows[0][1])
+                # An existing claim rolls back the take, the pay link stays pooled
+                await self._add(connection, claim, id, lnurl)
+
+            return id, lnurl
+
+        return await self._write_claim(claim, write)
+
+    @DB_QUERY_SECONDS.timed_async
+    async def enqueue_callback(self, payment_hash: PaymentHash, body: str) -> bool:
+        created_at = self._now_date_function().timestamp()
+
+        return await self._database.execute(INSERT_CALLBACK, payment_hash, body, CALLBACK_PENDING, created_at) == 1
+
+    @DB_QUERY_SECONDS.timed_async
+    async def take_callback(self, max_attempts: int) -> Optional[Tuple[PaymentHash, str]]:
+        rows = await self._database.fetch(TAKE_CALLBACK, CALLBACK_IN_FLIGHT, CALLBACK_PENDING, max_attempts)
+
+        return (PaymentHash(rows[0][0]), str(rows[0][1])) if rows else None
+
+    @DB_QUERY_SECONDS.timed_async
+    async def finish_callback(self, payment_hash: PaymentHash, state: str) -> None:
+        await self._database.execute(
+            "UPDATE callback_queue SET state = $1 WHERE payment_hash = $2", state, payment_hash
+        )
+
+    @DB_QUERY_SECONDS.timed_async
+    async def recover_callbacks(self, max_attempts: int) -> RecoveredCallbacks:
+        async with self._database.transaction() as connection:
+            failed = await connection.execute(
+                "UPDATE callback_queue SET state = $1 WHERE state IN ($2, $3) AND attempts >= $4",
+                CALLBACK_FAILED,
+                CALLBACK_PENDING,
+                CALLBACK_IN_FLIGHT,
+                max_attempts,
+            )
+            recovered = await connection.execute(
+                "UPDATE callback_queue SET state = $1 WHERE state = $2", CALLBACK_PENDING, CALLBACK_IN_FLIGHT
+            )
+
+        return RecoveredCallbacks(recovered, failed)
+
+    @DB_QUERY_SECONDS.timed_async
+    async def prune_callbacks(self, before: float) -> int:
+        return await self._database.execute(
+            "DELETE FROM callback_queue WHERE state = $1 AND created_at < $2", CALLBACK_DONE, before
+        )
+
+    @DB_QUERY_SECONDS.timed_async
+    async def count_pending_callbacks(self) -> int:
+        rows = await self._database.fetch("SELECT COUNT(*) FROM callback_queue WHERE state = $1", CALLBACK_PENDING)
+
+        return int(rows[0][0])
+
+    @DB_QUERY_SECONDS.timed_async
+    async def get_pending_claims(self, after: str, limit: int) -> List[PendingClaim]:
+        rows = await self._database.fetch(SELECT_PENDING_CLAIMS, after, limit)
+
+        return [(DonationTokenClaim(row[0]), LnBitsPaymentLinkId(row[1]), row[2]) for row in rows]
+
+    @DB_QUERY_SECONDS.timed_async
+    async def expire_claim(self, claim: DonationTokenClaim) -> bool:
+        async def write() -> bool:
+            async with self._database.transaction() as connection:
+                if await connection.execute("DELETE FROM claims WHERE claim = $1 AND payment_hash IS NULL", claim) != 1:
+                    return False
+                await connection.execute("DELETE FROM status_events WHERE claim = $1", claim)
+
+            return True
+
+        return await self._write_claim(claim, write)
+
+    @DB_QUERY_SECONDS.timed_async
+    async def get_donation_keys(self, after: str, limit: int) -> List[IssuedDonationKey]:
+        rows = await self._database.fetch(SELECT_DONATION_KEYS, after, limit)
+
+        return [(DonationTokenClaim(row[0]), DonationKey(row[1]), row[2]) for row in rows]
+
+    @DB_QUERY_SECONDS.timed_async
+    async def replace_donation_keys(
+        self, keys: List[Tuple[DonationTokenClaim, DonationKey]], key_id: Optional[str] = None
+    ) -> int:
+        replaced = 0
+        try:
+            async with self._database.transaction() as connection:
+                for claim, donation_key in keys:
+                    replaced += await connection.execute(UPDATE_DONATION_KEY, donation_key, key_id, claim)
+        finally:
+            if self._status_cache is not None:
+                for claim, _ in keys:
+                    self._status_cache.invalidate(claim)
+
+        return replaced
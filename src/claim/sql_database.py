@@ -0,0 +1,73 @@
+import importlib
+from abc import ABCMeta, abstractmethod
+from contextlib import asynccontextmanager
+from typing import Any, AsyncContextManager, AsyncIterator, List, Tuple
+
+Row = Tuple[Any, ...]
+
+
+# The part of an async SQL driver AsyncPostgresClaimStorage needs. Queries use Postgres `$1` placeholders.
+class SqlConnection(metaclass=ABCMeta):
+    # Returns the number of affected rows
+    @abstractmethod
+    async def execute(self, query: str, *args: Any) -> int:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def fetch(self, query: str, *args: Any) -> List[Row]:
+        raise NotImplementedError()
+
+
+class SqlDatabase(SqlConnection):
+    # Everything run on the yielded connection commits together, an exception rolls it all back
+    @abstractmethod
+    def transaction(self) -> AsyncContextManager[SqlConnection]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    async def close(self) -> None:
+        raise NotImplementedError()
+
+
+class _AsyncpgConnection(SqlConnection):
+    def __init__(self, connection: Any) -> None:
+        self._connection = connection
+
+    async def execute(self, query: str, *args: Any) -> int:
+        # asyncpg returns the command tag, e.g. "INSERT 0 1" or "UPDATE 3"
+        status: str = await self._connection.execute(query, *args)
+        count = status.rsplit(" ", 1)[-1]
+
+        return int(count) if count.isdigit() else 0
+
+    async def fetch(self, query: str, *args: Any) -> List[Row]:
+        return [tuple(record) for record in await self._connection.fetch(query, *args)]
+
+
+# Postgres through an asyncpg connection pool. asyncpg is only needed when DB_URL is set.
+class AsyncpgDatabase(SqlDatabase):
+    def __init__(self, pool: Any) -> None:
+        self._pool = pool
+
+    @staticmethod
+    async def connect(dsn: str, min_size: int, max_size: int) -> "AsyncpgDatabase":
+        asyncpg = importlib.import_module("asyncpg")
+
+        return AsyncpgDatabase(await asyncpg.create_pool(dsn, min_size=min_size, max_size=max_size))
+
+    async def execute(self, query: str, *args: Any) -> int:
+        async with self._pool.acquire() as connection:
+            return await _AsyncpgConnection(connection).execute(query, *args)
+
+    async def fetch(self, query: str, *args: Any) -> List[Row]:
+        async with self._pool.acquire() as connection:
+            return await _AsyncpgConnection(connection).fetch(query, *args)
+
+    @asynccontextmanager
+    async def transaction(self) -> AsyncIterator[SqlConnection]:
+        async with self._pool.acquire() as connection:
+            async with connection.transaction():
+                yield _AsyncpgConnection(connection)
+
+    async def close(self) -> None:
+        await self._pool.close()
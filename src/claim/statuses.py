@@ -1,3 +1,76 @@
-CREATED_STATUS = "Claim created, waiting for payment..."
-SUCCESS_STATUS = "Sucessfully claimed."
-PAYMENT_HASH_USED_STATUS = "Payment-Hash is already used for different claim."
+import re
+from enum import IntEnum
+from typing import Dict, NamedTuple, Optional, Pattern
+
+
+# Stored as integers with the varying parts in their own columns, messages are only rendered when a claim is read
+class StatusCode(IntEnum):
+    # Free text, statuses written before codes existed that match no known message
+    MESSAGE = 0
+    CREATED = 1
+    SUCCESS = 2
+    PAYMENT_HASH_USED = 3
+    EXPIRED = 4
+    NOT_PAID = 5
+    WRONG_PAYMENT_LINK = 6
+    AMOUNT_TOO_LOW = 7
+
+
+class Status(NamedTuple):
+    code: StatusCode
+    actual: Optional[str] = None
+    expected: Optional[str] = None
+
+
+MESSAGES: Dict[StatusCode, str] = {
+    StatusCode.MESSAGE: "{actual}",
+    StatusCode.CREATED: "Claim created, waiting for payment...",
+    StatusCode.SUCCESS: "Sucessfully claimed.",
+    StatusCode.PAYMENT_HASH_USED: "Payment-Hash is already used for different claim.",
+    StatusCode.EXPIRED: "Claim expired without payment, payment link removed.",
+    StatusCode.NOT_PAID: "Callback received, but payment not paid.",
+    StatusCode.WRONG_PAYMENT_LINK: "PaymentLinkId ({actual}) is not as expected ({expected})",
+    StatusCode.AMOUNT_TOO_LOW: "Amount send ${actual} is less then ${expected}",
+}
+
+CREATED_STATUS = Status(StatusCode.CREATED)
+SUCCESS_STATUS = Status(StatusCode.SUCCESS)
+PAYMENT_HASH_USED_STATUS = Status(StatusCode.PAYMENT_HASH_USED)
+EXPIRED_STATUS = Status(StatusCode.EXPIRED)
+NOT_PAID_STATUS = Status(StatusCode.NOT_PAID)
+
+
+def wrong_payment_link_status(actual: object, expected: object) -> Status:
+    return Status(StatusCode.WRONG_PAYMENT_LINK, str(actual), str(expected))
+
+
+def amount_too_low_status(actual: object, expected: object) -> Status:
+    return Status(StatusCode.AMOUNT_TOO_LOW, str(actual), str(expected))
+
+
+def render_status(code: int, actual: Optional[str], expected: Optional[str]) -> str:
+    return MESSAGES[StatusCode(code)].format(actual=actual, expected=expected)
+
+
+def _message_pattern(message: str) -> Pattern[str]:
+    pattern = re.escape(message)
+    pattern = pattern.replace(re.escape("{actual}"), "(?P<actual>.*?)")
+    pattern = pattern.replace(re.escape("{expected}"), "(?P<expected>.*?)")
+
+    return re.compile(pattern, re.DOTALL)
+
+
+_LEGACY_PATTERNS = [
+    (code, _message_pattern(message)) for code, message in MESSAGES.items() if code != StatusCode.MESSAGE
+]
+
+
+# Status text written before codes existed, rendering the result gives back the same text
+def parse_legacy_status(text: str) -> Status:
+    for code, pattern in _LEGACY_PATTERNS:
+        match = pattern.fullmatch(text)
+        if match is not None:
+            groups = match.groupdict()
+            return Status(code, groups.get("actual"), groups.get("expected"))
+
+    return Status(StatusCode.MESSAGE, text)
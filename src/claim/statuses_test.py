@@ -0,0 +1,33 @@
+import pytest
+
+from claim.statuses import (
+    CREATED_STATUS,
+    Status,
+    StatusCode,
+    amount_too_low_status,
+    parse_legacy_status,
+    render_status,
+    wrong_payment_link_status,
+)
+
+
+def test_render_status() -> None:
+    assert render_status(*CREATED_STATUS) == "Claim created, waiting for payment..."
+    assert render_status(*amount_too_low_status(90, 100)) == "Amount send $90 is less then $100"
+    assert render_status(*wrong_payment_link_status(2, 1)) == "PaymentLinkId (2) is not as expected (1)"
+
+
+@pytest.mark.parametrize(
+    "text, status",
+    [
+        ("Claim created, waiting for payment...", CREATED_STATUS),
+        ("Sucessfully claimed.", Status(StatusCode.SUCCESS)),
+        ("Amount send $90 is less then $100", amount_too_low_status(90, 100)),
+        ("PaymentLinkId (2) is not as expected (1)", wrong_payment_link_status(2, 1)),
+        ("Something {odd} happened", Status(StatusCode.MESSAGE, "Something {odd} happened")),
+        ("Sucessfully claimed. Twice", Status(StatusCode.MESSAGE, "Sucessfully claimed. Twice")),
+    ],
+)
+def test_legacy_status_round_trip(text: str, status: Status) -> None:
+    assert parse_legacy_status(text) == status
+    assert render_status(*parse_legacy_status(text)) == text
@@ -0,0 +1,90 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Generic, Hashable, Tuple, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class _InFlight(Generic[V]):
+    def __init__(self, task: "asyncio.Task[V]") -> None:
+        self.task = task
+        self.waiters = 0
+
+
+# Concurrent calls for the same key share one in-flight request. Results accepted by `cacheable` are then served
+# from memory for ttl_seconds, expired entries are swept once the cache grows past max_size. The request runs in its
+# own task, so a cancelled caller doesn't cancel it for the others, only the last caller leaving cancels it.
+class Coalescer(Generic[K, V]):
+    def __init__(
+        self,
+        ttl_seconds: float,
+        cacheable: Callable[[V], bool] = lambda _: True,
+        max_size: int = 10000,
+        now: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._ttl_seconds = ttl_seconds
+        self._max_size = max_size
+        self._cacheable = cacheable
+        self._now = now
+        self._in_flight: Dict[K, _InFlight[V]] = {}
+        self._cache: Dict[K, Tuple[float, V]] = {}
+        self.calls = 0
+        self.hits = 0
+        self.coalesced = 0
+
+    async def get(self, key: K, fetch: Callable[[], Awaitable[V]]) -> V:
+        self.calls += 1
+
+        cached = self._cache.get(key)
+        if cached is not None:
+            expires_at, value = cached
+            if expires_at > self._now():
+                self.hits += 1
+                return value
+            del self._cache[key]
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+        else:
+            in_flight = _InFlight(asyncio.get_running_loop().create_task(self._fetch(key, fetch)))
+            self._in_flight[key] = in_flight
+            in_flight.task.add_done_callback(lambda _: self._done(key, in_flight))
+
+        in_flight.waiters += 1
+        try:
+            return await asyncio.shield(in_flight.task)
+        except asyncio.CancelledError:
+            if in_flight.waiters == 1:
+                in_flight.task.cancel()
+            raise
+        finally:
+            in_flight.waiters -= 1
+
+    async def _fetch(self, key: K, fetch: Callable[[], Awaitable[V]]) -> V:
+        value = await fetch()
+
+        if self._ttl_seconds > 0 and self._cacheable(value):
+            if len(self._cache) >= self._max_size:
+                self._evict()
+            self._cache[key] = (self._now() + self._ttl_seconds, value)
+
+        return value
+
+    def _done(self, key: K, in_flight: _InFlight[V]) -> None:
+        if self._in_flight.get(key) is in_flight:
+            del self._in_flight[key]
+        # Marks the exception as retrieved when every caller was cancelled
+        if not in_flight.task.cancelled():
+            in_flight.task.exception()
+
+    def _evict(self) -> None:
+        now = self._now()
+        for key in [key for key, (expires_at, _) in self._cache.items() if expires_at <= now]:
+            del self._cache[key]
+
+        # Everything is still fresh, drop the oldest half (dicts keep insertion order)
+        if len(self._cache) >= self._max_size:
+            for key in list(self._cache)[: len(self._cache) // 2 + 1]:
+                del self._cache[key]
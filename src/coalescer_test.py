@@ -0,0 +1,134 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from coalescer import Coalescer
+
+DELAY = 0.05
+
+
+def test_concurrent_calls_share_one_fetch() -> None:
+    coalescer: Coalescer[str, int] = Coalescer(0)
+    fetches: List[str] = []
+
+    async def fetch() -> int:
+        fetches.append("A")
+        await asyncio.sleep(DELAY)
+        return 1
+
+    async def run() -> List[int]:
+        return await asyncio.gather(*[coalescer.get("A", fetch) for _ in range(10)])
+
+    assert asyncio.run(run()) == [1] * 10
+    assert fetches == ["A"]
+    assert coalescer.coalesced == 9
+
+
+def test_only_cacheable_results_are_cached() -> None:
+    now: List[float] = [0]
+    coalescer: Coalescer[str, bool] = Coalescer(60, lambda paid: paid, now=lambda: now[0])
+    paid: List[bool] = [False]
+
+    async def fetch() -> bool:
+        return paid[0]
+
+    async def run() -> None:
+        assert await coalescer.get("A", fetch) is False
+        paid[0] = True
+        assert await coalescer.get("A", fetch) is True
+        paid[0] = False
+        assert await coalescer.get("A", fetch) is True
+
+        now[0] = 60
+        assert await coalescer.get("A", fetch) is False
+
+    asyncio.run(run())
+
+    assert coalescer.hits == 1
+
+
+def test_errors_are_shared_and_not_cached() -> None:
+    coalescer: Coalescer[str, int] = Coalescer(60)
+    fetches: List[str] = []
+
+    async def fetch() -> int:
+        fetches.append("A")
+        await asyncio.sleep(DELAY)
+        raise ValueError()
+
+    async def run() -> None:
+        results = await asyncio.gather(*[coalescer.get("A", fetch) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+        with pytest.raises(ValueError):
+            await coalescer.get("A", fetch)
+
+    asyncio.run(run())
+
+    assert fetches == ["A", "A"]
+
+
+def test_cache_is_bounded() -> None:
+    coalescer: Coalescer[int, int] = Coalescer(60, max_size=10)
+
+    async def run() -> None:
+        for i in range(100):
+            await coalescer.get(i, lambda: asyncio.sleep(0, i))
+
+    asyncio.run(run())
+
+    assert len(coalescer._cache) <= 10
+
+
+def test_cancelled_caller_leaves_the_fetch_to_the_others() -> None:
+    coalescer: Coalescer[str, int] = Coalescer(0)
+    fetches: List[str] = []
+
+    async def fetch() -> int:
+        fetches.append("A")
+        await asyncio.sleep(DELAY)
+        return 1
+
+    async def run() -> None:
+        first = asyncio.create_task(coalescer.get("A", fetch))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(coalescer.get("A", fetch))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        assert await second == 1
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(run())
+
+    assert fetches == ["A"]
+
+
+def test_fetch_is_cancelled_with_its_last_caller() -> None:
+    coalescer: Coalescer[str, int] = Coalescer(0)
+    cancelled: List[str] = []
+
+    async def fetch() -> int:
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append("A")
+            raise
+        return 1
+
+    async def run() -> None:
+        callers = [asyncio.create_task(coalescer.get("A", fetch)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+
+        # The next call starts a new fetch
+        assert await asyncio.wait_for(coalescer.get("A", lambda: asyncio.sleep(0, 2)), 1) == 2
+
+    asyncio.run(run())
+
+    assert cancelled == ["A"]
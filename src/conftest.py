@@ -0,0 +1,9 @@
+from pathlib import Path
+
+import pytest
+
+
+# A fresh SQLite database file per test, removed by pytest together with its -wal and -shm files
+@pytest.fixture
+def db_path(tmp_path: Path) -> str:
+    return str(tmp_path / "test.db")
@@ -0,0 +1,91 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Tuple
+
+from aiohttp import web
+
+from metrics import LOCK_WAIT_SECONDS, REGISTRY
+
+CLAIM_ADMISSIONS = REGISTRY.counter(
+    "claim_admissions_total", "Claim creations admitted, queued, shed or rate limited", ["result"]
+)
+
+
+# Token bucket per key, refilled at rate tokens per second up to burst. Only the max_keys most recently seen keys are
+# kept, an evicted key starts again with a full bucket.
+class TokenBucketLimiter:
+    def __init__(self, rate: float, burst: float, max_keys: int, now: Callable[[], float] = time.monotonic) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._max_keys = max_keys
+        self._now = now
+        self._buckets: OrderedDict[Tuple[str, str], Tuple[float, float]] = OrderedDict()
+
+    # Takes a token and returns 0, or returns the seconds until the next token without taking one
+    def acquire(self, kind: str, key: str) -> float:
+        if self._rate <= 0:
+            return 0
+
+        now = self._now()
+        tokens, updated = self._buckets.get((kind, key), (self._burst, now))
+        tokens = min(self._burst, tokens + (now - updated) * self._rate)
+
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / self._rate
+            CLAIM_ADMISSIONS.labels(f"rate_limited_{kind}").inc()
+
+        self._buckets[(kind, key)] = (tokens, now)
+        self._buckets.move_to_end((kind, key))
+        if len(self._buckets) > self._max_keys:
+            self._buckets.popitem(last=False)
+
+        return retry_after
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+# Runs at most max_concurrency claim creations at once and lets max_queue more wait. Anything beyond that is
+# answered with a 503 right away instead of piling up on LNbits and the database.
+class AdmissionController:
+    def __init__(self, max_concurrency: int, max_queue: int) -> None:
+        self._max_concurrency = max_concurrency
+        self._max_queue = max_queue
+        self._semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        self.active = 0
+        self.queued = 0
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        if self._max_concurrency <= 0:
+            yield
+            return
+
+        waiting = time.perf_counter()
+        if self._semaphore.locked():
+            if self.queued >= self._max_queue:
+                CLAIM_ADMISSIONS.labels("shed").inc()
+                raise web.HTTPServiceUnavailable(headers={"Retry-After": "1"})
+
+            CLAIM_ADMISSIONS.labels("queued").inc()
+            self.queued += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.queued -= 1
+        else:
+            await self._semaphore.acquire()
+        LOCK_WAIT_SECONDS.labels("admission").observe(time.perf_counter() - waiting)
+
+        CLAIM_ADMISSIONS.labels("admitted").inc()
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
@@ -0,0 +1,73 @@
+import asyncio
+from typing import List
+
+import pytest
+from aiohttp import web
+
+from create_claim.admission import AdmissionController, TokenBucketLimiter
+from metrics import LOCK_WAIT_SECONDS
+
+
+def test_token_bucket_refills_at_rate() -> None:
+    now = [0.0]
+    limiter = TokenBucketLimiter(2, 3, 100, lambda: now[0])
+
+    assert [limiter.acquire("ip", "A") for _ in range(3)] == [0, 0, 0]
+    assert limiter.acquire("ip", "A") == pytest.approx(0.5)
+    assert limiter.acquire("ip", "B") == 0
+    assert limiter.acquire("claim", "A") == 0
+
+    now[0] = 0.5
+    assert limiter.acquire("ip", "A") == 0
+    assert limiter.acquire("ip", "A") == pytest.approx(0.5)
+
+
+def test_token_bucket_evicts_least_recently_seen_keys() -> None:
+    limiter = TokenBucketLimiter(1, 1, 2, lambda: 0)
+
+    assert limiter.acquire("ip", "A") == 0
+    assert limiter.acquire("ip", "B") == 0
+    assert limiter.acquire("ip", "A") > 0
+    assert limiter.acquire("ip", "C") == 0
+    assert len(limiter) == 2
+    assert limiter.acquire("ip", "A") > 0
+    assert limiter.acquire("ip", "B") == 0
+
+
+def test_disabled_token_bucket_allows_everything() -> None:
+    limiter = TokenBucketLimiter(0, 1, 2, lambda: 0)
+
+    assert [limiter.acquire("ip", "A") for _ in range(5)] == [0, 0, 0, 0, 0]
+    assert len(limiter) == 0
+
+
+def test_admission_controller_queues_then_sheds() -> None:
+    async def run() -> None:
+        admission = AdmissionController(2, 1)
+        admitted = sum(LOCK_WAIT_SECONDS.labels("admission").counts)
+        release = asyncio.Event()
+        finished: List[int] = []
+
+        async def create(i: int) -> None:
+            async with admission.admit():
+                await release.wait()
+                finished.append(i)
+
+        tasks = [asyncio.create_task(create(i)) for i in range(3)]
+        await asyncio.sleep(0)
+
+        assert (admission.active, admission.queued) == (2, 1)
+
+        with pytest.raises(web.HTTPServiceUnavailable):
+            async with admission.admit():
+                pass
+
+        release.set()
+        await asyncio.gather(*tasks)
+
+        assert sorted(finished) == [0, 1, 2]
+        # The shed creation never waited
+        assert sum(LOCK_WAIT_SECONDS.labels("admission").counts) == admitted + 3
+        assert (admission.active, admission.queued) == (0, 0)
+
+    asyncio.run(run())
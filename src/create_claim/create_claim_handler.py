@@ -1,47 +1,80 @@
 from asyncio.log import logger
-from typing import Tuple
-from pydantic import BaseModel
+from typing import Annotated, Optional
+from pydantic import BaseModel, StringConstraints
 
-from claim.claim import DonationTokenClaim
-from claim.claim_storage import ClaimStorage
-from lnbits import AmountSats, LnBitsApi, LnBitsPaymentLinkId, LnUrl
-from settings import DOMAIN, URL_PAYMENT_SUCCESS_CALLBACK
+from claim.async_claim_storage import AsyncClaimStorage
+from claim.claim import CLAIM_MAX_LENGTH, DonationTokenClaim
+from claim.claim_storage import ClaimExistsError
+from create_claim.create_pay_link import create_pay_link
+from create_claim.pay_link_pool import PayLinkPool
+from lnbits import AmountSats, LnBitsApi, LnUrl
 
 
 class CreateClaimApi(BaseModel):
-    claim: DonationTokenClaim
+    claim: Annotated[DonationTokenClaim, StringConstraints(min_length=1, max_length=CLAIM_MAX_LENGTH)]
 
 
 class CreateClaimHandler:
-    def __init__(self, claim_storage: ClaimStorage, ln_bits_api: LnBitsApi) -> None:
+    def __init__(
+        self,
+        claim_storage: AsyncClaimStorage,
+        ln_bits_api: LnBitsApi,
+        callback_url: str,
+        lnurl_url_template: Optional[str] = None,
+        pay_link_pool: Optional[PayLinkPool] = None,
+    ) -> None:
         self._claim_storage = claim_storage
         self._ln_bits_api = ln_bits_api
+        self._callback_url = callback_url
+        self._lnurl_url_template = lnurl_url_template
+        self._pay_link_pool = pay_link_pool
 
-    async def _do_create_pay_link(
-        self,
-        amount: AmountSats,
-        claim: DonationTokenClaim,
-        callback_url: str,
-    ) -> Tuple[LnBitsPaymentLinkId, LnUrl]:
-        response = await self._ln_bits_api.create_pay_link(amount, claim, callback_url)
-        created_payment_link = await self._ln_bits_api.get_payment_link(response.id)
+    async def handle(self, create_claim_api: CreateClaimApi, expected_sats_amount: AmountSats) -> LnUrl:
+        existing_lnurl = await self._claim_storage.get_lnurl(create_claim_api.claim)
 
-        return created_payment_link.id, created_payment_link.lnurl
+        if existing_lnurl is not None:
+            return existing_lnurl
 
-    async def handle(self, create_claim_api: CreateClaimApi, expected_sats_amount: AmountSats) -> LnUrl:
-        existing_payment_link_id = self._claim_storage.get_claim(create_claim_api.claim)
+        existing_payment_link_id = await self._claim_storage.get_claim(create_claim_api.claim)
 
         if existing_payment_link_id is not None:
+            # Claims created before the lnurl column existed
             logger.warning(f"Claim ${create_claim_api.claim} already has an payment link {existing_payment_link_id}")
             existing_payment_link = await self._ln_bits_api.get_payment_link(existing_payment_link_id)
+            await self._claim_storage.save_lnurl(create_claim_api.claim, existing_payment_link.lnurl)
             return existing_payment_link.lnurl
 
-        id, lnurl = await self._do_create_pay_link(
+        if self._pay_link_pool is not None:
+            try:
+                pooled_lnurl = await self._pay_link_pool.take(create_claim_api.claim)
+            except ClaimExistsError:
+                return await self._created_concurrently(create_claim_api.claim)
+            if pooled_lnurl is not None:
+                return pooled_lnurl
+
+        id, lnurl = await create_pay_link(
+            self._ln_bits_api,
             expected_sats_amount,
             create_claim_api.claim,
-            DOMAIN + URL_PAYMENT_SUCCESS_CALLBACK,
+            self._callback_url,
+            self._lnurl_url_template,
         )
 
-        self._claim_storage.add(create_claim_api.claim, id)
+        try:
+            await self._claim_storage.add(create_claim_api.claim, id, lnurl)
+        except ClaimExistsError:
+            try:
+                await self._ln_bits_api.delete_pay_link(id)
+            except Exception as e:
+                logger.warning(f"Pay link {id} of concurrently created claim not deleted: {e!r}")
+            return await self._created_concurrently(create_claim_api.claim)
+
+        return lnurl
+
+    # Another request, possibly on another worker, created the claim first, its pay link wins
+    async def _created_concurrently(self, claim: DonationTokenClaim) -> LnUrl:
+        lnurl = await self._claim_storage.get_lnurl(claim)
+        if lnurl is None:
+            raise Exception(f"Claim {claim} was created concurrently without an LNURL")
 
         return lnurl
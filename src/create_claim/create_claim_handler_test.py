@@ -1 +1,160 @@
-# Todo
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+from typing import Awaitable, Callable, List, Tuple
+
+import aiohttp
+
+from claim.async_claim_storage import AsyncSqlLiteClaimStorage
+from claim.claim import DonationTokenClaim
+from create_claim.create_claim_handler import CreateClaimApi, CreateClaimHandler
+from create_claim.pay_link_pool import PayLinkPool
+from lnbits import (
+    AmountSats,
+    LnBitsApi,
+    LnBitsApiKey,
+    LnBitsPaymentLinkCreate,
+    LnBitsPaymentLinkGet,
+    LnBitsPaymentLinkId,
+    LnUrl,
+)
+
+SATS = AmountSats(Decimal(1000))
+claim_A = DonationTokenClaim("A")
+
+
+def create_fresh_storage(db_path: str) -> AsyncSqlLiteClaimStorage:
+    storage = AsyncSqlLiteClaimStorage(lambda: datetime.fromtimestamp(0), db_path, readers=1)
+    storage.create_tables()
+
+    return storage
+
+
+def payment_link(id: LnBitsPaymentLinkId) -> LnBitsPaymentLinkGet:
+    return LnBitsPaymentLinkGet(
+        id=id,
+        wallet="wallet",
+        description="",
+        min=1000,
+        max=1000000,
+        served_meta=0,
+        served_pr=0,
+        webhook_url=None,
+        comment_chars=0,
+        lnurl=LnUrl(f"LNURL{id}"),
+    )
+
+
+# Records every call, new pay links get ids from 10 on
+class FakeLnBitsApi(LnBitsApi):
+    def __init__(self) -> None:
+        super().__init__(aiohttp.ClientSession(), "", LnBitsApiKey(""))
+        self.calls: List[str] = []
+        self.on_create: Callable[[], Awaitable[None]] = lambda: asyncio.sleep(0)
+
+    async def create_pay_link(self, amount: AmountSats, description: str, callback_url: str) -> LnBitsPaymentLinkCreate:
+        self.calls.append("create_pay_link")
+        await self.on_create()
+
+        return payment_link(LnBitsPaymentLinkId(10 + self.calls.count("create_pay_link") - 1))
+
+    async def get_payment_link(self, payId: LnBitsPaymentLinkId) -> LnBitsPaymentLinkGet:
+        self.calls.append(f"get_payment_link {payId}")
+
+        return payment_link(payId)
+
+    async def delete_pay_link(self, payId: LnBitsPaymentLinkId) -> None:
+        self.calls.append(f"delete_pay_link {payId}")
+
+
+def run_with_handler(
+    db_path: str, test: Callable[[AsyncSqlLiteClaimStorage, FakeLnBitsApi], Awaitable[None]]
+) -> FakeLnBitsApi:
+    storage = create_fresh_storage(db_path)
+    ln_bits_apis: List[FakeLnBitsApi] = []
+
+    async def run() -> None:
+        ln_bits_api = FakeLnBitsApi()
+        ln_bits_apis.append(ln_bits_api)
+        try:
+            await test(storage, ln_bits_api)
+        finally:
+            await ln_bits_api._session.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    return ln_bits_apis[0]
+
+
+def test_new_claim_gets_a_new_pay_link(db_path: str) -> None:
+    async def test(storage: AsyncSqlLiteClaimStorage, ln_bits_api: FakeLnBitsApi) -> None:
+        handler = CreateClaimHandler(storage, ln_bits_api, "http://callback")
+
+        assert await handler.handle(CreateClaimApi(claim=claim_A), SATS) == "LNURL10"
+        assert await storage.get_claim(claim_A) == 10
+        assert await storage.get_lnurl(claim_A) == "LNURL10"
+
+    assert run_with_handler(db_path, test).calls == ["create_pay_link", "get_payment_link 10"]
+
+
+def test_stored_lnurl_is_returned_without_ln_bits(db_path: str) -> None:
+    async def test(storage: AsyncSqlLiteClaimStorage, ln_bits_api: FakeLnBitsApi) -> None:
+        await storage.add(claim_A, LnBitsPaymentLinkId(1), LnUrl("LNURL1"))
+        handler = CreateClaimHandler(storage, ln_bits_api, "http://callback")
+
+        assert await handler.handle(CreateClaimApi(claim=claim_A), SATS) == "LNURL1"
+
+    assert run_with_handler(db_path, test).calls == []
+
+
+def test_lnurl_of_older_claim_is_fetched_once_and_saved(db_path: str) -> None:
+    async def test(storage: AsyncSqlLiteClaimStorage, ln_bits_api: FakeLnBitsApi) -> None:
+        # Created before the lnurl column existed
+        await storage.add(claim_A, LnBitsPaymentLinkId(1))
+        handler = CreateClaimHandler(storage, ln_bits_api, "http://callback")
+
+        assert await handler.handle(CreateClaimApi(claim=claim_A), SATS) == "LNURL1"
+        assert await storage.get_lnurl(claim_A) == "LNURL1"
+        assert await handler.handle(CreateClaimApi(claim=claim_A), SATS) == "LNURL1"
+
+    assert run_with_handler(db_path, test).calls == ["get_payment_link 1"]
+
+
+def test_pooled_pay_link_is_bound_without_ln_bits(db_path: str) -> None:
+    created: List[int] = []
+
+    async def create_pay_link() -> Tuple[LnBitsPaymentLinkId, LnUrl]:
+        created.append(1)
+        return LnBitsPaymentLinkId(100 + len(created)), LnUrl(f"LNURL{100 + len(created)}")
+
+    async def test(storage: AsyncSqlLiteClaimStorage, ln_bits_api: FakeLnBitsApi) -> None:
+        await storage.add_pooled_pay_link(LnBitsPaymentLinkId(1), LnUrl("LNURL1"))
+        pool = PayLinkPool(storage, create_pay_link, 0, 1)
+        await pool.start()
+        handler = CreateClaimHandler(storage, ln_bits_api, "http://callback", pay_link_pool=pool)
+
+        assert await handler.handle(CreateClaimApi(claim=claim_A), SATS) == "LNURL1"
+        assert await storage.get_claim(claim_A) == 1
+        assert pool.hits == 1
+        await pool.close()
+
+    assert run_with_handler(db_path, test).calls == []
+
+
+def test_concurrently_created_claim_keeps_the_first_pay_link(db_path: str) -> None:
+    async def test(storage: AsyncSqlLiteClaimStorage, ln_bits_api: FakeLnBitsApi) -> None:
+        # Another request creates the claim while this one waits on LNbits
+        async def create_concurrently() -> None:
+            await storage.add(claim_A, LnBitsPaymentLinkId(1), LnUrl("LNURL1"))
+
+        ln_bits_api.on_create = create_concurrently
+        handler = CreateClaimHandler(storage, ln_bits_api, "http://callback")
+
+        assert await handler.handle(CreateClaimApi(claim=claim_A), SATS) == "LNURL1"
+        assert await storage.get_claim(claim_A) == 1
+
+    # The orphaned pay link is deleted
+    assert run_with_handler(db_path, test).calls == ["create_pay_link", "get_payment_link 10", "delete_pay_link 10"]
@@ -0,0 +1,23 @@
+from typing import Optional, Tuple
+
+from lnbits import AmountSats, LnBitsApi, LnBitsPaymentLinkId, LnUrl
+from lnurl import encode_lnurl
+
+
+# lnurl_url_template, e.g. "https://lnbits.example/lnurlp/{id}", lets the LNURL be derived from the link id
+# instead of fetched from LNbits. The LNURL endpoint differs between LNbits versions, so it has to be configured.
+async def create_pay_link(
+    ln_bits_api: LnBitsApi,
+    amount: AmountSats,
+    description: str,
+    callback_url: str,
+    lnurl_url_template: Optional[str] = None,
+) -> Tuple[LnBitsPaymentLinkId, LnUrl]:
+    response = await ln_bits_api.create_pay_link(amount, description, callback_url)
+
+    if lnurl_url_template:
+        return response.id, encode_lnurl(lnurl_url_template.format(id=response.id))
+
+    created_payment_link = await ln_bits_api.get_payment_link(response.id)
+
+    return created_payment_link.id, created_payment_link.lnurl
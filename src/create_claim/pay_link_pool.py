@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, Tuple
+
+from claim.async_claim_storage import AsyncClaimStorage
+from claim.claim import DonationTokenClaim
+from lnbits import LnBitsPaymentLinkId, LnUrl
+
+CreatePayLink = Callable[[], Awaitable[Tuple[LnBitsPaymentLinkId, LnUrl]]]
+
+
+# Pay links created ahead of time, so a new claim only binds one instead of waiting on LNbits. Once the pool drops
+# to low_watermark, it is refilled in the background up to high_watermark.
+class PayLinkPool:
+    def __init__(
+        self,
+        claim_storage: AsyncClaimStorage,
+        create_pay_link: CreatePayLink,
+        low_watermark: int,
+        high_watermark: int,
+    ) -> None:
+        self._claim_storage = claim_storage
+        self._create_pay_link = create_pay_link
+        self._low_watermark = low_watermark
+        self._high_watermark = high_watermark
+        self._refill_task: Optional[asyncio.Task[None]] = None
+        self.depth = 0
+        self.hits = 0
+        self.misses = 0
+
+    async def start(self) -> None:
+        self.depth = await self._claim_storage.count_pooled_pay_links()
+        self._refill_if_needed()
+
+    async def take(self, claim: DonationTokenClaim) -> Optional[LnUrl]:
+        pay_link = await self._claim_storage.add_from_pool(claim)
+
+        if pay_link is None:
+            self.misses += 1
+            self.depth = 0
+        else:
+            self.hits += 1
+            self.depth = max(self.depth - 1, 0)
+
+        self._refill_if_needed()
+
+        return pay_link[1] if pay_link is not None else None
+
+    def _refill_if_needed(self) -> None:
+        if self.depth <= self._low_watermark and self._refill_task is None:
+            self._refill_task = asyncio.get_running_loop().create_task(self._refill())
+
+    async def _refill(self) -> None:
+        try:
+            # Other workers may share the pool, so start from the stored count
+            self.depth = await self._claim_storage.count_pooled_pay_links()
+            while self.depth < self._high_watermark:
+                id, lnurl = await self._create_pay_link()
+                await self._claim_storage.add_pooled_pay_link(id, lnurl)
+                self.depth += 1
+        except Exception:
+            logging.exception("PayLinkPool: refill failed")
+        finally:
+            self._refill_task = None
+
+    async def close(self) -> None:
+        if self._refill_task is not None:
+            self._refill_task.cancel()
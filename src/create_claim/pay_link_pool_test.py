@@ -0,0 +1,72 @@
+import asyncio
+from datetime import datetime
+from typing import List, Tuple
+
+from claim.async_claim_storage import AsyncSqlLiteClaimStorage
+from claim.claim import DonationTokenClaim
+from create_claim.pay_link_pool import PayLinkPool
+from lnbits import LnBitsPaymentLinkId, LnUrl
+
+
+def create_fresh_storage(db_path: str) -> AsyncSqlLiteClaimStorage:
+    storage = AsyncSqlLiteClaimStorage(lambda: datetime.fromtimestamp(0), db_path, readers=1)
+    storage.create_tables()
+
+    return storage
+
+
+def test_pool_is_filled_taken_and_refilled(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    created: List[int] = []
+
+    async def create_pay_link() -> Tuple[LnBitsPaymentLinkId, LnUrl]:
+        created.append(1)
+        return LnBitsPaymentLinkId(len(created)), LnUrl(f"LNURL{len(created)}")
+
+    async def wait_for_refill(pool: PayLinkPool) -> None:
+        while pool._refill_task is not None:
+            await asyncio.sleep(0.01)
+
+    async def run() -> None:
+        pool = PayLinkPool(storage, create_pay_link, 1, 3)
+        await pool.start()
+        await wait_for_refill(pool)
+        assert pool.depth == 3
+
+        assert await pool.take(DonationTokenClaim("A")) == "LNURL1"
+        assert await pool.take(DonationTokenClaim("B")) == "LNURL2"
+        assert pool.depth == 1
+        await wait_for_refill(pool)
+
+        assert pool.depth == 3
+        assert await storage.count_pooled_pay_links() == 3
+        assert await storage.get_claim(DonationTokenClaim("A")) == 1
+        assert pool.hits == 2
+        assert pool.misses == 0
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    assert len(created) == 5
+
+
+def test_empty_pool_counts_miss(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+
+    async def create_pay_link() -> Tuple[LnBitsPaymentLinkId, LnUrl]:
+        raise Exception("LNbits is down")
+
+    async def run() -> None:
+        pool = PayLinkPool(storage, create_pay_link, 1, 3)
+        await pool.start()
+
+        assert await pool.take(DonationTokenClaim("A")) is None
+        assert pool.misses == 1
+        await pool.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
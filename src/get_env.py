@@ -1,8 +1,9 @@
 import os
+from typing import Optional
 
 
-def get_env(name: str) -> str:
-    raw = os.environ.get(name)
+def get_env(name: str, default: Optional[str] = None) -> str:
+    raw = os.environ.get(name, default)
     if raw is None:
         raise Exception("ENV variable '" + name + "' is missing")
 
@@ -0,0 +1,33 @@
+import time
+from typing import Awaitable, Callable
+
+from aiohttp import web
+
+from metrics import REGISTRY
+
+REQUEST_SECONDS = REGISTRY.histogram("http_request_seconds", "Request latency per route", ["method", "route"])
+RESPONSES = REGISTRY.counter(
+    "http_responses_total", "Responses per route and status code", ["method", "route", "status"]
+)
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+# Routes are labelled by their pattern, so claims don't each get their own series
+@web.middleware
+async def metrics_middleware(request: web.Request, handler: Handler) -> web.StreamResponse:
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else "unmatched"
+    status = 500
+    started = time.perf_counter()
+
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        REQUEST_SECONDS.labels(request.method, route).observe(time.perf_counter() - started)
+        RESPONSES.labels(request.method, route, str(status)).inc()
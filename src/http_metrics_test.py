@@ -0,0 +1,40 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+
+from http_metrics import REQUEST_SECONDS, RESPONSES, metrics_middleware
+
+
+def test_requests_are_counted_per_route_pattern() -> None:
+    async def claim_status(request: web.Request) -> web.Response:
+        if request.match_info["claim"] == "missing":
+            return web.Response(status=404)
+        return web.Response(body="{}")
+
+    async def run() -> None:
+        app = web.Application(middlewares=[metrics_middleware])
+        app.router.add_get("/claim/{claim}", claim_status)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+
+        ok = RESPONSES.labels("GET", "/claim/{claim}", "200").value
+        not_found = RESPONSES.labels("GET", "/claim/{claim}", "404").value
+        count = sum(REQUEST_SECONDS.labels("GET", "/claim/{claim}").counts)
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                for claim in ["A", "B", "missing"]:
+                    async with session.get(f"http://127.0.0.1:{port}/claim/{claim}") as response:
+                        await response.read()
+        finally:
+            await runner.cleanup()
+
+        assert RESPONSES.labels("GET", "/claim/{claim}", "200").value == ok + 2
+        assert RESPONSES.labels("GET", "/claim/{claim}", "404").value == not_found + 1
+        assert sum(REQUEST_SECONDS.labels("GET", "/claim/{claim}").counts) == count + 3
+
+    asyncio.run(run())
@@ -0,0 +1,37 @@
+import json
+from typing import Any, Type, TypeVar
+
+from aiohttp import web
+from pydantic import BaseModel, ValidationError
+
+M = TypeVar("M", bound=BaseModel)
+
+# orjson is optional, it encodes responses several times faster than the json module
+try:
+    import orjson
+
+    def dumps(value: Any) -> bytes:
+        return orjson.dumps(value)
+
+    def loads(body: bytes | str) -> Any:
+        return orjson.loads(body)
+
+except ImportError:
+
+    def dumps(value: Any) -> bytes:
+        return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+    def loads(body: bytes | str) -> Any:
+        return json.loads(body)
+
+
+# Validates the raw body in one pass, pydantic compiles the validator once per model, so no dict is built first.
+# Invalid bodies are answered with a 400 instead of reaching storage or failing with a 500.
+def parse_body(model: Type[M], body: bytes) -> M:
+    try:
+        return model.model_validate_json(body)
+    except ValidationError as e:
+        fields = [".".join(str(part) for part in error["loc"]) or error["type"] for error in e.errors()]
+        raise web.HTTPBadRequest(
+            text=dumps({"error": "invalid body", "fields": fields}).decode("utf-8"), content_type="application/json"
+        )
@@ -0,0 +1,41 @@
+import json
+
+import pytest
+from aiohttp import web
+from pydantic import BaseModel
+
+from json_codec import dumps, loads, parse_body
+
+
+class Body(BaseModel):
+    claim: str
+    amount: int
+
+
+def test_parse_body() -> None:
+    assert parse_body(Body, b'{"claim": "A", "amount": 1}') == Body(claim="A", amount=1)
+
+
+@pytest.mark.parametrize(
+    "body, fields",
+    [
+        (b"", ["json_invalid"]),
+        (b'{"claim": "A"', ["json_invalid"]),
+        (b'{"claim": "A"}', ["amount"]),
+        (b'{"claim": 1, "amount": "x"}', ["claim", "amount"]),
+        (b"[]", ["model_type"]),
+    ],
+)
+def test_invalid_body_is_a_bad_request(body: bytes, fields: list[str]) -> None:
+    with pytest.raises(web.HTTPBadRequest) as e:
+        parse_body(Body, body)
+
+    assert e.value.text is not None
+    assert json.loads(e.value.text) == {"error": "invalid body", "fields": fields}
+
+
+def test_dumps_is_json() -> None:
+    value = {"key": None, "status": ["paid"], "lnurl": "LNURL1"}
+
+    assert json.loads(dumps(value)) == value
+    assert loads(dumps(value)) == value
@@ -1,8 +1,19 @@
 from decimal import Decimal
+import asyncio
 import logging
-from typing import Dict, NewType, Optional, Union
+import random
+from types import SimpleNamespace
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NewType, Optional, Tuple, Union
 import aiohttp
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+
+from body_log import BodyLog
+from json_codec import loads
+from coalescer import Coalescer
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
 
 
 LnUrl = NewType("LnUrl", str)
@@ -70,11 +81,105 @@ class LnBitsPaymentLinkGet(LnBitsPaymentLinkCreate):
     lnurl: LnUrl
 
 
+class LnBitsConnectionStats:
+    def __init__(self) -> None:
+        self.created = 0
+        self.reused = 0
+
+    async def _on_connection_create_end(
+        self, session: aiohttp.ClientSession, context: SimpleNamespace, params: aiohttp.TraceConnectionCreateEndParams
+    ) -> None:
+        self.created += 1
+
+    async def _on_connection_reuseconn(
+        self, session: aiohttp.ClientSession, context: SimpleNamespace, params: aiohttp.TraceConnectionReuseconnParams
+    ) -> None:
+        self.reused += 1
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+
+        return trace_config
+
+
+def create_ln_bits_session(
+    pool_size: int, pool_size_per_host: int, keepalive_timeout: float, dns_cache_ttl: int
+) -> Tuple[aiohttp.ClientSession, LnBitsConnectionStats]:
+    stats = LnBitsConnectionStats()
+    connector = aiohttp.TCPConnector(
+        limit=pool_size,
+        limit_per_host=pool_size_per_host,
+        keepalive_timeout=keepalive_timeout,
+        ttl_dns_cache=dns_cache_ttl,
+    )
+
+    return aiohttp.ClientSession(connector=connector, trace_configs=[stats.trace_config()]), stats
+
+
+LN_BITS_SECONDS = REGISTRY.histogram(
+    "lnbits_request_seconds", "LNbits API call latency, retries included", ["operation"]
+)
+LN_BITS_RESPONSES = REGISTRY.counter(
+    "lnbits_responses_total", "LNbits responses by status code, error for failed connections", ["operation", "status"]
+)
+
+
+@contextmanager
+def _count_errors(operation: str) -> Iterator[None]:
+    try:
+        yield
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+        LN_BITS_RESPONSES.labels(operation, "error").inc()
+        raise
+
+
 class LnBitsApi:
-    def __init__(self, session: aiohttp.ClientSession, baseUrl: str, api_key: LnBitsApiKey) -> None:
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        baseUrl: str,
+        api_key: LnBitsApiKey,
+        timeout: float = 10,
+        retries: int = 2,
+        retry_backoff: float = 0.2,
+        body_log: Optional[BodyLog] = None,
+    ) -> None:
         self._session = session
         self._baseUrl = baseUrl
         self._api_key = api_key
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._body_log = body_log if body_log is not None else BodyLog(logger)
+
+    # Only for idempotent GETs: retries connection errors, timeouts and 5xx with jittered exponential backoff
+    async def _get(self, url: str, operation: str) -> bytes:
+        with LN_BITS_SECONDS.labels(operation).time():
+            return await self._get_with_retries(url, operation)
+
+    async def _get_with_retries(self, url: str, operation: str) -> bytes:
+        for attempt in range(self._retries + 1):
+            try:
+                async with self._session.get(
+                    url, headers={"X-Api-Key": self._api_key}, timeout=self._timeout
+                ) as response:
+                    body = await response.read()
+                    LN_BITS_RESPONSES.labels(operation, str(response.status)).inc()
+                    logger.info("Outgoing >>: GET %s, Result: %s", url, response.status)
+                    self._body_log.log(f"Outgoing >>: GET {url}", body)
+                    if response.status < 500 or attempt == self._retries:
+                        return body
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                LN_BITS_RESPONSES.labels(operation, "error").inc()
+                if attempt == self._retries:
+                    raise
+                logger.warning("Outgoing >>: GET %s failed: %r, retrying", url, e)
+
+            await asyncio.sleep(random.uniform(0, self._retry_backoff * 2**attempt))
+
+        raise Exception(f"GET {url} failed after {self._retries + 1} attempts")
 
     async def create_pay_link(
         self,
@@ -96,26 +201,138 @@ class LnBitsApi:
             # "success_url": "minapps-priceconvertor://success",
         }
 
-        async with self._session.post(url, headers={"X-Api-Key": self._api_key}, json=request_body) as response:
-            logging.info(f"Outgoing >>: POST {url}, Result: {response.status} {await response.text()}")
-            result = await response.json()
+        with LN_BITS_SECONDS.labels("create_pay_link").time(), _count_errors("create_pay_link"):
+            async with self._session.post(
+                url, headers={"X-Api-Key": self._api_key}, json=request_body, timeout=self._timeout
+            ) as response:
+                body = await response.read()
+        LN_BITS_RESPONSES.labels("create_pay_link", str(response.status)).inc()
+        logger.info("Outgoing >>: POST %s, Result: %s", url, response.status)
+        self._body_log.log(f"Outgoing >>: POST {url}", body)
 
-            return LnBitsPaymentLinkCreate(**result)
+        return LnBitsPaymentLinkCreate.model_validate_json(body)
 
     async def get_payment_link(self, payId: LnBitsPaymentLinkId) -> LnBitsPaymentLinkGet:
         url = f"{self._baseUrl}/lnurlp/api/v1/links/{payId}"
 
-        async with self._session.get(url, headers={"X-Api-Key": self._api_key}) as response:
-            logging.info(f"Outgoing >>: GET {url}, Result: {response.status} {await response.text()}")
-            result = await response.json()
+        return LnBitsPaymentLinkGet.model_validate_json(await self._get(url, "get_payment_link"))
+
+    async def delete_pay_link(self, payId: LnBitsPaymentLinkId) -> None:
+        url = f"{self._baseUrl}/lnurlp/api/v1/links/{payId}"
+
+        with LN_BITS_SECONDS.labels("delete_pay_link").time(), _count_errors("delete_pay_link"):
+            async with self._session.delete(
+                url, headers={"X-Api-Key": self._api_key}, timeout=self._timeout
+            ) as response:
+                body = await response.read()
+        LN_BITS_RESPONSES.labels("delete_pay_link", str(response.status)).inc()
+        logger.info("Outgoing >>: DELETE %s, Result: %s", url, response.status)
+        self._body_log.log(f"Outgoing >>: DELETE {url}", body)
+
+        # Already deleted is fine
+        if response.status >= 400 and response.status != 404:
+            raise Exception(f"Deleting pay link {payId} failed with {response.status}")
 
-            return LnBitsPaymentLinkGet(**result)
+    # Wallet details of the API key, a cheap call that fails on a wrong key or an unreachable LNbits. Not retried,
+    # the readiness probe asks again anyway.
+    async def ping(self) -> None:
+        url = f"{self._baseUrl}/api/v1/wallet"
+
+        with LN_BITS_SECONDS.labels("ping").time(), _count_errors("ping"):
+            async with self._session.get(url, headers={"X-Api-Key": self._api_key}, timeout=self._timeout) as response:
+                await response.read()
+        LN_BITS_RESPONSES.labels("ping", str(response.status)).inc()
+
+        if response.status >= 400:
+            raise Exception(f"LNbits wallet lookup failed with {response.status}")
 
     async def get_payment(self, payment_hash: PaymentHash) -> LnBitsPayment:
         url = f"{self._baseUrl}/api/v1/payments/{payment_hash}"
 
-        async with self._session.get(url, headers={"X-Api-Key": self._api_key}) as response:
-            logging.info(f"Outgoing >>: POST {url}, Result: {response.status} {await response.text()}")
-            result = await response.json()
+        return LnBitsPayment.model_validate_json(await self._get(url, "get_payment"))
+
+    # Latest payments of the wallet, newest first from offset on. Payments that are not from a pay link are skipped
+    async def get_payments(self, limit: int, offset: int = 0) -> List[LnBitsPaymentDetails]:
+        url = f"{self._baseUrl}/api/v1/payments?limit={limit}&offset={offset}"
+
+        payments: List[LnBitsPaymentDetails] = []
+        for item in loads(await self._get(url, "get_payments")):
+            try:
+                payments.append(LnBitsPaymentDetails.model_validate(item))
+            except ValidationError:
+                pass
+
+        return payments
+
+
+# Concurrent lookups of the same payment or pay link share one request, paid payments and pay links are cached
+# for cache_ttl seconds. With batch_window, payment lookups arriving within the window are first looked up in one
+# call to the payments list; payments not found there as paid fall back to get_payment.
+class CoalescingLnBitsApi(LnBitsApi):
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        baseUrl: str,
+        api_key: LnBitsApiKey,
+        timeout: float = 10,
+        retries: int = 2,
+        retry_backoff: float = 0.2,
+        body_log: Optional[BodyLog] = None,
+        cache_ttl: float = 60,
+        batch_window: float = 0,
+        batch_limit: int = 100,
+    ) -> None:
+        super().__init__(session, baseUrl, api_key, timeout, retries, retry_backoff, body_log)
+        self.payments: Coalescer[PaymentHash, LnBitsPayment] = Coalescer(cache_ttl, lambda payment: payment.paid)
+        self.payment_links: Coalescer[LnBitsPaymentLinkId, LnBitsPaymentLinkGet] = Coalescer(cache_ttl)
+        self._batch_window = batch_window
+        self._batch_limit = batch_limit
+        self._batch: Dict[PaymentHash, asyncio.Future[LnBitsPayment]] = {}
+        self._batch_task: Optional[asyncio.Task[None]] = None
+        self.batched = 0
+
+    async def get_payment_link(self, payId: LnBitsPaymentLinkId) -> LnBitsPaymentLinkGet:
+        return await self.payment_links.get(payId, lambda: LnBitsApi.get_payment_link(self, payId))
+
+    async def get_payment(self, payment_hash: PaymentHash) -> LnBitsPayment:
+        if self._batch_window <= 0:
+            return await self.payments.get(payment_hash, lambda: LnBitsApi.get_payment(self, payment_hash))
+
+        return await self.payments.get(payment_hash, lambda: self._get_payment_batched(payment_hash))
+
+    async def _get_payment_batched(self, payment_hash: PaymentHash) -> LnBitsPayment:
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future[LnBitsPayment] = loop.create_future()
+        self._batch[payment_hash] = future
+        if self._batch_task is None:
+            self._batch_task = loop.create_task(self._flush_batch())
+
+        return await future
+
+    async def _flush_batch(self) -> None:
+        await asyncio.sleep(self._batch_window)
+        batch, self._batch, self._batch_task = self._batch, {}, None
+
+        paid: Dict[str, LnBitsPaymentDetails] = {}
+        if len(batch) > 1:
+            try:
+                paid = {p.payment_hash: p for p in await self.get_payments(self._batch_limit) if not p.pending}
+            except Exception as e:
+                logger.warning("Outgoing >>: payments list failed: %r, looking payments up one by one", e)
+
+        async def resolve(payment_hash: PaymentHash, future: asyncio.Future[LnBitsPayment]) -> None:
+            details = paid.get(payment_hash)
+            try:
+                if details is not None:
+                    self.batched += 1
+                    payment = LnBitsPayment(paid=True, preimage=details.preimage, details=details)
+                else:
+                    payment = await LnBitsApi.get_payment(self, payment_hash)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                return
+            if not future.done():
+                future.set_result(payment)
 
-            return LnBitsPayment(**result)
+        await asyncio.gather(*[resolve(payment_hash, future) for payment_hash, future in batch.items()])
@@ -0,0 +1,186 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List
+
+import pytest
+from aiohttp import web
+
+from lnbits import (
+    LN_BITS_RESPONSES,
+    CoalescingLnBitsApi,
+    LnBitsApi,
+    LnBitsApiKey,
+    LnBitsConnectionStats,
+    LnBitsPaymentLinkId,
+    PaymentHash,
+    create_ln_bits_session,
+)
+
+payment_link = {
+    "id": 1,
+    "wallet": "wallet",
+    "description": "A",
+    "min": 10,
+    "max": 1000000,
+    "served_meta": 0,
+    "served_pr": 0,
+    "webhook_url": None,
+    "comment_chars": 0,
+    "lnurl": "LNURL1",
+}
+
+
+Handler = Callable[[web.Request], Awaitable[web.StreamResponse]]
+
+
+# Local stand-in for LNbits serving GET /lnurlp/api/v1/links/{id}, or the given path
+async def with_ln_bits(
+    handler: Handler,
+    test: Callable[[LnBitsApi, LnBitsConnectionStats], Awaitable[None]],
+    path: str = "/lnurlp/api/v1/links/{id}",
+) -> None:
+    app = web.Application()
+    app.router.add_get(path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    session, stats = create_ln_bits_session(10, 10, 30, 300)
+    try:
+        await test(LnBitsApi(session, f"http://127.0.0.1:{port}", LnBitsApiKey("key"), 1, 2, 0.01), stats)
+    finally:
+        await session.close()
+        await runner.cleanup()
+
+
+def test_get_is_retried_on_server_error() -> None:
+    calls: List[int] = []
+
+    async def handler(request: web.Request) -> web.Response:
+        calls.append(1)
+        if len(calls) < 3:
+            return web.Response(status=503)
+        return web.json_response(payment_link)
+
+    async def test(api: LnBitsApi, stats: LnBitsConnectionStats) -> None:
+        link = await api.get_payment_link(LnBitsPaymentLinkId(1))
+        assert link.lnurl == "LNURL1"
+
+    unavailable = LN_BITS_RESPONSES.labels("get_payment_link", "503").value
+    asyncio.run(with_ln_bits(handler, test))
+
+    assert len(calls) == 3
+    # Every attempt is counted with its status code
+    assert LN_BITS_RESPONSES.labels("get_payment_link", "503").value == unavailable + 2
+
+
+def test_get_is_retried_on_timeout() -> None:
+    calls: List[int] = []
+
+    async def handler(request: web.Request) -> web.Response:
+        calls.append(1)
+        if len(calls) == 1:
+            await asyncio.sleep(2)
+        return web.json_response(payment_link)
+
+    async def test(api: LnBitsApi, stats: LnBitsConnectionStats) -> None:
+        link = await api.get_payment_link(LnBitsPaymentLinkId(1))
+        assert link.id == 1
+
+    asyncio.run(with_ln_bits(handler, test))
+
+    assert len(calls) == 2
+
+
+def test_connections_are_reused() -> None:
+    async def handler(request: web.Request) -> web.Response:
+        return web.json_response(payment_link)
+
+    async def test(api: LnBitsApi, stats: LnBitsConnectionStats) -> None:
+        for _ in range(5):
+            await api.get_payment_link(LnBitsPaymentLinkId(1))
+
+        assert stats.created == 1
+        assert stats.reused == 4
+
+    asyncio.run(with_ln_bits(handler, test))
+
+
+def test_ping_fails_on_a_rejected_api_key() -> None:
+    statuses = [200, 401]
+
+    async def handler(request: web.Request) -> web.Response:
+        assert request.headers["X-Api-Key"] == "key"
+        return web.json_response({"id": "wallet", "name": "wallet", "balance": 0}, status=statuses.pop(0))
+
+    async def test(api: LnBitsApi, stats: LnBitsConnectionStats) -> None:
+        await api.ping()
+        with pytest.raises(Exception, match="failed with 401"):
+            await api.ping()
+
+    asyncio.run(with_ln_bits(handler, test, "/api/v1/wallet"))
+
+
+def payment(payment_hash: str, pending: bool) -> Dict[str, Any]:
+    return {
+        "checking_id": payment_hash,
+        "pending": pending,
+        "amount": 1000000,
+        "fee": 0,
+        "memo": "A",
+        "time": 0,
+        "bolt11": "lnbc",
+        "preimage": "0" * 64,
+        "payment_hash": payment_hash,
+        "extra": {"tag": "lnurlp", "link": 1, "comment": None, "extra": "1000"},
+        "wallet_id": "wallet",
+    }
+
+
+def test_payment_lookups_are_batched() -> None:
+    calls: List[str] = []
+
+    async def list_handler(request: web.Request) -> web.Response:
+        calls.append("list")
+        # An outgoing payment without pay link extra is skipped
+        outgoing = {**payment("C", False), "extra": {}}
+        return web.json_response([payment("A", False), payment("B", True), outgoing])
+
+    async def get_handler(request: web.Request) -> web.Response:
+        payment_hash = request.match_info["payment_hash"]
+        calls.append(payment_hash)
+        return web.json_response({"paid": True, "preimage": "0" * 64, "details": payment(payment_hash, False)})
+
+    async def run() -> None:
+        app = web.Application()
+        app.router.add_get("/api/v1/payments", list_handler)
+        app.router.add_get("/api/v1/payments/{payment_hash}", get_handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+
+        session, _ = create_ln_bits_session(10, 10, 30, 300)
+        api = CoalescingLnBitsApi(
+            session, f"http://127.0.0.1:{port}", LnBitsApiKey("key"), batch_window=0.01, batch_limit=10
+        )
+        try:
+            hashes = ["A", "A", "B", "C"]
+            payments = await asyncio.gather(*[api.get_payment(PaymentHash(h)) for h in hashes])
+            assert [p.details.payment_hash for p in payments] == hashes
+            assert all(p.paid for p in payments)
+
+            # Paid payments are cached
+            await api.get_payment(PaymentHash("A"))
+        finally:
+            await session.close()
+            await runner.cleanup()
+
+        assert sorted(calls) == ["B", "C", "list"]
+        assert api.batched == 1
+        assert api.payments.coalesced == 1
+        assert api.payments.hits == 1
+
+    asyncio.run(run())
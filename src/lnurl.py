@@ -0,0 +1,48 @@
+from typing import List
+
+from lnbits import LnUrl
+
+BECH32_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+BECH32_GENERATOR = [0x3B6A57B2, 0x26508E6D, 0x1EA119FA, 0x3D4233DD, 0x2A1462B3]
+
+
+def _bech32_polymod(values: List[int]) -> int:
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1FFFFFF) << 5 ^ value
+        for i in range(5):
+            checksum ^= BECH32_GENERATOR[i] if ((top >> i) & 1) else 0
+
+    return checksum
+
+
+def _bech32_checksum(hrp: str, data: List[int]) -> List[int]:
+    expanded_hrp = [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+    polymod = _bech32_polymod(expanded_hrp + data + [0, 0, 0, 0, 0, 0]) ^ 1
+
+    return [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+
+
+def _to_5_bit_words(data: bytes) -> List[int]:
+    words: List[int] = []
+    accumulator = 0
+    bits = 0
+    for byte in data:
+        accumulator = (accumulator << 8) | byte
+        bits += 8
+        while bits >= 5:
+            bits -= 5
+            words.append((accumulator >> bits) & 31)
+    if bits > 0:
+        words.append((accumulator << (5 - bits)) & 31)
+
+    return words
+
+
+# LUD-01: bech32 encoded url, without the 90 characters limit of BIP-173
+def encode_lnurl(url: str) -> LnUrl:
+    data = _to_5_bit_words(url.encode("utf-8"))
+    encoded = "".join(BECH32_CHARSET[d] for d in data + _bech32_checksum("lnurl", data))
+
+    return LnUrl(f"lnurl1{encoded}".upper())
@@ -0,0 +1,11 @@
+from lnurl import encode_lnurl
+
+
+def test_encode_lnurl() -> None:
+    # Example from LUD-01
+    url = "https://service.com/api?q=3fc3645b439ce8e7f2553a69e5267081d96dcd340693afabe04be7b0ccd178df"
+
+    assert encode_lnurl(url) == (
+        "LNURL1DP68GURN8GHJ7UM9WFMXJCM99E3K7MF0V9CXJ0M385EKVCENXC6R2C35XVUKXEFCV5MKVV34X5EKZD3EV56NYD3HXQURZEPEXEJXXEPNXSCRVWF"
+        + "NV9NXZCN9XQ6XYEFHVGCXXCMYXYMNSERXFQ5FNS"
+    )
@@ -0,0 +1,32 @@
+import asyncio
+from typing import Optional
+
+from metrics import REGISTRY
+
+EVENT_LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop wakes up a sleeping task, blocking calls on the loop show up here",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+
+
+# Sleeps interval seconds in a loop and records how much later than asked the sleep returned
+class LoopLagMonitor:
+    def __init__(self, interval: float = 0.1) -> None:
+        self._interval = interval
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        lag = EVENT_LOOP_LAG_SECONDS.labels()
+        while True:
+            expected = loop.time() + self._interval
+            await asyncio.sleep(self._interval)
+            lag.observe(max(0.0, loop.time() - expected))
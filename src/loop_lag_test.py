@@ -0,0 +1,21 @@
+import asyncio
+import time
+
+from loop_lag import EVENT_LOOP_LAG_SECONDS, LoopLagMonitor
+
+
+def test_blocking_the_loop_is_recorded_as_lag() -> None:
+    lag = EVENT_LOOP_LAG_SECONDS.labels()
+
+    async def run() -> None:
+        monitor = LoopLagMonitor(0.01)
+        monitor.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.3)
+        await asyncio.sleep(0.02)
+        await monitor.close()
+
+    sum_before = lag.sum
+    asyncio.run(run())
+
+    assert lag.sum - sum_before >= 0.25
@@ -0,0 +1,199 @@
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Sequence, Tuple, TypeVar, cast
+
+F = TypeVar("F", bound=Callable[..., Any])
+AF = TypeVar("AF", bound=Callable[..., Awaitable[Any]])
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+# Seconds, from a cached SQLite read up to an LNbits call running into its timeout
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else repr(value)
+
+
+class HistogramSeries:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._buckets, value)
+        # SqlLiteClaimStorage observes from its connection threads
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram:
+    def __init__(
+        self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> None:
+        self._name = name
+        self._help = help
+        self._label_names = label_names
+        self._buckets = buckets
+        self._series: Dict[Tuple[str, ...], HistogramSeries] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> HistogramSeries:
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(values, HistogramSeries(self._buckets))
+
+        return series
+
+    # Decorators timing a method, labelled by its name
+    def timed(self, method: F) -> F:
+        series = self.labels(method.__name__)
+
+        @functools.wraps(method)
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            with series.time():
+                return method(*args, **kwargs)
+
+        return cast(F, timed)
+
+    def timed_async(self, method: AF) -> AF:
+        series = self.labels(method.__name__)
+
+        @functools.wraps(method)
+        async def timed(*args: Any, **kwargs: Any) -> Any:
+            with series.time():
+                return await method(*args, **kwargs)
+
+        return cast(AF, timed)
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self._name} {self._help}"
+        yield f"# TYPE {self._name} histogram"
+        for values, series in list(self._series.items()):
+            with series._lock:
+                counts, total = list(series.counts), series.sum
+
+            cumulative = 0
+            for bucket, count in zip([*map(_format_value, self._buckets), "+Inf"], counts):
+                cumulative += count
+                labels = _format_labels([*self._label_names, "le"], [*values, bucket])
+                yield f"{self._name}_bucket{labels} {cumulative}"
+
+            labels = _format_labels(self._label_names, values)
+            yield f"{self._name}_sum{labels} {_format_value(total)}"
+            yield f"{self._name}_count{labels} {cumulative}"
+
+
+class CounterSeries:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label_names: Sequence[str] = ()) -> None:
+        self._name = name
+        self._help = help
+        self._label_names = label_names
+        self._series: Dict[Tuple[str, ...], CounterSeries] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str) -> CounterSeries:
+        series = self._series.get(values)
+        if series is None:
+            with self._lock:
+                series = self._series.setdefault(values, CounterSeries())
+
+        return series
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self._name} {self._help}"
+        yield f"# TYPE {self._name} counter"
+        for values, series in list(self._series.items()):
+            yield f"{self._name}{_format_labels(self._label_names, values)} {_format_value(series.value)}"
+
+
+# Read when scraped, so queue depths cost nothing between scrapes
+class Gauge:
+    def __init__(self, name: str, help: str, read: Callable[[], float]) -> None:
+        self._name = name
+        self._help = help
+        self._read = read
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self._name} {self._help}"
+        yield f"# TYPE {self._name} gauge"
+        yield f"{self._name} {_format_value(self._read())}"
+
+
+# Metrics of one process in the Prometheus text format. With WEB_WORKERS > 1 every worker has its own.
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Histogram | Counter | Gauge] = {}
+
+    def _register(self, name: str, metric: Histogram | Counter | Gauge) -> None:
+        if name in self._metrics:
+            raise Exception(f"Metric {name} is already registered")
+        self._metrics[name] = metric
+
+    def histogram(
+        self, name: str, help: str, label_names: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        histogram = Histogram(name, help, label_names, buckets)
+        self._register(name, histogram)
+
+        return histogram
+
+    def counter(self, name: str, help: str, label_names: Sequence[str] = ()) -> Counter:
+        counter = Counter(name, help, label_names)
+        self._register(name, counter)
+
+        return counter
+
+    # Gauges read objects of a running server, registering one again replaces it, so run() can start twice in one
+    # process
+    def gauge(self, name: str, help: str, read: Callable[[], float]) -> Gauge:
+        if isinstance(self._metrics.get(name), Gauge):
+            del self._metrics[name]
+        gauge = Gauge(name, help, read)
+        self._register(name, gauge)
+
+        return gauge
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.collect())
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+LOCK_WAIT_SECONDS = REGISTRY.histogram("lock_wait_seconds", "Time spent waiting for a lock or semaphore", ["lock"])
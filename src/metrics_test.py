@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from metrics import MetricsRegistry
+
+
+def test_histogram_renders_cumulative_buckets() -> None:
+    registry = MetricsRegistry()
+    histogram = registry.histogram("request_seconds", "Request latency", ["route"], buckets=(0.1, 1))
+    histogram.labels("/claim").observe(0.05)
+    histogram.labels("/claim").observe(0.1)
+    histogram.labels("/claim").observe(3)
+
+    assert registry.render() == (
+        "# HELP request_seconds Request latency\n"
+        + "# TYPE request_seconds histogram\n"
+        + 'request_seconds_bucket{route="/claim",le="0.1"} 2\n'
+        + 'request_seconds_bucket{route="/claim",le="1"} 2\n'
+        + 'request_seconds_bucket{route="/claim",le="+Inf"} 3\n'
+        + 'request_seconds_sum{route="/claim"} 3.15\n'
+        + 'request_seconds_count{route="/claim"} 3\n'
+    )
+
+
+def test_counter_and_gauge() -> None:
+    registry = MetricsRegistry()
+    counter = registry.counter("responses_total", "Responses", ["status"])
+    counter.labels("200").inc()
+    counter.labels("200").inc()
+    counter.labels("500").inc()
+    depth = [3]
+    registry.gauge("queue_depth", "Queue depth", lambda: depth[0])
+
+    assert registry.render().splitlines()[2:4] == ['responses_total{status="200"} 2', 'responses_total{status="500"} 1']
+    assert registry.render().splitlines()[-1] == "queue_depth 3"
+
+    with pytest.raises(Exception):
+        registry.counter("responses_total", "Responses")
+
+    # A second run of the server registers its gauges again
+    registry.gauge("queue_depth", "Queue depth", lambda: 5)
+    assert registry.render().splitlines()[-3:] == [
+        "# HELP queue_depth Queue depth",
+        "# TYPE queue_depth gauge",
+        "queue_depth 5",
+    ]
+    with pytest.raises(Exception):
+        registry.gauge("responses_total", "Responses", lambda: 0)
+
+
+def test_timed_methods_are_labelled_by_name() -> None:
+    registry = MetricsRegistry()
+    histogram = registry.histogram("call_seconds", "Call latency", ["method"])
+
+    class Storage:
+        @histogram.timed
+        def get_claim(self) -> str:
+            return "A"
+
+        @histogram.timed_async
+        async def add(self) -> str:
+            return "B"
+
+    storage = Storage()
+
+    assert storage.get_claim() == "A"
+    assert asyncio.run(storage.add()) == "B"
+    assert 'call_seconds_count{method="get_claim"} 1' in registry.render()
+    assert 'call_seconds_count{method="add"} 1' in registry.render()
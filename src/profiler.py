@@ -0,0 +1,44 @@
+import sys
+import threading
+from collections import Counter
+from types import FrameType
+from typing import List, Optional
+
+
+# Samples the stack of the thread that started it every interval seconds from a background thread, the event loop
+# itself does no extra work. render() returns the samples as collapsed stacks, the input of flamegraph tools.
+class SamplingProfiler:
+    def __init__(self, interval: float, max_depth: int = 64) -> None:
+        self._interval = interval
+        self._max_depth = max_depth
+        self._samples: Counter[str] = Counter()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._target_thread_id = 0
+
+    def start(self) -> None:
+        self._target_thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            frame = sys._current_frames().get(self._target_thread_id)
+            if frame is not None:
+                self._samples[self._collapse(frame)] += 1
+
+    def _collapse(self, frame: Optional[FrameType]) -> str:
+        stack: List[str] = []
+        while frame is not None and len(stack) < self._max_depth:
+            stack.append(f"{frame.f_code.co_name} ({frame.f_code.co_filename}:{frame.f_lineno})")
+            frame = frame.f_back
+
+        return ";".join(reversed(stack))
+
+    def render(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self._samples.most_common())
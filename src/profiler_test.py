@@ -0,0 +1,21 @@
+import time
+
+from profiler import SamplingProfiler
+
+
+def busy_loop(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_profiler_samples_the_starting_thread() -> None:
+    profiler = SamplingProfiler(0.001)
+    profiler.start()
+    busy_loop(0.1)
+    profiler.stop()
+
+    stacks = profiler.render().splitlines()
+
+    assert len(stacks) > 0
+    assert any("busy_loop" in stack and "test_profiler_samples_the_starting_thread" in stack for stack in stacks)
@@ -0,0 +1,58 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from metrics import REGISTRY
+
+READINESS_CHECKS_FAILED = REGISTRY.counter("readiness_checks_failed", "Failed readiness checks", ["check"])
+
+ReadinessCheck = Callable[[], Awaitable[object]]
+
+
+class ReadinessResult(NamedTuple):
+    ready: bool
+    checks: Dict[str, str]
+
+
+# Whether the worker can serve requests now: all checks run concurrently, each within timeout, and report "ok" or
+# why they failed. Probes arriving while a check runs share its result. Once draining the worker reports not ready
+# without checking, so the load balancer stops sending it requests.
+class ReadinessProbe:
+    def __init__(self, timeout: float) -> None:
+        self._timeout = timeout
+        self._checks: List[Tuple[str, ReadinessCheck]] = []
+        self._running: Optional[asyncio.Future[ReadinessResult]] = None
+        self.draining = False
+
+    def add(self, name: str, check: ReadinessCheck) -> None:
+        self._checks.append((name, check))
+
+    async def check(self) -> ReadinessResult:
+        if self.draining:
+            return ReadinessResult(False, {"draining": "shutting down"})
+
+        if self._running is None:
+            self._running = asyncio.ensure_future(self._check_all())
+            self._running.add_done_callback(self._done)
+
+        return await asyncio.shield(self._running)
+
+    def _done(self, running: "asyncio.Future[ReadinessResult]") -> None:
+        self._running = None
+
+    async def _check_all(self) -> ReadinessResult:
+        results = await asyncio.gather(*[self._check_one(name, check) for name, check in self._checks])
+        checks = dict(zip([name for name, _ in self._checks], results))
+
+        return ReadinessResult(all(result == "ok" for result in results), checks)
+
+    async def _check_one(self, name: str, check: ReadinessCheck) -> str:
+        try:
+            await asyncio.wait_for(check(), self._timeout)
+        except asyncio.TimeoutError:
+            READINESS_CHECKS_FAILED.labels(name).inc()
+            return f"timed out after {self._timeout} s"
+        except Exception as e:
+            READINESS_CHECKS_FAILED.labels(name).inc()
+            return repr(e)
+
+        return "ok"
@@ -0,0 +1,81 @@
+import asyncio
+from typing import List
+
+from readiness import READINESS_CHECKS_FAILED, ReadinessProbe
+
+
+async def ok() -> None:
+    pass
+
+
+async def failing() -> None:
+    raise Exception("database is locked")
+
+
+async def hanging() -> None:
+    await asyncio.sleep(10)
+
+
+def test_ready_when_all_checks_pass() -> None:
+    probe = ReadinessProbe(1)
+    probe.add("database", ok)
+    probe.add("signer", ok)
+
+    result = asyncio.run(probe.check())
+
+    assert result.ready
+    assert result.checks == {"database": "ok", "signer": "ok"}
+
+
+def test_failed_and_slow_checks_are_reported() -> None:
+    probe = ReadinessProbe(0.05)
+    probe.add("database", failing)
+    probe.add("lnbits", hanging)
+    probe.add("signer", ok)
+    failed = READINESS_CHECKS_FAILED.labels("lnbits").value
+
+    result = asyncio.run(probe.check())
+
+    assert not result.ready
+    assert result.checks == {
+        "database": "Exception('database is locked')",
+        "lnbits": "timed out after 0.05 s",
+        "signer": "ok",
+    }
+    assert READINESS_CHECKS_FAILED.labels("lnbits").value == failed + 1
+
+
+def test_concurrent_probes_share_one_check() -> None:
+    calls: List[int] = []
+
+    async def counted() -> None:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+
+    probe = ReadinessProbe(1)
+    probe.add("lnbits", counted)
+
+    async def run() -> None:
+        results = await asyncio.gather(*[probe.check() for _ in range(5)])
+        assert all(result.ready for result in results)
+        await probe.check()
+
+    asyncio.run(run())
+
+    assert len(calls) == 2
+
+
+def test_draining_is_not_ready_without_checking() -> None:
+    calls: List[int] = []
+
+    async def counted() -> None:
+        calls.append(1)
+
+    probe = ReadinessProbe(1)
+    probe.add("database", counted)
+    probe.draining = True
+
+    result = asyncio.run(probe.check())
+
+    assert not result.ready
+    assert calls == []
@@ -0,0 +1,57 @@
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+
+from claim.async_claim_storage import AsyncClaimStorage, AsyncSqlLiteClaimStorage, SqlLitePragmas
+from claim.postgres_claim_storage import AsyncPostgresClaimStorage
+from claim.sql_database import AsyncpgDatabase
+from settings import (
+    DB_CACHE_SIZE,
+    DB_MMAP_SIZE,
+    DB_PATH,
+    DB_SYNCHRONOUS,
+    DB_URL,
+    LOG_LEVEL,
+    PRIVATE_KEY,
+    PRIVATE_KEY_ALGORITHM,
+    PRIVATE_KEY_ID,
+    SIGN_WORKERS,
+)
+from sign.reissue_donation_keys import reissue_donation_keys
+from sign.sign import SIGN_EXECUTOR_PROCESS, DonationKeySigner, create_sign_executor, load_signing_key
+
+
+# Re-signs the donation keys of all paid claims with PRIVATE_KEY, on a process pool of its own. RETIRED_KEYS are not
+# needed, keys they signed are reissued.
+async def main(args: argparse.Namespace) -> None:
+    sign_executor = create_sign_executor(SIGN_EXECUTOR_PROCESS, args.workers)
+    donation_key_signer = DonationKeySigner(
+        load_signing_key(PRIVATE_KEY_ID, PRIVATE_KEY_ALGORITHM, PRIVATE_KEY), sign_executor
+    )
+    claim_storage: AsyncClaimStorage
+
+    if DB_URL != "":
+        claim_storage = AsyncPostgresClaimStorage(datetime.now, await AsyncpgDatabase.connect(DB_URL, 1, 2))
+    else:
+        claim_storage = AsyncSqlLiteClaimStorage(
+            datetime.now, DB_PATH, readers=1, pragmas=SqlLitePragmas(DB_SYNCHRONOUS, DB_MMAP_SIZE, DB_CACHE_SIZE)
+        )
+
+    try:
+        result = await reissue_donation_keys(claim_storage, donation_key_signer, args.page_size)
+        logging.info(f"Reissue done: {result.checked} donation keys checked, {result.reissued} reissued")
+    finally:
+        if isinstance(claim_storage, AsyncPostgresClaimStorage):
+            await claim_storage.close()
+        elif isinstance(claim_storage, AsyncSqlLiteClaimStorage):
+            claim_storage.close()
+        sign_executor.shutdown()
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(LOG_LEVEL)
+    parser = argparse.ArgumentParser(description="Re-sign the donation keys of paid claims with PRIVATE_KEY")
+    parser.add_argument("--page-size", type=int, default=1000, help="claims read, signed and written at once")
+    parser.add_argument("--workers", type=int, default=SIGN_WORKERS, help="signing processes")
+    asyncio.run(main(parser.parse_args()))
@@ -1,9 +1,11 @@
+import os
 from decimal import Decimal
 from get_env import get_env
 from lnbits import AmountSats, LnBitsApiKey
 
 URL_CLAIM = "/donation/api/key/claim"
 URL_PAYMENT_SUCCESS_CALLBACK = "/donation/api/key/payment-success-callback"
+URL_VERIFY_KEYS = "/donation/api/key/verify"
 
 PRIVATE_KEY = get_env("PRIVATE_KEY")
 DOMAIN = get_env("DOMAIN")
@@ -11,3 +13,71 @@ LN_BITS_API_KEY = LnBitsApiKey(get_env("LN_BITS_API_KEY"))
 LN_BITS_URL = LnBitsApiKey(get_env("LN_BITS_URL"))
 SATS_AMOUNT = AmountSats(Decimal(get_env("SATS_AMOUNT")))
 PORT = int(get_env("PORT"))
+
+PRIVATE_KEY_ID = get_env("PRIVATE_KEY_ID", "1")
+PRIVATE_KEY_ALGORITHM = get_env("PRIVATE_KEY_ALGORITHM", "rsa-sha1")
+RETIRED_KEYS = get_env("RETIRED_KEYS", "")
+SIGN_EXECUTOR = get_env("SIGN_EXECUTOR", "thread")
+SIGN_WORKERS = int(get_env("SIGN_WORKERS", "2"))
+
+WEB_WORKERS = int(get_env("WEB_WORKERS", "1"))
+
+DB_PATH = get_env("DB_PATH", os.path.join(os.path.dirname(__file__), "database.db"))
+DB_URL = get_env("DB_URL", "")
+DB_POOL_SIZE = int(get_env("DB_POOL_SIZE", "10"))
+DB_READERS = int(get_env("DB_READERS", "4"))
+DB_GROUP_COMMIT = get_env("DB_GROUP_COMMIT", "false") == "true"
+DB_SYNCHRONOUS = get_env("DB_SYNCHRONOUS", "FULL")
+DB_MMAP_SIZE = int(get_env("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE = int(get_env("DB_CACHE_SIZE", str(-64 * 1024)))
+STATUS_CACHE_SIZE = int(get_env("STATUS_CACHE_SIZE", "10000"))
+STATUS_CACHE_TTL = float(get_env("STATUS_CACHE_TTL", "60"))
+CLAIM_FILTER_CAPACITY = int(get_env("CLAIM_FILTER_CAPACITY", "100000"))
+CLAIM_FILTER_ERROR_RATE = float(get_env("CLAIM_FILTER_ERROR_RATE", "0.01"))
+LONG_POLL_TIMEOUT = float(get_env("LONG_POLL_TIMEOUT", "30"))
+RATE_LIMIT_RATE = float(get_env("RATE_LIMIT_RATE", "0"))
+RATE_LIMIT_BURST = float(get_env("RATE_LIMIT_BURST", "10"))
+RATE_LIMIT_KEYS = int(get_env("RATE_LIMIT_KEYS", "100000"))
+RATE_LIMIT_CLAIM_PREFIX = int(get_env("RATE_LIMIT_CLAIM_PREFIX", "0"))
+CLIENT_IP_HEADER = get_env("CLIENT_IP_HEADER", "")
+CLAIM_MAX_CONCURRENCY = int(get_env("CLAIM_MAX_CONCURRENCY", "50"))
+CLAIM_MAX_QUEUE = int(get_env("CLAIM_MAX_QUEUE", "200"))
+MAX_BODY_SIZE = int(get_env("MAX_BODY_SIZE", "16384"))
+VERIFY_MAX_BODY_SIZE = int(get_env("VERIFY_MAX_BODY_SIZE", str(1024 * 1024)))
+VERIFY_MAX_KEYS = int(get_env("VERIFY_MAX_KEYS", "1000"))
+VERIFY_CHUNK_SIZE = int(get_env("VERIFY_CHUNK_SIZE", "50"))
+LONG_POLL_RECHECK = float(get_env("LONG_POLL_RECHECK", "2"))
+
+LN_BITS_POOL_SIZE = int(get_env("LN_BITS_POOL_SIZE", "100"))
+LN_BITS_POOL_SIZE_PER_HOST = int(get_env("LN_BITS_POOL_SIZE_PER_HOST", "20"))
+LN_BITS_KEEPALIVE_TIMEOUT = float(get_env("LN_BITS_KEEPALIVE_TIMEOUT", "30"))
+LN_BITS_DNS_CACHE_TTL = int(get_env("LN_BITS_DNS_CACHE_TTL", "300"))
+LN_BITS_TIMEOUT = float(get_env("LN_BITS_TIMEOUT", "10"))
+LN_BITS_RETRIES = int(get_env("LN_BITS_RETRIES", "2"))
+LN_BITS_CACHE_TTL = float(get_env("LN_BITS_CACHE_TTL", "60"))
+LN_BITS_BATCH_WINDOW = float(get_env("LN_BITS_BATCH_WINDOW", "0"))
+LN_BITS_BATCH_LIMIT = int(get_env("LN_BITS_BATCH_LIMIT", "100"))
+LN_BITS_LNURL_URL = get_env("LN_BITS_LNURL_URL", "")
+
+PAY_LINK_POOL_LOW_WATERMARK = int(get_env("PAY_LINK_POOL_LOW_WATERMARK", "0"))
+PAY_LINK_POOL_HIGH_WATERMARK = int(get_env("PAY_LINK_POOL_HIGH_WATERMARK", "0"))
+
+PROFILER_INTERVAL = float(get_env("PROFILER_INTERVAL", "0"))
+SHUTDOWN_TIMEOUT = float(get_env("SHUTDOWN_TIMEOUT", "25"))
+READY_TIMEOUT = float(get_env("READY_TIMEOUT", "2"))
+
+LOG_LEVEL = get_env("LOG_LEVEL", "INFO")
+LOG_BODY_LIMIT = int(get_env("LOG_BODY_LIMIT", "1000"))
+LOG_BODY_SAMPLE_RATE = float(get_env("LOG_BODY_SAMPLE_RATE", "1"))
+
+CALLBACK_WORKERS = int(get_env("CALLBACK_WORKERS", "4"))
+CALLBACK_MAX_ATTEMPTS = int(get_env("CALLBACK_MAX_ATTEMPTS", "5"))
+CALLBACK_RETENTION = float(get_env("CALLBACK_RETENTION", "86400"))
+
+SWEEP_INTERVAL = float(get_env("SWEEP_INTERVAL", "300"))
+SWEEP_MIN_AGE = float(get_env("SWEEP_MIN_AGE", "120"))
+SWEEP_EXPIRE_AFTER = float(get_env("SWEEP_EXPIRE_AFTER", "0"))
+SWEEP_PAGE_SIZE = int(get_env("SWEEP_PAGE_SIZE", "500"))
+SWEEP_PAYMENTS_LIMIT = int(get_env("SWEEP_PAYMENTS_LIMIT", "500"))
+SWEEP_CONCURRENCY = int(get_env("SWEEP_CONCURRENCY", "4"))
+SWEEP_CALLS_PER_SECOND = float(get_env("SWEEP_CALLS_PER_SECOND", "5"))
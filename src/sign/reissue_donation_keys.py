@@ -0,0 +1,43 @@
+import logging
+from typing import NamedTuple
+
+from claim.async_claim_storage import AsyncClaimStorage
+from sign.sign import DonationKeySigner
+
+
+class ReissueResult(NamedTuple):
+    checked: int
+    reissued: int
+
+
+# Re-signs the donation keys of paid claims with the active key, e.g. after a key rotation. Claims are read in pages,
+# keys of the active key id or that verify with the active key are skipped, so a run that was interrupted can just be
+# started again. Each page is signed on all workers of the signer's executor and written in one transaction.
+async def reissue_donation_keys(
+    claim_storage: AsyncClaimStorage, donation_key_signer: DonationKeySigner, page_size: int = 1000
+) -> ReissueResult:
+    checked = 0
+    reissued = 0
+    after = ""
+
+    while True:
+        page = await claim_storage.get_donation_keys(after, page_size)
+        if len(page) == 0:
+            break
+
+        unknown = [
+            (claim, donation_key) for claim, donation_key, key_id in page if key_id != donation_key_signer.key_id
+        ]
+        valid = await donation_key_signer.verify_many_async(unknown, active_only=True)
+        stale = [claim for (claim, _), key_valid in zip(unknown, valid) if not key_valid]
+        if stale:
+            donation_keys = await donation_key_signer.sign_many_async(stale)
+            reissued += await claim_storage.replace_donation_keys(
+                list(zip(stale, donation_keys)), donation_key_signer.key_id
+            )
+
+        checked += len(page)
+        after = page[-1][0]
+        logging.info(f"Reissue: {checked} donation keys checked, {reissued} reissued")
+
+    return ReissueResult(checked, reissued)
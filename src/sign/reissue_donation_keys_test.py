@@ -0,0 +1,57 @@
+import asyncio
+import os
+from datetime import datetime
+
+from claim.async_claim_storage import AsyncSqlLiteClaimStorage
+from claim.claim import DonationTokenClaim
+from claim.donation_key import DonationKey
+from lnbits import LnBitsPaymentLinkId, PaymentHash
+from sign.reissue_donation_keys import ReissueResult, reissue_donation_keys
+from sign.sign import ALGORITHM_RSA_SHA1, ALGORITHM_RSA_SHA256, DonationKeySigner, load_signing_key, verify_message
+
+dirname = os.path.dirname(__file__)
+private_key_path = f"{dirname}/test_privatekey.pem"
+
+
+def create_fresh_storage(db_path: str) -> AsyncSqlLiteClaimStorage:
+    storage = AsyncSqlLiteClaimStorage(datetime.now, db_path, readers=1)
+    storage.create_tables()
+
+    return storage
+
+
+def test_reissue_donation_keys(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    retired_key = load_signing_key("1", ALGORITHM_RSA_SHA1, private_key_path)
+    signer = DonationKeySigner(load_signing_key("2", ALGORITHM_RSA_SHA256, private_key_path), None, [retired_key])
+    claims = [DonationTokenClaim(f"claim {i}") for i in range(5)]
+
+    async def run() -> None:
+        for i, claim in enumerate(claims):
+            await storage.add(claim, LnBitsPaymentLinkId(i))
+        # Not a key, signed by the active key before key ids were stored, signed by the retired key, trusted by its
+        # key id without verifying, and unpaid
+        await storage.save_success(claims[0], PaymentHash("hash 0"), DonationKey("b2xkIGtleQ=="))
+        await storage.save_success(claims[1], PaymentHash("hash 1"), signer.sign(claims[1]))
+        await storage.save_success(
+            claims[2], PaymentHash("hash 2"), DonationKeySigner(retired_key).sign(claims[2]), "1"
+        )
+        await storage.save_success(claims[3], PaymentHash("hash 3"), DonationKey("b2xkIGtleQ=="), "2")
+
+        assert await reissue_donation_keys(storage, signer, page_size=2) == ReissueResult(checked=4, reissued=2)
+        donation_keys = await storage.get_donation_keys("", 10)
+        assert [(claim, key_id) for claim, _, key_id in donation_keys] == [
+            (claims[0], "2"),
+            (claims[1], None),
+            (claims[2], "2"),
+            (claims[3], "2"),
+        ]
+        assert all(verify_message([signer.active_key], claim, key) for claim, key, _ in donation_keys[:3])
+
+        # Nothing left to do on a second run
+        assert await reissue_donation_keys(storage, signer, page_size=2) == ReissueResult(checked=4, reissued=0)
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
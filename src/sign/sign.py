@@ -1,17 +1,263 @@
+import asyncio
 import base64
-from typing import cast
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Sequence, Tuple, TypeVar
 import rsa
 
 from claim.donation_key import DonationKey
+from metrics import REGISTRY
 
+# cryptography is optional, it signs through OpenSSL several times faster than the pure Python rsa package. Both give
+# the same PKCS#1 v1.5 signatures, Ed25519 keys need it.
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, padding
+    from cryptography.hazmat.primitives.asymmetric import rsa as openssl_rsa
 
+    OPENSSL_AVAILABLE = True
+except ImportError:
+    OPENSSL_AVAILABLE = False
+
+T = TypeVar("T")
+
+ALGORITHM_RSA_SHA1 = "rsa-sha1"
+ALGORITHM_RSA_SHA256 = "rsa-sha256"
+ALGORITHM_ED25519 = "ed25519"
+RSA_HASH_METHODS = {ALGORITHM_RSA_SHA1: "SHA-1", ALGORITHM_RSA_SHA256: "SHA-256"}
+BACKEND_RSA = "rsa"
+BACKEND_OPENSSL = "openssl"
+SIGN_EXECUTOR_THREAD = "thread"
+SIGN_EXECUTOR_PROCESS = "process"
+
+# sign_async includes the wait for a free executor worker
+SIGN_SECONDS = REGISTRY.histogram("donation_key_sign_seconds", "Donation key signing time", ["method"])
+
+
+# A private key as read from its PEM file. Cheap to pass to process pool workers, which each load it once.
+class SigningKey(NamedTuple):
+    key_id: str
+    algorithm: str
+    pem: bytes
+
+
+class KeyBackend(metaclass=ABCMeta):
+    @abstractmethod
+    def sign(self, data: bytes) -> bytes:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def verify(self, data: bytes, signature: bytes) -> bool:
+        raise NotImplementedError()
+
+
+class PureRsaBackend(KeyBackend):
+    def __init__(self, pem: bytes, hash_method: str) -> None:
+        self._private_key = rsa.PrivateKey.load_pkcs1(pem)
+        self._public_key = rsa.PublicKey(self._private_key.n, self._private_key.e)
+        self._hash_method = hash_method
+
+    def sign(self, data: bytes) -> bytes:
+        return rsa.sign(data, self._private_key, self._hash_method)
+
+    def verify(self, data: bytes, signature: bytes) -> bool:
+        try:
+            # rsa.verify accepts whatever hash the signature names, only the key's own one is valid here
+            return rsa.verify(data, signature, self._public_key) == self._hash_method
+        except rsa.VerificationError:
+            return False
+
+
+class OpenSslRsaBackend(KeyBackend):
+    def __init__(self, pem: bytes, hash_method: str) -> None:
+        private_key = serialization.load_pem_private_key(pem, password=None)
+        if not isinstance(private_key, openssl_rsa.RSAPrivateKey):
+            raise ValueError("Not an RSA private key")
+
+        self._private_key = private_key
+        self._public_key = private_key.public_key()
+        self._hash: hashes.HashAlgorithm = hashes.SHA1() if hash_method == "SHA-1" else hashes.SHA256()
+
+    def sign(self, data: bytes) -> bytes:
+        return self._private_key.sign(data, padding.PKCS1v15(), self._hash)
+
+    def verify(self, data: bytes, signature: bytes) -> bool:
+        try:
+            self._public_key.verify(signature, data, padding.PKCS1v15(), self._hash)
+        except InvalidSignature:
+            return False
+
+        return True
+
+
+class OpenSslEd25519Backend(KeyBackend):
+    def __init__(self, pem: bytes) -> None:
+        private_key = serialization.load_pem_private_key(pem, password=None)
+        if not isinstance(private_key, ed25519.Ed25519PrivateKey):
+            raise ValueError("Not an Ed25519 private key")
+
+        self._private_key = private_key
+        self._public_key = private_key.public_key()
+
+    def sign(self, data: bytes) -> bytes:
+        return self._private_key.sign(data)
+
+    def verify(self, data: bytes, signature: bytes) -> bool:
+        try:
+            self._public_key.verify(signature, data)
+        except InvalidSignature:
+            return False
+
+        return True
+
+
+# OpenSSL when cryptography is installed, unless a backend is asked for
+def create_key_backend(algorithm: str, pem: bytes, backend: Optional[str] = None) -> KeyBackend:
+    backend = backend or (BACKEND_OPENSSL if OPENSSL_AVAILABLE else BACKEND_RSA)
+    if backend == BACKEND_OPENSSL and not OPENSSL_AVAILABLE:
+        raise Exception(f"Signing backend '{BACKEND_OPENSSL}' needs the cryptography package")
+
+    if algorithm in RSA_HASH_METHODS:
+        if backend == BACKEND_OPENSSL:
+            return OpenSslRsaBackend(pem, RSA_HASH_METHODS[algorithm])
+        return PureRsaBackend(pem, RSA_HASH_METHODS[algorithm])
+
+    if algorithm == ALGORITHM_ED25519:
+        if backend != BACKEND_OPENSSL:
+            raise Exception(f"Signing algorithm '{ALGORITHM_ED25519}' needs the cryptography package")
+        return OpenSslEd25519Backend(pem)
+
+    raise Exception(
+        f"Unknown signing algorithm '{algorithm}', expected "
+        + f"'{ALGORITHM_RSA_SHA1}', '{ALGORITHM_RSA_SHA256}' or '{ALGORITHM_ED25519}'"
+    )
+
+
+# Parsed once per process, executor calls only pass the SigningKey
+@lru_cache(maxsize=None)
+def key_backend(key: SigningKey) -> KeyBackend:
+    return create_key_backend(key.algorithm, key.pem)
+
+
+def load_signing_key(key_id: str, algorithm: str, priv_key_path: str) -> SigningKey:
+    with open(priv_key_path, "rb") as p:
+        key = SigningKey(key_id, algorithm, p.read())
+
+    # Sign/verify round-trip, so a broken key fails at startup instead of on the first payment
+    backend = key_backend(key)
+    probe = b"donation-key-server"
+    if not backend.verify(probe, backend.sign(probe)):
+        raise Exception(f"Private key {priv_key_path} is not valid")
+
+    return key
+
+
+# "key id:algorithm:path" entries separated by commas
+def load_signing_keys(keys: str) -> List[SigningKey]:
+    signing_keys = []
+    for entry in keys.split(","):
+        if entry.strip() == "":
+            continue
+
+        parts = entry.strip().split(":", 2)
+        if len(parts) != 3:
+            raise Exception(f"Signing key '{entry}' is not 'key id:algorithm:path'")
+        signing_keys.append(load_signing_key(*parts))
+
+    return signing_keys
+
+
+def sign_message(key: SigningKey, message: str) -> DonationKey:
+    signature = key_backend(key).sign(message.encode("utf-8"))
+
+    return DonationKey(base64.b64encode(signature).decode("utf-8"))
+
+
+# True when any of the keys signed the message
+def verify_message(keys: Sequence[SigningKey], message: str, donation_key: str) -> bool:
+    try:
+        signature = base64.b64decode(donation_key, validate=True)
+    except ValueError:
+        return False
+
+    data = message.encode("utf-8")
+
+    return any(key_backend(key).verify(data, signature) for key in keys)
+
+
+# Many messages per executor call, so a process pool pickles the key once per chunk instead of once per message
+def sign_messages(key: SigningKey, messages: Sequence[str]) -> List[DonationKey]:
+    return [sign_message(key, message) for message in messages]
+
+
+def verify_messages(keys: Sequence[SigningKey], pairs: Sequence[Tuple[str, str]]) -> List[bool]:
+    return [verify_message(keys, message, donation_key) for message, donation_key in pairs]
+
+
+def chunks(items: Sequence[T], size: int) -> List[Sequence[T]]:
+    return [items[i : i + size] for i in range(0, len(items), size)]
+
+
+def create_sign_executor(kind: str, workers: int) -> Executor:
+    if kind == SIGN_EXECUTOR_THREAD:
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sign")
+
+    if kind == SIGN_EXECUTOR_PROCESS:
+        return ProcessPoolExecutor(max_workers=workers)
+
+    raise Exception(f"Unknown sign executor '{kind}', expected '{SIGN_EXECUTOR_THREAD}' or '{SIGN_EXECUTOR_PROCESS}'")
+
+
+# Signs with the active key and verifies against it and the retired keys, so keys issued before a rotation stay
+# valid until they are reissued
 class DonationKeySigner:
-    def __init__(self, priv_key_path: str) -> None:
-        self._priv_key_path = priv_key_path
+    def __init__(
+        self, active_key: SigningKey, executor: Optional[Executor] = None, retired_keys: Sequence[SigningKey] = ()
+    ) -> None:
+        key_ids = [key.key_id for key in [active_key, *retired_keys]]
+        if len(set(key_ids)) != len(key_ids):
+            raise Exception(f"Signing key ids are not unique: {', '.join(key_ids)}")
+
+        self.active_key = active_key
+        self.keys = [active_key, *retired_keys]
+        self._executor = executor
 
+    @property
+    def key_id(self) -> str:
+        return self.active_key.key_id
+
+    @SIGN_SECONDS.timed
     def sign(self, message: str) -> DonationKey:
-        with open(self._priv_key_path, "rb") as p:
-            privateKey = rsa.PrivateKey.load_pkcs1(p.read())
-            signature = rsa.sign(message.encode("utf-8"), cast(rsa.PrivateKey, privateKey), "SHA-1")
+        return sign_message(self.active_key, message)
+
+    @SIGN_SECONDS.timed_async
+    async def sign_async(self, message: str) -> DonationKey:
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(self._executor, sign_message, self.active_key, message)
+
+    # Chunks are spread over the executor's workers, results are in the order of messages
+    async def sign_many_async(self, messages: Sequence[str], chunk_size: int = 50) -> List[DonationKey]:
+        loop = asyncio.get_running_loop()
+        signed = await asyncio.gather(
+            *[
+                loop.run_in_executor(self._executor, sign_messages, self.active_key, chunk)
+                for chunk in chunks(messages, chunk_size)
+            ]
+        )
+
+        return [donation_key for chunk in signed for donation_key in chunk]
+
+    # Pairs of message and donation key, True for those signed by one of the keys, or the active key only
+    async def verify_many_async(
+        self, pairs: Sequence[Tuple[str, str]], chunk_size: int = 100, active_only: bool = False
+    ) -> List[bool]:
+        loop = asyncio.get_running_loop()
+        keys = [self.active_key] if active_only else self.keys
+        verified = await asyncio.gather(
+            *[loop.run_in_executor(self._executor, verify_messages, keys, chunk) for chunk in chunks(pairs, chunk_size)]
+        )
 
-            return DonationKey(base64.b64encode(signature).decode("utf-8"))
+        return [valid for chunk in verified for valid in chunk]
@@ -1,19 +1,161 @@
+import asyncio
 import os
+import pytest
 
-from sign.sign import DonationKeySigner
-
+from pathlib import Path
+from typing import List
+from sign.sign import (
+    ALGORITHM_ED25519,
+    ALGORITHM_RSA_SHA1,
+    ALGORITHM_RSA_SHA256,
+    BACKEND_OPENSSL,
+    BACKEND_RSA,
+    OPENSSL_AVAILABLE,
+    DonationKeySigner,
+    create_key_backend,
+    create_sign_executor,
+    load_signing_key,
+    load_signing_keys,
+    verify_message,
+)
 
 dirname = os.path.dirname(__file__)
+private_key_path = f"{dirname}/test_privatekey.pem"
+message = "Bitcoin: A Peer-to-Peer Electronic Cash System"
+expected_signature = (
+    "ZJEwqajrMMajJPjQAfV2T5uMELwo9QhNz3W5IpL3hco+VzO6Wk7bGkP+NqCKB3mB1hmy"
+    + "JuiTAAMuz+Q5C6gfdyLYltYFpO0htOG0Hy5j8gXeHcw/sE9kabe0WfqGADozp6TlJOni"
+    + "zQ5Gr+ycfE5Muzkj4ryx0Lg6BnDrzf/sfKxCqAU9ezk/JKNNpuPjVgsuCImvQKZrGXCi"
+    + "8lt+U/45q3l7PlHJ3YDeo+9Uxlf7AVtfeLAgK4bAYz/VLnQ1CzPswNumkU4XjDXrahhF"
+    + "Sojs0P1R16mSwFixpsKA+jbxglZunDX0AO+x8j/rbb5hYf4nZI7bakcFOc9WicizYEa2iQ=="
+)
+
+backends = [BACKEND_RSA] + ([BACKEND_OPENSSL] if OPENSSL_AVAILABLE else [])
+
+
+def create_signer(key_id: str = "1", algorithm: str = ALGORITHM_RSA_SHA1) -> DonationKeySigner:
+    return DonationKeySigner(load_signing_key(key_id, algorithm, private_key_path))
 
 
 def test_sign() -> None:
-    private_key_path = f"{dirname}/test_privatekey.pem"
-    signature = DonationKeySigner(private_key_path).sign("Bitcoin: A Peer-to-Peer Electronic Cash System")
-
-    assert signature == (
-        "ZJEwqajrMMajJPjQAfV2T5uMELwo9QhNz3W5IpL3hco+VzO6Wk7bGkP+NqCKB3mB1hmy"
-        + "JuiTAAMuz+Q5C6gfdyLYltYFpO0htOG0Hy5j8gXeHcw/sE9kabe0WfqGADozp6TlJOni"
-        + "zQ5Gr+ycfE5Muzkj4ryx0Lg6BnDrzf/sfKxCqAU9ezk/JKNNpuPjVgsuCImvQKZrGXCi"
-        + "8lt+U/45q3l7PlHJ3YDeo+9Uxlf7AVtfeLAgK4bAYz/VLnQ1CzPswNumkU4XjDXrahhF"
-        + "Sojs0P1R16mSwFixpsKA+jbxglZunDX0AO+x8j/rbb5hYf4nZI7bakcFOc9WicizYEa2iQ=="
+    signature = create_signer().sign(message)
+
+    assert signature == expected_signature
+
+
+@pytest.mark.parametrize("backend", backends)
+def test_backends_sign_the_same(backend: str) -> None:
+    with open(private_key_path, "rb") as p:
+        pem = p.read()
+
+    for algorithm in [ALGORITHM_RSA_SHA1, ALGORITHM_RSA_SHA256]:
+        key_backend = create_key_backend(algorithm, pem, backend)
+        signature = key_backend.sign(message.encode("utf-8"))
+
+        assert signature == create_key_backend(algorithm, pem, BACKEND_RSA).sign(message.encode("utf-8"))
+        assert key_backend.verify(message.encode("utf-8"), signature)
+
+
+@pytest.mark.parametrize("kind", ["thread", "process"])
+def test_sign_async(kind: str) -> None:
+    executor = create_sign_executor(kind, 2)
+    signer = DonationKeySigner(load_signing_key("1", ALGORITHM_RSA_SHA1, private_key_path), executor)
+
+    async def sign_many() -> List[str]:
+        return await asyncio.gather(*[signer.sign_async(message) for _ in range(4)])
+
+    try:
+        assert asyncio.run(sign_many()) == [expected_signature] * 4
+    finally:
+        executor.shutdown()
+
+
+def test_invalid_private_key() -> None:
+    with pytest.raises(ValueError):
+        load_signing_key("1", ALGORITHM_RSA_SHA1, f"{dirname}/test_publickey.pem")
+
+
+def test_unknown_algorithm() -> None:
+    with pytest.raises(Exception, match="Unknown signing algorithm"):
+        load_signing_key("1", "dsa", private_key_path)
+
+
+@pytest.mark.parametrize("kind", ["thread", "process"])
+def test_sign_and_verify_many(kind: str) -> None:
+    executor = create_sign_executor(kind, 2)
+    signer = DonationKeySigner(load_signing_key("1", ALGORITHM_RSA_SHA1, private_key_path), executor)
+    messages = [f"{message} {i}" for i in range(5)]
+
+    async def sign_and_verify() -> List[bool]:
+        donation_keys = await signer.sign_many_async(messages, chunk_size=2)
+        assert donation_keys == [signer.sign(m) for m in messages]
+
+        return await signer.verify_many_async(list(zip(messages, donation_keys)), chunk_size=2)
+
+    try:
+        assert asyncio.run(sign_and_verify()) == [True] * 5
+    finally:
+        executor.shutdown()
+
+
+def test_verify_message() -> None:
+    keys = create_signer().keys
+
+    assert verify_message(keys, message, expected_signature)
+    assert not verify_message(keys, message + ".", expected_signature)
+    assert not verify_message(keys, message, expected_signature[4:])
+    assert not verify_message(keys, message, "not base64 !")
+    assert not verify_message(keys, message, "")
+
+
+# The same RSA key with another hash stands in for a new key
+def test_retired_keys_keep_verifying() -> None:
+    retired_key = load_signing_key("1", ALGORITHM_RSA_SHA1, private_key_path)
+    signer = DonationKeySigner(load_signing_key("2", ALGORITHM_RSA_SHA256, private_key_path), None, [retired_key])
+    pairs = [(message, expected_signature), (message, signer.sign(message))]
+
+    assert signer.key_id == "2"
+    assert signer.sign(message) != expected_signature
+    assert not verify_message([signer.active_key], message, expected_signature)
+    assert asyncio.run(signer.verify_many_async(pairs)) == [True, True]
+    assert asyncio.run(signer.verify_many_async(pairs, active_only=True)) == [False, True]
+
+
+def test_signing_key_ids_are_unique() -> None:
+    with pytest.raises(Exception, match="not unique"):
+        DonationKeySigner(
+            load_signing_key("1", ALGORITHM_RSA_SHA1, private_key_path),
+            None,
+            load_signing_keys(f"1:{ALGORITHM_RSA_SHA256}:{private_key_path}"),
+        )
+
+
+def test_load_signing_keys() -> None:
+    keys = load_signing_keys(
+        f" 1:{ALGORITHM_RSA_SHA1}:{private_key_path}, 2:{ALGORITHM_RSA_SHA256}:{private_key_path},"
     )
+
+    assert [(key.key_id, key.algorithm) for key in keys] == [("1", ALGORITHM_RSA_SHA1), ("2", ALGORITHM_RSA_SHA256)]
+    assert load_signing_keys("") == []
+    with pytest.raises(Exception, match="is not 'key id:algorithm:path'"):
+        load_signing_keys(private_key_path)
+
+
+@pytest.mark.skipif(not OPENSSL_AVAILABLE, reason="needs cryptography")
+def test_ed25519(tmp_path: Path) -> None:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+
+    key_path = tmp_path / "ed25519.pem"
+    key_path.write_bytes(
+        ed25519.Ed25519PrivateKey.generate().private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+        )
+    )
+    signer = DonationKeySigner(load_signing_key("3", ALGORITHM_ED25519, str(key_path)))
+    signature = signer.sign(message)
+
+    assert verify_message(signer.keys, message, signature)
+    assert not verify_message(signer.keys, message, expected_signature)
+    with pytest.raises(Exception, match="needs the cryptography package"):
+        create_key_backend(ALGORITHM_ED25519, key_path.read_bytes(), BACKEND_RSA)
@@ -1 +1,205 @@
-# Todo
+import asyncio
+import os
+from datetime import datetime
+from decimal import Decimal
+from typing import Awaitable, Callable, List
+
+import aiohttp
+
+from claim.async_claim_storage import AsyncSqlLiteClaimStorage
+from claim.claim import DonationTokenClaim
+from claim.claim_events import ClaimEvents
+from claim.donation_key import DonationKey
+from lnbits import (
+    AmountSats,
+    LnBitsApi,
+    LnBitsApiKey,
+    LnBitsCallbackData,
+    LnBitsPayment,
+    LnBitsPaymentDetails,
+    LnBitsPaymentDetailsExtra,
+    LnBitsPaymentLinkId,
+    PaymentHash,
+)
+from sign.sign import ALGORITHM_RSA_SHA256, DonationKeySigner, load_signing_key, verify_message
+from success_callback.callback_handler import CallbackHandler
+
+dirname = os.path.dirname(__file__)
+private_key_path = f"{dirname}/../sign/test_privatekey.pem"
+
+SATS = AmountSats(Decimal(1000))
+claim_A = DonationTokenClaim("A")
+claim_B = DonationTokenClaim("B")
+link_1 = LnBitsPaymentLinkId(1)
+link_2 = LnBitsPaymentLinkId(2)
+
+
+def create_fresh_storage(db_path: str) -> AsyncSqlLiteClaimStorage:
+    storage = AsyncSqlLiteClaimStorage(lambda: datetime.fromtimestamp(0), db_path, readers=1)
+    storage.create_tables()
+
+    return storage
+
+
+def callback_data(payment_hash: str, link: LnBitsPaymentLinkId, amount: int = 1000) -> LnBitsCallbackData:
+    return LnBitsCallbackData(
+        payment_hash=PaymentHash(payment_hash),
+        payment_request="lnbc",
+        amount=AmountSats(Decimal(amount)),
+        comment=None,
+        lnurlp=link,
+    )
+
+
+# Payments are paid to link 1 with 1000000 msats unless set otherwise
+class FakeLnBitsApi(LnBitsApi):
+    def __init__(self) -> None:
+        super().__init__(aiohttp.ClientSession(), "", LnBitsApiKey(""))
+        self.paid = True
+        self.link = link_1
+        self.looked_up: List[PaymentHash] = []
+
+    async def get_payment(self, payment_hash: PaymentHash) -> LnBitsPayment:
+        self.looked_up.append(payment_hash)
+
+        return LnBitsPayment(
+            paid=self.paid,
+            preimage="0" * 64,
+            details=LnBitsPaymentDetails(
+                checking_id=payment_hash,
+                pending=not self.paid,
+                amount=1000000,
+                fee=0,
+                memo="",
+                time=0,
+                bolt11="lnbc",
+                preimage="0" * 64,
+                payment_hash=payment_hash,
+                extra=LnBitsPaymentDetailsExtra(tag="lnurlp", link=self.link, comment=None, extra=""),
+                wallet_id="wallet",
+            ),
+        )
+
+
+def run_with_handler(
+    db_path: str,
+    test: Callable[[AsyncSqlLiteClaimStorage, FakeLnBitsApi, CallbackHandler, ClaimEvents], Awaitable[None]],
+) -> None:
+    storage = create_fresh_storage(db_path)
+    signer = DonationKeySigner(load_signing_key("1", ALGORITHM_RSA_SHA256, private_key_path))
+
+    async def run() -> None:
+        ln_bits_api = FakeLnBitsApi()
+        claim_events = ClaimEvents()
+        await storage.add(claim_A, link_1)
+        try:
+            await test(storage, ln_bits_api, CallbackHandler(storage, ln_bits_api, signer, claim_events), claim_events)
+        finally:
+            await ln_bits_api._session.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+
+async def last_status(storage: AsyncSqlLiteClaimStorage, claim: DonationTokenClaim) -> str:
+    status = await storage.get_claim_status(claim)
+    assert status is not None
+
+    return status[1][-1].split("] ", 1)[1]
+
+
+def test_paid_callback_saves_and_publishes_the_donation_key(db_path: str) -> None:
+    async def test(
+        storage: AsyncSqlLiteClaimStorage, ln_bits_api: FakeLnBitsApi, handler: CallbackHandler, events: ClaimEvents
+    ) -> None:
+        with events.subscribe(claim_A) as issued_key:
+            await handler.handle(callback_data("AAA", link_1), SATS)
+
+            assert issued_key.done()
+            status = await storage.get_claim_status(claim_A)
+            assert status is not None and status[0] == issued_key.result()
+            assert verify_message(
+                [load_signing_key("1", ALGORITHM_RSA_SHA256, private_key_path)], claim_A, issued_key.result()
+            )
+        assert await last_status(storage, claim_A) == "Sucessfully claimed."
+        assert await storage.is_payment_hashed_used(PaymentHash("AAA"))
+
+    run_with_handler(db_path, test)
+
+
+def test_callback_below_the_amount_is_rejected_without_ln_bits(db_path: str) -> None:
+    async def test(
+        storage: AsyncSqlLiteClaimStorage, ln_bits_api: FakeLnBitsApi, handler: CallbackHandler, events: ClaimEvents
+    ) -> None:
+        await handler.handle(callback_data("AAA", link_1, amount=999), SATS)
+
+        assert await last_status(storage, claim_A) == "Amount send $999 is less then $1000"
+        assert ln_bits_api.looked_up == []
+
+    run_with_handler(db_path, test)
+
+
+def test_callback_is_checked_against_the_payment_in_ln_bits(db_path: str) -> None:
+    async def test(
+        storage: AsyncSqlLiteClaimStorage, ln_bits_api: FakeLnBitsApi, handler: CallbackHandler, events: ClaimEvents
+    ) -> None:
+        ln_bits_api.paid = False
+        await handler.handle(callback_data("AAA", link_1), SATS)
+        assert await last_status(storage, claim_A) == "Callback received, but payment not paid."
+
+        ln_bits_api.paid = True
+        ln_bits_api.link = link_2
+        await handler.handle(callback_data("AAA", link_1), SATS)
+        assert await last_status(storage, claim_A) == "PaymentLinkId (2) is not as expected (1)"
+
+        status = await storage.get_claim_status(claim_A)
+        assert status is not None and status[0] is None
+
+    run_with_handler(db_path, test)
+
+
+def test_payment_hash_of_another_claim_is_not_used(db_path: str) -> None:
+    async def test(
+        storage: AsyncSqlLiteClaimStorage, ln_bits_api: FakeLnBitsApi, handler: CallbackHandler, events: ClaimEvents
+    ) -> None:
+        await storage.add(claim_B, link_2)
+        await handler.handle(callback_data("AAA", link_1), SATS)
+
+        ln_bits_api.link = link_2
+        await handler.handle(callback_data("AAA", link_2), SATS)
+
+        assert await last_status(storage, claim_B) == "Payment-Hash is already used for different claim."
+
+    run_with_handler(db_path, test)
+
+
+def test_second_payment_of_a_paid_claim_is_not_published(db_path: str) -> None:
+    async def test(
+        storage: AsyncSqlLiteClaimStorage, ln_bits_api: FakeLnBitsApi, handler: CallbackHandler, events: ClaimEvents
+    ) -> None:
+        await storage.save_success(claim_A, PaymentHash("AAA"), DonationKey("A/XY12=="))
+
+        with events.subscribe(claim_A) as issued_key:
+            await handler.handle(callback_data("BBB", link_1), SATS)
+
+            assert not issued_key.done()
+        status = await storage.get_claim_status(claim_A)
+        assert status is not None and status[0] == "A/XY12=="
+        assert await last_status(storage, claim_A) == "Sucessfully claimed."
+        assert not await storage.is_payment_hashed_used(PaymentHash("BBB"))
+
+    run_with_handler(db_path, test)
+
+
+def test_callback_of_unknown_pay_link_is_ignored(db_path: str) -> None:
+    async def test(
+        storage: AsyncSqlLiteClaimStorage, ln_bits_api: FakeLnBitsApi, handler: CallbackHandler, events: ClaimEvents
+    ) -> None:
+        await handler.handle(callback_data("AAA", LnBitsPaymentLinkId(99)), SATS)
+
+        assert ln_bits_api.looked_up == []
+        assert await last_status(storage, claim_A) == "Claim created, waiting for payment..."
+
+    run_with_handler(db_path, test)
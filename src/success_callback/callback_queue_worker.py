@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Optional
+
+from claim.async_claim_storage import AsyncClaimStorage
+from claim.claim_storage import CALLBACK_DONE, CALLBACK_FAILED
+from lnbits import LnBitsCallbackData
+
+
+# Drains webhooks persisted by the callback route. Delivery is at-least-once: a webhook is only marked done after
+# handle returned, and webhooks left in flight by a crash are picked up again on start. Webhooks retried by LNbits
+# for the same pay link can't issue a second donation key, save_success only stores the first payment of a claim.
+# Done webhooks are kept for retention seconds so LNbits retries are not queued again, then pruned while idle.
+class CallbackQueueWorker:
+    def __init__(
+        self,
+        claim_storage: AsyncClaimStorage,
+        handle: Callable[[LnBitsCallbackData], Awaitable[None]],
+        workers: int,
+        max_attempts: int = 5,
+        retry_backoff: float = 1,
+        poll_interval: float = 5,
+        retention: float = 24 * 60 * 60,
+    ) -> None:
+        self._claim_storage = claim_storage
+        self._handle = handle
+        self._workers = workers
+        self._max_attempts = max_attempts
+        self._retry_backoff = retry_backoff
+        self._poll_interval = poll_interval
+        self._retention = retention
+        self._pruned_at = 0.0
+        self._counted_at = 0.0
+        self._wake_up = asyncio.Event()
+        self._tasks: List[asyncio.Task[None]] = []
+        self._closing = False
+        self.in_flight = 0
+        self.pending = 0
+
+    # With workers sharing the storage recover once before any of them starts, a worker recovering while the others
+    # run would take back webhooks they are still processing. A webhook is taken at most max_attempts times, one that
+    # keeps crashing the server fails instead of being retried on every start.
+    async def start(self, recover: bool = True) -> None:
+        if recover:
+            recovered, failed = await self._claim_storage.recover_callbacks(self._max_attempts)
+            if recovered > 0:
+                logging.warning(f"CallbackQueueWorker: recovered {recovered} in-flight callbacks")
+            if failed > 0:
+                logging.error(f"CallbackQueueWorker: {failed} callbacks taken {self._max_attempts} times failed")
+
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._run()) for _ in range(self._workers)]
+
+    # Workers stop taking webhooks and get up to drain_timeout seconds to finish the ones they are processing, then
+    # they are cancelled. Webhooks not taken stay queued and cancelled ones in flight, the next start picks up both.
+    async def close(self, drain_timeout: float = 0) -> None:
+        self._closing = True
+        self._wake_up.set()
+        if drain_timeout > 0 and self._tasks:
+            await asyncio.wait(self._tasks, timeout=drain_timeout)
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    # Returns False when a webhook with the same payment hash was already queued
+    async def enqueue(self, callback_data: LnBitsCallbackData, body: Optional[str] = None) -> bool:
+        enqueued = await self._claim_storage.enqueue_callback(
+            callback_data.payment_hash, body if body is not None else callback_data.model_dump_json()
+        )
+        if enqueued:
+            self._wake_up.set()
+
+        return enqueued
+
+    # A failing storage doesn't stop the worker, it backs off and tries again. A webhook that couldn't be finished
+    # stays in flight until the next start recovers it.
+    async def _run(self) -> None:
+        while not self._closing:
+            try:
+                await self._take_next()
+            except Exception:
+                logging.exception("CallbackQueueWorker: callback queue failed")
+                await asyncio.sleep(self._retry_backoff)
+
+    async def _take_next(self) -> None:
+        # Cleared before looking, so a webhook queued while the queue reads empty still wakes this worker
+        self._wake_up.clear()
+        taken = await self._claim_storage.take_callback(self._max_attempts)
+        await self._count_pending(taken is None)
+
+        if taken is None:
+            await self._prune()
+            try:
+                await asyncio.wait_for(self._wake_up.wait(), self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        payment_hash, body = taken
+        self.in_flight += 1
+        try:
+            state = await self._process(body)
+        finally:
+            self.in_flight -= 1
+        await self._claim_storage.finish_callback(payment_hash, state)
+
+    # Webhooks waiting to be taken, for the callback_queue_pending gauge. Counted at most once a second, none are
+    # waiting when the queue read empty.
+    async def _count_pending(self, empty: bool) -> None:
+        if empty:
+            self.pending = 0
+        elif time.monotonic() - self._counted_at >= 1:
+            self._counted_at = time.monotonic()
+            self.pending = await self._claim_storage.count_pending_callbacks()
+
+    # At most once per hour of the retention
+    async def _prune(self) -> None:
+        if time.monotonic() - self._pruned_at < min(self._retention, 60 * 60):
+            return
+
+        self._pruned_at = time.monotonic()
+        pruned = await self._claim_storage.prune_callbacks(time.time() - self._retention)
+        if pruned > 0:
+            logging.info(f"CallbackQueueWorker: pruned {pruned} done callbacks")
+
+    async def _process(self, body: str) -> str:
+        error: Optional[Exception] = None
+
+        for attempt in range(self._max_attempts):
+            try:
+                await self._handle(LnBitsCallbackData.model_validate_json(body))
+
+                return CALLBACK_DONE
+            except Exception as e:
+                error = e
+                logging.warning(f"CallbackQueueWorker: attempt {attempt + 1} failed: {e!r}")
+                if attempt + 1 < self._max_attempts:
+                    await asyncio.sleep(self._retry_backoff * 2**attempt)
+
+        logging.error(f"CallbackQueueWorker: giving up on callback {body}: {error!r}")
+
+        return CALLBACK_FAILED
@@ -0,0 +1,321 @@
+import asyncio
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+from claim.async_claim_storage import AsyncSqlLiteClaimStorage
+from lnbits import AmountSats, LnBitsCallbackData, LnBitsPaymentLinkId, PaymentHash
+from success_callback.callback_queue_worker import CallbackQueueWorker
+
+MAX_ATTEMPTS = 5
+
+
+def create_fresh_storage(db_path: str) -> AsyncSqlLiteClaimStorage:
+    storage = AsyncSqlLiteClaimStorage(datetime.now, db_path, readers=1)
+    storage.create_tables()
+
+    return storage
+
+
+def callback_data(payment_hash: str) -> LnBitsCallbackData:
+    return LnBitsCallbackData(
+        payment_hash=PaymentHash(payment_hash),
+        payment_request="lnbc",
+        amount=AmountSats(Decimal(1000)),
+        comment=None,
+        lnurlp=LnBitsPaymentLinkId(1),
+    )
+
+
+def callback_body(payment_hash: str) -> str:
+    return callback_data(payment_hash).model_dump_json()
+
+
+# Fails the first takes, like a database that is locked for a moment
+class FlakyStorage(AsyncSqlLiteClaimStorage):
+    failures = 2
+
+    async def take_callback(self, max_attempts: int) -> Optional[Tuple[PaymentHash, str]]:
+        if self.failures > 0:
+            self.failures -= 1
+            raise Exception("database is locked")
+
+        return await super().take_callback(max_attempts)
+
+
+async def wait_until_handled(handled: List[str], count: int) -> None:
+    while len(handled) < count:
+        await asyncio.sleep(0.01)
+
+
+def test_queued_callbacks_are_handled_once(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    handled: List[str] = []
+
+    async def handle(callback_data: LnBitsCallbackData) -> None:
+        handled.append(callback_data.payment_hash)
+
+    async def run() -> None:
+        worker = CallbackQueueWorker(storage, handle, 2, poll_interval=10)
+        await worker.start()
+
+        enqueued = [await worker.enqueue(callback_data(payment_hash)) for payment_hash in ["A", "B", "A"]]
+        assert enqueued == [True, True, False]
+
+        await asyncio.wait_for(wait_until_handled(handled, 2), 1)
+        await worker.close()
+
+        assert await storage.take_callback(MAX_ATTEMPTS) is None
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    assert sorted(handled) == ["A", "B"]
+
+
+def test_failed_callback_is_retried(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    handled: List[str] = []
+
+    async def handle(callback_data: LnBitsCallbackData) -> None:
+        handled.append(callback_data.payment_hash)
+        if len(handled) < 3:
+            raise Exception("LNbits is down")
+
+    async def run() -> None:
+        worker = CallbackQueueWorker(storage, handle, 1, retry_backoff=0.001)
+        await storage.enqueue_callback(PaymentHash("A"), callback_body("A"))
+        await worker.start()
+
+        await asyncio.wait_for(wait_until_handled(handled, 3), 1)
+        await worker.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    assert handled == ["A", "A", "A"]
+
+
+def test_worker_keeps_running_after_storage_errors(db_path: str) -> None:
+    storage = FlakyStorage(datetime.now, db_path, readers=1)
+    storage.create_tables()
+    handled: List[str] = []
+
+    async def handle(callback_data: LnBitsCallbackData) -> None:
+        handled.append(callback_data.payment_hash)
+
+    async def run() -> None:
+        worker = CallbackQueueWorker(storage, handle, 1, retry_backoff=0.001)
+        await storage.enqueue_callback(PaymentHash("A"), callback_body("A"))
+        await worker.start()
+
+        await asyncio.wait_for(wait_until_handled(handled, 1), 1)
+        await worker.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    assert storage.failures == 0
+    assert handled == ["A"]
+
+
+def test_last_failed_attempt_finishes_without_backoff(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    handled: List[str] = []
+
+    async def handle(callback_data: LnBitsCallbackData) -> None:
+        handled.append(callback_data.payment_hash)
+        raise Exception("LNbits is down")
+
+    async def run() -> None:
+        worker = CallbackQueueWorker(storage, handle, 1, max_attempts=1, retry_backoff=10)
+        await storage.enqueue_callback(PaymentHash("A"), callback_body("A"))
+        await worker.start()
+
+        await asyncio.wait_for(wait_until_handled(handled, 1), 1)
+        while worker.in_flight > 0:
+            await asyncio.sleep(0.001)
+        await asyncio.wait_for(worker.close(), 1)
+
+        # Marked failed, not left in flight
+        assert await storage.recover_callbacks(MAX_ATTEMPTS) == (0, 0)
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+
+def test_done_callbacks_are_pruned_after_the_retention(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    handled: List[str] = []
+
+    async def handle(callback_data: LnBitsCallbackData) -> None:
+        handled.append(callback_data.payment_hash)
+
+    async def run() -> None:
+        worker = CallbackQueueWorker(storage, handle, 1, poll_interval=0.01, retention=0)
+        await worker.start()
+        assert await worker.enqueue(callback_data("A"))
+        await asyncio.wait_for(wait_until_handled(handled, 1), 1)
+
+        # Deduplicated until pruned
+        async def enqueue_again() -> None:
+            while not await worker.enqueue(callback_data("A")):
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(enqueue_again(), 1)
+        await asyncio.wait_for(wait_until_handled(handled, 2), 1)
+        await worker.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    assert handled == ["A", "A"]
+
+
+def test_in_flight_callbacks_are_recovered_on_start(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    handled: List[str] = []
+
+    async def handle(callback_data: LnBitsCallbackData) -> None:
+        handled.append(callback_data.payment_hash)
+
+    async def run() -> None:
+        await storage.enqueue_callback(PaymentHash("A"), callback_body("A"))
+        # Taken by a worker that crashed before finishing it
+        await storage.take_callback(MAX_ATTEMPTS)
+
+        worker = CallbackQueueWorker(storage, handle, 1)
+        await worker.start()
+
+        await asyncio.wait_for(wait_until_handled(handled, 1), 1)
+        await worker.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    assert handled == ["A"]
+
+
+def test_callback_crashing_every_start_fails_after_max_attempts(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    handled: List[str] = []
+
+    async def handle(callback_data: LnBitsCallbackData) -> None:
+        handled.append(callback_data.payment_hash)
+        await asyncio.sleep(10)
+
+    async def run() -> None:
+        await storage.enqueue_callback(PaymentHash("A"), callback_body("A"))
+
+        # The server dies while A is in flight, every start takes it again
+        for _ in range(2):
+            worker = CallbackQueueWorker(storage, handle, 1, max_attempts=2, poll_interval=10)
+            await worker.start()
+            while worker.in_flight == 0:
+                await asyncio.sleep(0.001)
+            await worker.close()
+
+        worker = CallbackQueueWorker(storage, handle, 1, max_attempts=2, poll_interval=10)
+        await worker.start()
+        await asyncio.sleep(0.05)
+        await worker.close()
+
+        assert await storage.take_callback(MAX_ATTEMPTS) is None
+        assert await storage.recover_callbacks(MAX_ATTEMPTS) == (0, 0)
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    assert handled == ["A", "A"]
+
+
+def test_close_drains_in_flight_callbacks_and_leaves_queued_ones(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    handled: List[str] = []
+
+    async def handle(callback_data: LnBitsCallbackData) -> None:
+        await asyncio.sleep(0.05)
+        handled.append(callback_data.payment_hash)
+
+    async def run() -> None:
+        worker = CallbackQueueWorker(storage, handle, 1, poll_interval=10)
+        await worker.start()
+        await worker.enqueue(callback_data("A"))
+        while worker.in_flight == 0:
+            await asyncio.sleep(0.001)
+        await worker.enqueue(callback_data("B"))
+
+        await worker.close(drain_timeout=1)
+
+        assert handled == ["A"]
+        # Left for the next start
+        taken = await storage.take_callback(MAX_ATTEMPTS)
+        assert taken is not None and taken[0] == "B"
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+
+def test_close_cancels_callbacks_still_running_at_the_deadline(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+
+    async def handle(callback_data: LnBitsCallbackData) -> None:
+        await asyncio.sleep(10)
+
+    async def run() -> None:
+        worker = CallbackQueueWorker(storage, handle, 1, poll_interval=10)
+        await worker.start()
+        await worker.enqueue(callback_data("A"))
+        while worker.in_flight == 0:
+            await asyncio.sleep(0.001)
+
+        await asyncio.wait_for(worker.close(drain_timeout=0.05), 1)
+
+        # Still in flight, recovered by the next start
+        assert await storage.take_callback(MAX_ATTEMPTS) is None
+        assert await storage.recover_callbacks(MAX_ATTEMPTS) == (1, 0)
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+
+def test_pending_callbacks_are_counted_while_taking(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+
+    async def handle(callback_data: LnBitsCallbackData) -> None:
+        await asyncio.sleep(10)
+
+    async def run() -> None:
+        for payment_hash in ["A", "B", "C"]:
+            await storage.enqueue_callback(PaymentHash(payment_hash), callback_body(payment_hash))
+
+        worker = CallbackQueueWorker(storage, handle, 1, poll_interval=10)
+        await worker.start()
+        while worker.in_flight == 0:
+            await asyncio.sleep(0.001)
+
+        assert worker.pending == 2
+        await worker.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
@@ -1,13 +1,16 @@
 from decimal import Decimal
 from typing import Optional
 
+from claim.statuses import Status, amount_too_low_status
 from lnbits import AmountSats, LnBitsCallbackData
 
 
-def payment_callback_validation(callback_data: LnBitsCallbackData, expected_sats_amount: AmountSats) -> Optional[str]:
+def payment_callback_validation(
+    callback_data: LnBitsCallbackData, expected_sats_amount: AmountSats
+) -> Optional[Status]:
     amount = AmountSats(Decimal(callback_data.amount))
 
-    if expected_sats_amount < expected_sats_amount:
-        return f"Amount send ${amount} is less then ${expected_sats_amount}"
+    if amount < expected_sats_amount:
+        return amount_too_low_status(amount, expected_sats_amount)
 
     return None
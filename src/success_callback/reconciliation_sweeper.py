@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time
+from decimal import Decimal
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from claim.async_claim_storage import AsyncClaimStorage
+from claim.claim import DonationTokenClaim
+from lnbits import AmountSats, LnBitsApi, LnBitsCallbackData, LnBitsPaymentDetails, LnBitsPaymentLinkId, PaymentHash
+from metrics import LOCK_WAIT_SECONDS
+
+
+class SweepReport:
+    def __init__(self) -> None:
+        self.duration = 0.0
+        self.scanned = 0
+        self.recovered = 0
+        self.expired = 0
+
+    def __str__(self) -> str:
+        return (
+            f"{self.scanned} pending claims scanned in {self.duration:.2f}s, "
+            + f"{self.recovered} recovered, {self.expired} expired"
+        )
+
+
+# Spaces out LNbits calls to at most calls_per_second
+class _RateLimiter:
+    def __init__(self, calls_per_second: float) -> None:
+        self._interval = 1 / calls_per_second if calls_per_second > 0 else 0
+        self._next_call = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            delay = self._next_call - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_call = time.monotonic() + self._interval
+
+
+# The wallet's pay link payments as LNbits lists them, newest first, grouped by pay link with a paid payment kept over
+# a pending one. Older pages are read on demand and shared by the lookups of one sweep.
+class _WalletPayments:
+    def __init__(self, ln_bits_api: LnBitsApi, rate_limiter: _RateLimiter, page_size: int) -> None:
+        self._ln_bits_api = ln_bits_api
+        self._rate_limiter = rate_limiter
+        self._page_size = page_size
+        self._by_link: Dict[LnBitsPaymentLinkId, LnBitsPaymentDetails] = {}
+        self._offset = 0
+        self._oldest: Optional[int] = None
+        self._exhausted = False
+        self._lock = asyncio.Lock()
+
+    def get(self, link_id: LnBitsPaymentLinkId) -> Optional[LnBitsPaymentDetails]:
+        return self._by_link.get(link_id)
+
+    async def read_page(self) -> None:
+        await self._rate_limiter.wait()
+        page = await self._ln_bits_api.get_payments(self._page_size, self._offset)
+        self._offset += self._page_size
+        # A page without pay link payments ends the lookups too, its claims are looked up again by the next sweep
+        self._exhausted = len(page) == 0
+        for payment in page:
+            known = self._by_link.get(payment.extra.link)
+            if known is None or (known.pending and not payment.pending):
+                self._by_link[payment.extra.link] = payment
+            self._oldest = payment.time if self._oldest is None else min(self._oldest, payment.time)
+
+    # Reads older pages until a paid payment of the pay link is found or the pages reach back before created_at
+    async def find_paid(self, link_id: LnBitsPaymentLinkId, created_at: float) -> Optional[LnBitsPaymentDetails]:
+        async with self._lock:
+            while True:
+                payment = self._by_link.get(link_id)
+                if payment is not None and not payment.pending:
+                    return payment
+                if self._exhausted or (self._oldest is not None and self._oldest < created_at):
+                    return None
+                await self.read_page()
+
+
+# Finds pending claims whose webhook never arrived. Paid pay links are found in the latest wallet payments and
+# queued as if LNbits had sent the webhook, so they go through the same validation and signing as CallbackHandler.
+# Every other claim has its pay link looked up: when LNbits served an invoice for it, older wallet payments are read
+# until its payment is found, otherwise the claim is kept. Claims of pay links without an invoice are dropped after
+# expire_after seconds and get their pay link deleted.
+class ReconciliationSweeper:
+    def __init__(
+        self,
+        claim_storage: AsyncClaimStorage,
+        ln_bits_api: LnBitsApi,
+        enqueue: Callable[[LnBitsCallbackData], Awaitable[bool]],
+        min_age: float,
+        expire_after: float,
+        page_size: int = 500,
+        payments_limit: int = 500,
+        concurrency: int = 4,
+        calls_per_second: float = 5,
+        now: Callable[[], float] = time.time,
+    ) -> None:
+        self._claim_storage = claim_storage
+        self._ln_bits_api = ln_bits_api
+        self._enqueue = enqueue
+        self._min_age = min_age
+        self._expire_after = expire_after
+        self._page_size = page_size
+        self._payments_limit = payments_limit
+        self._concurrency = asyncio.Semaphore(concurrency)
+        self._rate_limiter = _RateLimiter(calls_per_second)
+        self._now = now
+        self._task: Optional[asyncio.Task[None]] = None
+
+    def start(self, interval: float) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._run(interval))
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                logging.info(f"ReconciliationSweeper: {await self.sweep()}")
+            except Exception:
+                logging.exception("ReconciliationSweeper: sweep failed")
+
+    async def sweep(self) -> SweepReport:
+        report = SweepReport()
+        started = time.perf_counter()
+
+        payments = _WalletPayments(self._ln_bits_api, self._rate_limiter, self._payments_limit)
+        await payments.read_page()
+
+        after = ""
+        while True:
+            page = await self._claim_storage.get_pending_claims(after, self._page_size)
+            report.scanned += len(page)
+
+            looked_up: List[Awaitable[None]] = []
+            for claim, link_id, created_at in page:
+                # Without a status its age is unknown
+                if created_at is None:
+                    continue
+                age = self._now() - created_at
+                if age < self._min_age:
+                    continue
+
+                payment = payments.get(link_id)
+                if payment is not None and not payment.pending:
+                    if await self._enqueue(self._to_callback_data(link_id, payment)):
+                        report.recovered += 1
+                else:
+                    looked_up.append(self._look_up(report, payments, claim, link_id, created_at, age))
+
+            await asyncio.gather(*looked_up)
+
+            if len(page) < self._page_size:
+                break
+            after = page[-1][0]
+
+        report.duration = time.perf_counter() - started
+
+        return report
+
+    async def _look_up(
+        self,
+        report: SweepReport,
+        payments: _WalletPayments,
+        claim: DonationTokenClaim,
+        link_id: LnBitsPaymentLinkId,
+        created_at: float,
+        age: float,
+    ) -> None:
+        waiting = time.perf_counter()
+        async with self._concurrency:
+            await self._rate_limiter.wait()
+            LOCK_WAIT_SECONDS.labels("sweeper").observe(time.perf_counter() - waiting)
+            try:
+                served = (await self._ln_bits_api.get_payment_link(link_id)).served_pr > 0
+                # An invoice still in flight is left to its webhook or the next sweep
+                payment = await payments.find_paid(link_id, created_at) if served else None
+            except Exception as e:
+                logging.warning(f"ReconciliationSweeper: looking up pay link {link_id} failed: {e!r}")
+                return
+
+            if payment is not None:
+                if await self._enqueue(self._to_callback_data(link_id, payment)):
+                    report.recovered += 1
+                return
+            if served or self._expire_after <= 0 or age < self._expire_after:
+                return
+
+            # Paid since the page was read
+            if not await self._claim_storage.expire_claim(claim):
+                return
+
+            await self._rate_limiter.wait()
+            try:
+                await self._ln_bits_api.delete_pay_link(link_id)
+            except Exception as e:
+                logging.warning(f"ReconciliationSweeper: deleting pay link {link_id} of expired claim failed: {e!r}")
+
+        report.expired += 1
+
+    @staticmethod
+    def _to_callback_data(link_id: LnBitsPaymentLinkId, payment: LnBitsPaymentDetails) -> LnBitsCallbackData:
+        return LnBitsCallbackData(
+            payment_hash=PaymentHash(payment.payment_hash),
+            payment_request=payment.bolt11,
+            amount=AmountSats(Decimal(payment.amount // 1000)),
+            comment=payment.extra.comment,
+            lnurlp=link_id,
+        )
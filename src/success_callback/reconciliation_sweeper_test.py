@@ -0,0 +1,252 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+from claim.async_claim_storage import AsyncSqlLiteClaimStorage
+from claim.claim import DonationTokenClaim
+from claim.donation_key import DonationKey
+from lnbits import (
+    LnBitsApi,
+    LnBitsApiKey,
+    LnBitsCallbackData,
+    LnBitsPaymentDetails,
+    LnBitsPaymentDetailsExtra,
+    LnBitsPaymentLinkGet,
+    LnBitsPaymentLinkId,
+    LnUrl,
+    PaymentHash,
+)
+from success_callback.reconciliation_sweeper import ReconciliationSweeper
+
+CREATED_AT = 1000.0
+DAY = 24 * 60 * 60
+
+
+def create_fresh_storage(db_path: str) -> AsyncSqlLiteClaimStorage:
+    storage = AsyncSqlLiteClaimStorage(lambda: datetime.fromtimestamp(CREATED_AT), db_path, readers=1)
+    storage.create_tables()
+
+    return storage
+
+
+# Paid after the claims were created, pending payments get their own hash
+def payment(link: int, pending: bool) -> LnBitsPaymentDetails:
+    return LnBitsPaymentDetails(
+        checking_id=str(link),
+        pending=pending,
+        amount=1000000,
+        fee=0,
+        memo="",
+        time=int(CREATED_AT) + 60,
+        bolt11="lnbc",
+        preimage="0" * 64,
+        payment_hash=f"pending-{link}" if pending else f"hash-{link}",
+        extra=LnBitsPaymentDetailsExtra(tag="lnurlp", link=LnBitsPaymentLinkId(link), comment=None, extra=""),
+        wallet_id="wallet",
+    )
+
+
+class FakeLnBitsApi(LnBitsApi):
+    def __init__(self, served: Optional[Dict[LnBitsPaymentLinkId, int]] = None) -> None:
+        super().__init__(aiohttp.ClientSession(), "", LnBitsApiKey(""))
+        self.deleted: List[LnBitsPaymentLinkId] = []
+        self.served = served if served is not None else {}
+        self.payments = [payment(1, False), payment(2, True)]
+        self.offsets: List[int] = []
+        self.on_get_payment_link: Callable[[LnBitsPaymentLinkId], Awaitable[None]] = lambda id: asyncio.sleep(0)
+
+    async def get_payments(self, limit: int, offset: int = 0) -> List[LnBitsPaymentDetails]:
+        self.offsets.append(offset)
+
+        return self.payments[offset : offset + limit]
+
+    async def get_payment_link(self, payId: LnBitsPaymentLinkId) -> LnBitsPaymentLinkGet:
+        await self.on_get_payment_link(payId)
+
+        return LnBitsPaymentLinkGet(
+            id=payId,
+            wallet="wallet",
+            description="",
+            min=1000,
+            max=1000000,
+            served_meta=0,
+            served_pr=self.served.get(payId, 0),
+            webhook_url=None,
+            comment_chars=0,
+            lnurl=LnUrl(f"LNURL{payId}"),
+        )
+
+    async def delete_pay_link(self, payId: LnBitsPaymentLinkId) -> None:
+        self.deleted.append(payId)
+
+
+def test_sweep_recovers_paid_and_expires_stale_claims(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    enqueued: List[LnBitsCallbackData] = []
+
+    async def enqueue(callback_data: LnBitsCallbackData) -> bool:
+        enqueued.append(callback_data)
+        return True
+
+    async def run() -> None:
+        ln_bits_api = FakeLnBitsApi({LnBitsPaymentLinkId(2): 1})
+        for i in range(1, 6):
+            await storage.add(DonationTokenClaim(str(i)), LnBitsPaymentLinkId(i))
+
+        sweeper = ReconciliationSweeper(
+            storage, ln_bits_api, enqueue, 60, DAY, page_size=2, calls_per_second=0, now=lambda: CREATED_AT + 2 * DAY
+        )
+        report = await sweeper.sweep()
+        await ln_bits_api._session.close()
+
+        assert report.scanned == 5
+        assert report.recovered == 1
+        # Pending payment of link 2 is left to LNbits
+        assert report.expired == 3
+        assert sorted(ln_bits_api.deleted) == [3, 4, 5]
+        assert [p[0] for p in await storage.get_pending_claims("", 10)] == ["1", "2"]
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    assert [c.lnurlp for c in enqueued] == [1]
+    assert enqueued[0].payment_hash == "hash-1"
+    assert enqueued[0].amount == 1000
+
+
+def test_sweep_finds_payments_older_than_the_latest(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    enqueued: List[LnBitsCallbackData] = []
+
+    async def enqueue(callback_data: LnBitsCallbackData) -> bool:
+        enqueued.append(callback_data)
+        return True
+
+    async def run() -> None:
+        ln_bits_api = FakeLnBitsApi({LnBitsPaymentLinkId(3): 1, LnBitsPaymentLinkId(4): 1})
+        ln_bits_api.payments = [payment(1, False), payment(2, False), payment(4, True), payment(3, False)]
+        for i in range(3, 6):
+            await storage.add(DonationTokenClaim(str(i)), LnBitsPaymentLinkId(i))
+
+        sweeper = ReconciliationSweeper(
+            storage, ln_bits_api, enqueue, 60, 0, payments_limit=2, calls_per_second=0, now=lambda: CREATED_AT + DAY
+        )
+        report = await sweeper.sweep()
+        await ln_bits_api._session.close()
+
+        assert report.recovered == 1
+        assert report.expired == 0
+        # Pages are shared by the lookups, the last one is empty
+        assert ln_bits_api.offsets == [0, 2, 4]
+        assert [p[0] for p in await storage.get_pending_claims("", 10)] == ["3", "4", "5"]
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    assert [c.payment_hash for c in enqueued] == ["hash-3"]
+    assert enqueued[0].amount == 1000
+
+
+def test_paid_payment_is_not_hidden_by_a_newer_pending_one(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    enqueued: List[LnBitsCallbackData] = []
+
+    async def enqueue(callback_data: LnBitsCallbackData) -> bool:
+        enqueued.append(callback_data)
+        return True
+
+    async def run() -> None:
+        ln_bits_api = FakeLnBitsApi()
+        ln_bits_api.payments = [payment(7, True), payment(7, False)]
+        await storage.add(DonationTokenClaim("7"), LnBitsPaymentLinkId(7))
+
+        sweeper = ReconciliationSweeper(storage, ln_bits_api, enqueue, 60, DAY, now=lambda: CREATED_AT + 2 * DAY)
+        report = await sweeper.sweep()
+        await ln_bits_api._session.close()
+
+        assert report.recovered == 1
+        assert report.expired == 0
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    assert [c.payment_hash for c in enqueued] == ["hash-7"]
+
+
+def test_sweep_keeps_claims_that_might_be_paid(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+
+    async def enqueue(callback_data: LnBitsCallbackData) -> bool:
+        return True
+
+    async def run() -> None:
+        # An invoice of link 4 was served, claim 5 is paid while the sweep looks up its pay link
+        ln_bits_api = FakeLnBitsApi({LnBitsPaymentLinkId(4): 1})
+
+        async def pay_claim_5(id: LnBitsPaymentLinkId) -> None:
+            if id == 5:
+                await storage.save_success(DonationTokenClaim("5"), PaymentHash("hash-5"), DonationKey("5/XY12=="))
+
+        ln_bits_api.on_get_payment_link = pay_claim_5
+        for i in range(3, 6):
+            await storage.add(DonationTokenClaim(str(i)), LnBitsPaymentLinkId(i))
+
+        sweeper = ReconciliationSweeper(
+            storage, ln_bits_api, enqueue, 60, DAY, calls_per_second=0, now=lambda: CREATED_AT + 2 * DAY
+        )
+        report = await sweeper.sweep()
+        await ln_bits_api._session.close()
+
+        assert report.scanned == 4
+        assert report.expired == 1
+        assert ln_bits_api.deleted == [3]
+        assert [p[0] for p in await storage.get_pending_claims("", 10)] == ["4", "6"]
+        status = await storage.get_claim_status(DonationTokenClaim("5"))
+        assert status is not None and "expired" not in str(status[1])
+
+    # Without statuses, its age is unknown
+    connection = sqlite3.connect(db_path)
+    with connection:
+        connection.execute("INSERT INTO claims (claim, lnbit_payment_link_id) VALUES ('6', 6)")
+    connection.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+
+def test_young_claims_are_left_to_their_webhook(db_path: str) -> None:
+    storage = create_fresh_storage(db_path)
+    enqueued: List[LnBitsCallbackData] = []
+
+    async def enqueue(callback_data: LnBitsCallbackData) -> bool:
+        enqueued.append(callback_data)
+        return True
+
+    async def run() -> None:
+        ln_bits_api = FakeLnBitsApi()
+        await storage.add(DonationTokenClaim("1"), LnBitsPaymentLinkId(1))
+
+        sweeper = ReconciliationSweeper(storage, ln_bits_api, enqueue, 60, DAY, now=lambda: CREATED_AT + 10)
+        report = await sweeper.sweep()
+        await ln_bits_api._session.close()
+
+        assert report.scanned == 1
+        assert report.recovered == 0
+
+    try:
+        asyncio.run(run())
+    finally:
+        storage.close()
+
+    assert enqueued == []
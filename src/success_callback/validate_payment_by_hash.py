@@ -1,20 +1,21 @@
 from typing import Dict, Optional
 
+from claim.statuses import NOT_PAID_STATUS, Status, amount_too_low_status, wrong_payment_link_status
 from lnbits import AmountSats, LnBitsPaymentLinkId, LnBitsPayment
 
 
 def validate_payment_by_hash(
     payment: LnBitsPayment, expected_id: LnBitsPaymentLinkId, expected_amount: AmountSats
-) -> Optional[str]:
+) -> Optional[Status]:
     if not payment.paid:
-        return f"Callback received, but payment not paid."
+        return NOT_PAID_STATUS
 
     payment_link_id = payment.details.extra.link
 
     if expected_id != payment_link_id:
-        return f"PaymentLinkId ({payment_link_id}) is not as expected ({expected_id})"
+        return wrong_payment_link_status(payment_link_id, expected_id)
 
     if payment.details.amount < expected_amount:
-        return f"Amount send ${payment.details.amount} is less then ${expected_amount}"
+        return amount_too_low_status(payment.details.amount, expected_amount)
 
     return None
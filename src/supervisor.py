@@ -0,0 +1,70 @@
+import logging
+import multiprocessing
+import signal
+import time
+from multiprocessing.process import BaseProcess
+from types import FrameType
+from typing import Callable, Dict, Optional
+
+
+def _run_worker(target: Callable[[int], None], worker: int) -> None:
+    # Forked children inherit the supervisor's handlers, which would keep them from stopping. Workers that drain on
+    # SIGTERM install their own handler in target.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    target(worker)
+
+
+# Pre-fork mode: runs target(worker) in `workers` forked processes, which share the listening port through
+# SO_REUSEPORT, and restarts any of them that exits. SIGTERM or SIGINT stops the workers and the supervisor, workers
+# still running after stop_timeout seconds are killed.
+class Supervisor:
+    def __init__(
+        self, workers: int, target: Callable[[int], None], restart_delay: float = 1, stop_timeout: float = 30
+    ) -> None:
+        self._workers = workers
+        self._target = target
+        self._restart_delay = restart_delay
+        self._stop_timeout = stop_timeout
+        self._context = multiprocessing.get_context("fork")
+        self._stopping = False
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+        self.supervise()
+
+    def stop(self) -> None:
+        self._stopping = True
+
+    def _on_signal(self, signum: int, frame: Optional[FrameType]) -> None:
+        logging.info(f"Supervisor: got signal {signum}, stopping workers")
+        self.stop()
+
+    def supervise(self) -> None:
+        processes: Dict[int, BaseProcess] = {}
+
+        try:
+            while not self._stopping:
+                for worker in range(self._workers):
+                    process = processes.get(worker)
+                    if process is not None and process.is_alive():
+                        continue
+
+                    if process is not None:
+                        logging.warning(f"Supervisor: worker {worker} exited with {process.exitcode}, restarting")
+                    processes[worker] = self._context.Process(target=_run_worker, args=(self._target, worker))
+                    processes[worker].start()
+
+                time.sleep(self._restart_delay)
+        finally:
+            for process in processes.values():
+                process.terminate()
+            deadline = time.monotonic() + self._stop_timeout
+            for process in processes.values():
+                process.join(max(0.0, deadline - time.monotonic()))
+            for worker, process in processes.items():
+                if process.is_alive():
+                    logging.warning(f"Supervisor: worker {worker} did not stop in {self._stop_timeout} s, killing it")
+                    process.kill()
+                    process.join()
@@ -0,0 +1,45 @@
+import multiprocessing
+import signal
+import threading
+import time
+
+from supervisor import Supervisor
+
+context = multiprocessing.get_context("fork")
+started: "multiprocessing.Queue[int]" = context.Queue()
+ignoring: "multiprocessing.Queue[int]" = context.Queue()
+
+
+def exit_right_away(worker: int) -> None:
+    started.put(worker)
+
+
+def ignore_sigterm(worker: int) -> None:
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    ignoring.put(worker)
+    time.sleep(60)
+
+
+def test_supervisor_restarts_exited_workers() -> None:
+    supervisor = Supervisor(2, exit_right_away, restart_delay=0.01)
+    thread = threading.Thread(target=supervisor.supervise)
+    thread.start()
+
+    starts = [started.get(timeout=10) for _ in range(6)]
+    supervisor.stop()
+    thread.join()
+
+    assert starts.count(0) >= 2
+    assert starts.count(1) >= 2
+
+
+def test_workers_not_stopping_in_time_are_killed() -> None:
+    supervisor = Supervisor(1, ignore_sigterm, restart_delay=0.01, stop_timeout=0.1)
+    thread = threading.Thread(target=supervisor.supervise)
+    thread.start()
+
+    ignoring.get(timeout=10)
+    supervisor.stop()
+    thread.join(10)
+
+    assert not thread.is_alive()
@@ -0,0 +1,50 @@
+import asyncio
+from typing import Annotated, AsyncIterator, List, Tuple
+from pydantic import BaseModel, StringConstraints
+
+from claim.claim import CLAIM_MAX_LENGTH, DonationTokenClaim
+from claim.donation_key import DonationKey
+from metrics import REGISTRY
+from sign.sign import DonationKeySigner, chunks
+
+# A 4096 bit key signs to 684 base64 characters
+DONATION_KEY_MAX_LENGTH = 1024
+
+DONATION_KEYS_VERIFIED = REGISTRY.counter("donation_keys_verified", "Donation keys verified in bulk", ["valid"])
+
+
+class VerifyKeyApi(BaseModel):
+    claim: Annotated[DonationTokenClaim, StringConstraints(min_length=1, max_length=CLAIM_MAX_LENGTH)]
+    key: Annotated[DonationKey, StringConstraints(max_length=DONATION_KEY_MAX_LENGTH)]
+
+
+class VerifyKeysApi(BaseModel):
+    keys: List[VerifyKeyApi]
+
+
+# Checks keys against the public key only, so keys issued by any worker or replica verify without a storage lookup.
+# All chunks are verified on the sign executor at once, results are yielded per chunk in the order of the request.
+class VerifyKeysHandler:
+    def __init__(self, donation_key_signer: DonationKeySigner, chunk_size: int) -> None:
+        self._donation_key_signer = donation_key_signer
+        self._chunk_size = chunk_size
+
+    async def handle(self, verify_keys_api: VerifyKeysApi) -> AsyncIterator[List[Tuple[DonationTokenClaim, bool]]]:
+        requested = chunks(verify_keys_api.keys, self._chunk_size)
+        verifications = [
+            asyncio.ensure_future(
+                self._donation_key_signer.verify_many_async([(key.claim, key.key) for key in chunk], len(chunk))
+            )
+            for chunk in requested
+        ]
+
+        try:
+            for chunk, verification in zip(requested, verifications):
+                valid = await verification
+                DONATION_KEYS_VERIFIED.labels("true").inc(sum(valid))
+                DONATION_KEYS_VERIFIED.labels("false").inc(len(valid) - sum(valid))
+                yield [(key.claim, key_valid) for key, key_valid in zip(chunk, valid)]
+        finally:
+            # The client went away, chunks not yet started are dropped
+            for verification in verifications:
+                verification.cancel()
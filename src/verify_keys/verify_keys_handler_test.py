@@ -0,0 +1,29 @@
+import asyncio
+import os
+from typing import List, Tuple
+
+from claim.claim import DonationTokenClaim
+from claim.donation_key import DonationKey
+from sign.sign import ALGORITHM_RSA_SHA1, DonationKeySigner, load_signing_key
+from verify_keys.verify_keys_handler import VerifyKeyApi, VerifyKeysApi, VerifyKeysHandler
+
+private_key_path = f"{os.path.dirname(__file__)}/../sign/test_privatekey.pem"
+
+
+def test_verify_keys_in_chunks() -> None:
+    signer = DonationKeySigner(load_signing_key("1", ALGORITHM_RSA_SHA1, private_key_path))
+    claims = [DonationTokenClaim(f"claim {i}") for i in range(5)]
+    keys = [VerifyKeyApi(claim=claim, key=DonationKey(signer.sign(claim))) for claim in claims]
+    # Key of another claim and one that is no base64
+    keys[1] = VerifyKeyApi(claim=claims[1], key=keys[0].key)
+    keys[3] = VerifyKeyApi(claim=claims[3], key=DonationKey("?"))
+
+    async def verify() -> List[List[Tuple[DonationTokenClaim, bool]]]:
+        handler = VerifyKeysHandler(signer, 2)
+        return [chunk async for chunk in handler.handle(VerifyKeysApi(keys=keys))]
+
+    assert asyncio.run(verify()) == [
+        [(claims[0], True), (claims[1], False)],
+        [(claims[2], True), (claims[3], False)],
+        [(claims[4], True)],
+    ]